@@ -30,19 +30,64 @@ CREATE TABLE IF NOT EXISTS public.deter_rt
     class_name character varying(256) NOT NULL,
     view_date date NOT NULL,
     area_km double precision NOT NULL,
+    lon double precision,
+    lat double precision,
     created_at date NOT NULL DEFAULT (now())::date,
     tile_id character varying(256) NOT NULL,
     detection_date date,
-    CONSTRAINT deter_rt_pkey PRIMARY KEY (uuid)
-);
+    batch_id integer,
+    geom_hash uuid GENERATED ALWAYS AS (md5(ST_AsBinary(ST_Normalize(ST_SnapToGrid(geom, 0.000001))))::uuid) STORED,
+    CONSTRAINT deter_rt_pkey PRIMARY KEY (uuid, view_date)
+) PARTITION BY RANGE (view_date);
+
+-- one partition per month of view_date, created by the pipeline before writing,
+-- the default partition only holds rows written before their month exists
+
+CREATE TABLE IF NOT EXISTS public.deter_rt_default PARTITION OF public.deter_rt DEFAULT;
 
 -- DROP INDEX IF EXISTS public.deter_rt_geom_idx;
 
 CREATE INDEX IF NOT EXISTS deter_rt_geom_idx
     ON public.deter_rt USING gist
-    (geom)
-    WITH (buffering=auto)
-    TABLESPACE pg_default;
+    (geom);
+
+-- DROP INDEX IF EXISTS public.deter_rt_geom_hash_idx;
+
+CREATE INDEX IF NOT EXISTS deter_rt_geom_hash_idx
+    ON public.deter_rt USING btree
+    (geom_hash, view_date);
+
+-- DROP INDEX IF EXISTS public.deter_rt_batch_id_idx;
+
+CREATE INDEX IF NOT EXISTS deter_rt_batch_id_idx
+    ON public.deter_rt USING btree
+    (batch_id);
+
+-- DROP INDEX IF EXISTS public.deter_rt_tile_id_idx;
+
+CREATE INDEX IF NOT EXISTS deter_rt_tile_id_idx
+    ON public.deter_rt USING btree
+    (tile_id, view_date);
+
+-- DROP TABLE IF EXISTS public.load_batch;
+
+CREATE TABLE IF NOT EXISTS public.load_batch
+(
+    id serial,
+    status character varying(16) NOT NULL DEFAULT 'open',
+    rows integer,
+    opened_at timestamp without time zone NOT NULL DEFAULT now(),
+    transformed_at timestamp without time zone,
+    validated_at timestamp without time zone,
+    CONSTRAINT load_batch_pkey PRIMARY KEY (id)
+);
+
+-- only one batch is open at a time
+CREATE UNIQUE INDEX IF NOT EXISTS load_batch_open_idx
+    ON public.load_batch USING btree
+    (status)
+    TABLESPACE pg_default
+    WHERE status = 'open';
 
 
 -- DROP TABLE IF EXISTS public.deter_otico;
@@ -53,17 +98,47 @@ CREATE TABLE IF NOT EXISTS public.deter_otico
     geom geometry(MultiPolygon,4674) NOT NULL,
     view_date date NOT NULL,
     class_name character varying(256) NOT NULL,
-    CONSTRAINT deter_otico_pkey PRIMARY KEY (id)
-);
+    CONSTRAINT deter_otico_pkey PRIMARY KEY (id, view_date)
+) PARTITION BY RANGE (view_date);
+
+CREATE TABLE IF NOT EXISTS public.deter_otico_default PARTITION OF public.deter_otico DEFAULT;
 
 -- DROP INDEX IF EXISTS public.deter_otico_geom_idx;
 
 CREATE INDEX IF NOT EXISTS deter_otico_geom_idx
     ON public.deter_otico USING gist
+    (geom);
+
+-- DROP INDEX IF EXISTS public.deter_otico_view_date_idx;
+
+CREATE INDEX IF NOT EXISTS deter_otico_view_date_idx
+    ON public.deter_otico USING btree
+    (view_date);
+
+-- DROP TABLE IF EXISTS public.deter_otico_coverage;
+
+-- the optical DETER dissolved by class and subdivided in small pieces, kept up to date by the collector
+CREATE TABLE IF NOT EXISTS public.deter_otico_coverage
+(
+    id serial,
+    class_name character varying(256) NOT NULL,
+    geom geometry(MultiPolygon,4674) NOT NULL,
+    CONSTRAINT deter_otico_coverage_pkey PRIMARY KEY (id)
+);
+
+-- DROP INDEX IF EXISTS public.deter_otico_coverage_geom_idx;
+
+CREATE INDEX IF NOT EXISTS deter_otico_coverage_geom_idx
+    ON public.deter_otico_coverage USING gist
     (geom)
     WITH (buffering=auto)
     TABLESPACE pg_default;
 
+CREATE INDEX IF NOT EXISTS deter_otico_coverage_class_name_idx
+    ON public.deter_otico_coverage USING btree
+    (class_name)
+    TABLESPACE pg_default;
+
 -- DROP TABLE IF EXISTS public.deter_rt_validados;
 
 CREATE TABLE IF NOT EXISTS public.deter_rt_validados
@@ -138,6 +213,89 @@ CREATE TABLE IF NOT EXISTS public.input_data
         INCLUDE(last_modified)
 );
 
+-- DROP INDEX IF EXISTS public.input_data_file_name_idx;
+
+CREATE INDEX IF NOT EXISTS input_data_file_name_idx
+    ON public.input_data USING btree
+    (file_name)
+    TABLESPACE pg_default;
+
+-- DROP INDEX IF EXISTS public.input_data_file_stem_idx;
+
+CREATE INDEX IF NOT EXISTS input_data_file_stem_idx
+    ON public.input_data USING btree
+    (split_part(file_name, '.', 1))
+    TABLESPACE pg_default;
+
+-- DROP INDEX IF EXISTS public.input_data_import_date_idx;
+
+CREATE INDEX IF NOT EXISTS input_data_import_date_idx
+    ON public.input_data USING btree
+    (import_date)
+    TABLESPACE pg_default;
+
+-- DROP INDEX IF EXISTS public.input_data_last_modified_idx;
+
+CREATE INDEX IF NOT EXISTS input_data_last_modified_idx
+    ON public.input_data USING btree
+    (last_modified)
+    TABLESPACE pg_default;
+
+-- Backfill tables
+-- -------------------------------------------
+
+-- DROP TABLE IF EXISTS public.deter_rt_backfill;
+
+CREATE TABLE IF NOT EXISTS public.deter_rt_backfill
+(
+    id serial,
+    geom geometry(MultiPolygon,4674) NOT NULL,
+    class_name character varying(256) NOT NULL,
+    view_date date NOT NULL,
+    area_km double precision NOT NULL,
+    lon double precision,
+    lat double precision,
+    tile_id character varying(256) NOT NULL,
+    detection_date date,
+    source_file character varying(256) NOT NULL,
+    run_key character varying(64),
+    geom_hash uuid GENERATED ALWAYS AS (md5(ST_AsBinary(ST_Normalize(ST_SnapToGrid(geom, 0.000001))))::uuid) STORED,
+    CONSTRAINT deter_rt_backfill_pkey PRIMARY KEY (id)
+);
+
+CREATE INDEX IF NOT EXISTS deter_rt_backfill_view_date_idx
+    ON public.deter_rt_backfill USING btree
+    (view_date)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS deter_rt_backfill_source_file_idx
+    ON public.deter_rt_backfill USING btree
+    (source_file)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS deter_rt_backfill_geom_hash_idx
+    ON public.deter_rt_backfill USING btree
+    (geom_hash, view_date)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS deter_rt_backfill_run_key_idx
+    ON public.deter_rt_backfill USING btree
+    (run_key, view_date)
+    TABLESPACE pg_default;
+
+-- DROP TABLE IF EXISTS public.backfill_progress;
+
+CREATE TABLE IF NOT EXISTS public.backfill_progress
+(
+    run_key character varying(64) NOT NULL,
+    file_name character varying(256) NOT NULL,
+    etag character varying,
+    source character varying(16) NOT NULL,
+    rows integer NOT NULL,
+    loaded_at timestamp without time zone NOT NULL DEFAULT now(),
+    CONSTRAINT backfill_progress_pkey PRIMARY KEY (run_key, file_name)
+);
+
 -- Temporary tables
 -- -------------------------------------------
 
@@ -182,9 +340,13 @@ CREATE TABLE IF NOT EXISTS public.deter_rt_temp
     class_name character varying(256) NOT NULL,
     view_date date NOT NULL,
     area_km double precision NOT NULL,
+    lon double precision,
+    lat double precision,
     created_at date NOT NULL DEFAULT (now())::date,
     tile_id character varying(256) NOT NULL,
     detection_date date,
+    batch_id integer,
+    geom_hash uuid GENERATED ALWAYS AS (md5(ST_AsBinary(ST_Normalize(ST_SnapToGrid(geom, 0.000001))))::uuid) STORED,
     CONSTRAINT deter_rt_temp_pkey PRIMARY KEY (uuid)
 );
 
@@ -194,4 +356,9 @@ CREATE INDEX IF NOT EXISTS deter_rt_tem_geom_idx
     ON public.deter_rt_temp USING gist
     (geom)
     WITH (buffering=auto)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS deter_rt_temp_geom_hash_idx
+    ON public.deter_rt_temp USING btree
+    (geom_hash, view_date)
     TABLESPACE pg_default;
\ No newline at end of file
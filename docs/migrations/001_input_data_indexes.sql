@@ -0,0 +1,19 @@
+-- -------------------------------------------
+-- Indexes used by the set-based reconciliation of the input_data control table.
+-- Safe to run more than once on an existing database.
+-- -------------------------------------------
+
+CREATE INDEX IF NOT EXISTS input_data_file_name_idx
+    ON public.input_data USING btree
+    (file_name)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS input_data_file_stem_idx
+    ON public.input_data USING btree
+    (split_part(file_name, '.', 1))
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS input_data_import_date_idx
+    ON public.input_data USING btree
+    (import_date)
+    TABLESPACE pg_default;
@@ -0,0 +1,39 @@
+-- -------------------------------------------
+-- Tables used by the backfill flow (deter_rt_backfill DAG).
+-- The backfill also creates them when missing.
+-- Safe to run more than once on an existing database.
+-- -------------------------------------------
+
+CREATE TABLE IF NOT EXISTS public.deter_rt_backfill
+(
+    id serial,
+    geom geometry(MultiPolygon,4674) NOT NULL,
+    class_name character varying(256) NOT NULL,
+    view_date date NOT NULL,
+    area_km double precision NOT NULL,
+    tile_id character varying(256) NOT NULL,
+    detection_date date,
+    source_file character varying(256) NOT NULL,
+    CONSTRAINT deter_rt_backfill_pkey PRIMARY KEY (id)
+);
+
+CREATE INDEX IF NOT EXISTS deter_rt_backfill_view_date_idx
+    ON public.deter_rt_backfill USING btree
+    (view_date)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS deter_rt_backfill_source_file_idx
+    ON public.deter_rt_backfill USING btree
+    (source_file)
+    TABLESPACE pg_default;
+
+CREATE TABLE IF NOT EXISTS public.backfill_progress
+(
+    run_key character varying(64) NOT NULL,
+    file_name character varying(256) NOT NULL,
+    etag character varying,
+    source character varying(16) NOT NULL,
+    rows integer NOT NULL,
+    loaded_at timestamp without time zone NOT NULL DEFAULT now(),
+    CONSTRAINT backfill_progress_pkey PRIMARY KEY (run_key, file_name)
+);
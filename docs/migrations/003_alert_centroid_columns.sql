@@ -0,0 +1,17 @@
+-- -------------------------------------------
+-- The centroid of each alert, computed by the loader with the geodesic area
+-- when the shapefile is parsed, and copied to the validated alerts.
+-- Safe to run more than once on an existing database.
+-- -------------------------------------------
+
+ALTER TABLE IF EXISTS public.deter_rt
+    ADD COLUMN IF NOT EXISTS lon double precision,
+    ADD COLUMN IF NOT EXISTS lat double precision;
+
+ALTER TABLE IF EXISTS public.deter_rt_temp
+    ADD COLUMN IF NOT EXISTS lon double precision,
+    ADD COLUMN IF NOT EXISTS lat double precision;
+
+ALTER TABLE IF EXISTS public.deter_rt_backfill
+    ADD COLUMN IF NOT EXISTS lon double precision,
+    ADD COLUMN IF NOT EXISTS lat double precision;
@@ -0,0 +1,33 @@
+-- -------------------------------------------
+-- The fingerprint of each geometry, snapped to a 0.000001 degree grid and normalized,
+-- used with view_date to find duplicate alerts by an index join instead of ST_Equals.
+-- Adding a stored column rewrites the table, run it out of the hourly flow.
+-- Safe to run more than once on an existing database.
+-- -------------------------------------------
+
+ALTER TABLE IF EXISTS public.deter_rt
+    ADD COLUMN IF NOT EXISTS geom_hash uuid
+    GENERATED ALWAYS AS (md5(ST_AsBinary(ST_Normalize(ST_SnapToGrid(geom, 0.000001))))::uuid) STORED;
+
+ALTER TABLE IF EXISTS public.deter_rt_temp
+    ADD COLUMN IF NOT EXISTS geom_hash uuid
+    GENERATED ALWAYS AS (md5(ST_AsBinary(ST_Normalize(ST_SnapToGrid(geom, 0.000001))))::uuid) STORED;
+
+ALTER TABLE IF EXISTS public.deter_rt_backfill
+    ADD COLUMN IF NOT EXISTS geom_hash uuid
+    GENERATED ALWAYS AS (md5(ST_AsBinary(ST_Normalize(ST_SnapToGrid(geom, 0.000001))))::uuid) STORED;
+
+CREATE INDEX IF NOT EXISTS deter_rt_geom_hash_idx
+    ON public.deter_rt USING btree
+    (geom_hash, view_date)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS deter_rt_temp_geom_hash_idx
+    ON public.deter_rt_temp USING btree
+    (geom_hash, view_date)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS deter_rt_backfill_geom_hash_idx
+    ON public.deter_rt_backfill USING btree
+    (geom_hash, view_date)
+    TABLESPACE pg_default;
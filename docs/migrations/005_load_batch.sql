@@ -0,0 +1,34 @@
+-- -------------------------------------------
+-- The load batches of the hourly flow: the loader stamps the rows with the open batch,
+-- the transformer moves them to deter_rt and the validator works only on their batch.
+-- Safe to run more than once on an existing database.
+-- -------------------------------------------
+
+CREATE TABLE IF NOT EXISTS public.load_batch
+(
+    id serial,
+    status character varying(16) NOT NULL DEFAULT 'open',
+    rows integer,
+    opened_at timestamp without time zone NOT NULL DEFAULT now(),
+    transformed_at timestamp without time zone,
+    validated_at timestamp without time zone,
+    CONSTRAINT load_batch_pkey PRIMARY KEY (id)
+);
+
+-- only one batch is open at a time
+CREATE UNIQUE INDEX IF NOT EXISTS load_batch_open_idx
+    ON public.load_batch USING btree
+    (status)
+    TABLESPACE pg_default
+    WHERE status = 'open';
+
+ALTER TABLE IF EXISTS public.deter_rt
+    ADD COLUMN IF NOT EXISTS batch_id integer;
+
+ALTER TABLE IF EXISTS public.deter_rt_temp
+    ADD COLUMN IF NOT EXISTS batch_id integer;
+
+CREATE INDEX IF NOT EXISTS deter_rt_batch_id_idx
+    ON public.deter_rt USING btree
+    (batch_id)
+    TABLESPACE pg_default;
@@ -0,0 +1,95 @@
+-- -------------------------------------------
+-- Partition deter_rt and deter_otico by month of view_date.
+--
+-- Each table is renamed to <table>_unpartitioned, a partitioned table with the same
+-- columns, defaults and generated columns takes its name, one partition is created per
+-- month of the existing data, plus a default partition, and the rows are copied.
+-- The pipeline creates the partitions of the new months before writing to the tables,
+-- see OutputDatabase.ensure_monthly_partitions.
+--
+-- Run it out of the hourly flow, in one transaction. The old tables are kept,
+-- drop them after checking the counts at the end.
+-- -------------------------------------------
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION pg_temp.partition_by_month(parent text, primary_key text)
+    RETURNS bigint AS
+    $$
+    DECLARE
+        old_table text := parent || '_unpartitioned';
+        month date;
+        last_month date;
+        index record;
+        columns text;
+        copied bigint;
+    BEGIN
+        EXECUTE format('ALTER TABLE public.%I RENAME TO %I', parent, old_table);
+        -- free the names of the constraints and indexes for the partitioned table
+        FOR index IN SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = old_table LOOP
+            EXECUTE format('ALTER INDEX public.%I RENAME TO %I', index.indexname, 'old_' || index.indexname);
+        END LOOP;
+
+        EXECUTE format(
+            'CREATE TABLE public.%I (LIKE public.%I INCLUDING DEFAULTS INCLUDING GENERATED, PRIMARY KEY (%s)) PARTITION BY RANGE (view_date)',
+            parent, old_table, primary_key
+        );
+
+        EXECUTE format('SELECT date_trunc(''month'', min(view_date))::date, max(view_date) FROM public.%I', old_table)
+            INTO month, last_month;
+        WHILE month <= last_month LOOP
+            EXECUTE format(
+                'CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+                parent || '_' || to_char(month, 'YYYYMM'), parent, month, (month + interval '1 month')::date
+            );
+            month := (month + interval '1 month')::date;
+        END LOOP;
+        EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I DEFAULT', parent || '_default', parent);
+
+        SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO columns
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = old_table AND is_generated = 'NEVER';
+        EXECUTE format('INSERT INTO public.%I (%s) SELECT %s FROM public.%I', parent, columns, columns, old_table);
+        GET DIAGNOSTICS copied = ROW_COUNT;
+
+        -- the serial sequence now belongs to the partitioned table
+        EXECUTE format('ALTER SEQUENCE public.%I OWNED BY public.%I.id', parent || '_id_seq', parent);
+
+        RETURN copied;
+    END
+    $$
+    LANGUAGE 'plpgsql';
+
+SELECT pg_temp.partition_by_month('deter_rt', 'uuid, view_date');
+
+CREATE INDEX IF NOT EXISTS deter_rt_geom_idx
+    ON public.deter_rt USING gist
+    (geom);
+
+CREATE INDEX IF NOT EXISTS deter_rt_geom_hash_idx
+    ON public.deter_rt USING btree
+    (geom_hash, view_date);
+
+CREATE INDEX IF NOT EXISTS deter_rt_batch_id_idx
+    ON public.deter_rt USING btree
+    (batch_id);
+
+SELECT pg_temp.partition_by_month('deter_otico', 'id, view_date');
+
+CREATE INDEX IF NOT EXISTS deter_otico_geom_idx
+    ON public.deter_otico USING gist
+    (geom);
+
+CREATE INDEX IF NOT EXISTS deter_otico_view_date_idx
+    ON public.deter_otico USING btree
+    (view_date);
+
+COMMIT;
+
+ANALYZE public.deter_rt;
+ANALYZE public.deter_otico;
+
+-- SELECT (SELECT count(*) FROM public.deter_rt) = (SELECT count(*) FROM public.deter_rt_unpartitioned);
+-- SELECT (SELECT count(*) FROM public.deter_otico) = (SELECT count(*) FROM public.deter_otico_unpartitioned);
+-- DROP TABLE public.deter_rt_unpartitioned;
+-- DROP TABLE public.deter_otico_unpartitioned;
@@ -0,0 +1,34 @@
+-- -------------------------------------------
+-- The optical DETER coverage used by the validation: the deter_otico polygons,
+-- buffered as the validation did, dissolved by class and subdivided in pieces
+-- of at most 256 vertices. The collector merges the new optical rows into it.
+-- The table is built here, it is also built by the collector when empty.
+-- Safe to run more than once on an existing database.
+-- -------------------------------------------
+
+CREATE TABLE IF NOT EXISTS public.deter_otico_coverage
+(
+    id serial,
+    class_name character varying(256) NOT NULL,
+    geom geometry(MultiPolygon,4674) NOT NULL,
+    CONSTRAINT deter_otico_coverage_pkey PRIMARY KEY (id)
+);
+
+CREATE INDEX IF NOT EXISTS deter_otico_coverage_geom_idx
+    ON public.deter_otico_coverage USING gist
+    (geom)
+    WITH (buffering=auto)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS deter_otico_coverage_class_name_idx
+    ON public.deter_otico_coverage USING btree
+    (class_name)
+    TABLESPACE pg_default;
+
+INSERT INTO public.deter_otico_coverage (class_name, geom)
+SELECT class_name, ST_Multi(ST_Subdivide(ST_CollectionExtract(ST_Union(ST_Buffer(geom, 0.000000001)), 3), 256))
+FROM public.deter_otico
+WHERE NOT EXISTS (SELECT 1 FROM public.deter_otico_coverage)
+GROUP BY class_name;
+
+ANALYZE public.deter_otico_coverage;
@@ -0,0 +1,21 @@
+-- -------------------------------------------
+-- The backfill run that loaded each row of the staging table, so a run publishes only
+-- its own rows. The existing rows get the last run that loaded their file.
+-- Safe to run more than once on an existing database.
+-- -------------------------------------------
+
+ALTER TABLE IF EXISTS public.deter_rt_backfill
+    ADD COLUMN IF NOT EXISTS run_key character varying(64);
+
+UPDATE public.deter_rt_backfill b SET run_key = p.run_key
+FROM (
+    SELECT DISTINCT ON (file_name) file_name, run_key
+    FROM public.backfill_progress
+    ORDER BY file_name, loaded_at DESC
+) p
+WHERE b.run_key IS NULL AND b.source_file = p.file_name;
+
+CREATE INDEX IF NOT EXISTS deter_rt_backfill_run_key_idx
+    ON public.deter_rt_backfill USING btree
+    (run_key, view_date)
+    TABLESPACE pg_default;
@@ -0,0 +1,15 @@
+-- -------------------------------------------
+-- Indexes used to find the last downloaded shapefile with alerts on the final table,
+-- see OutputDatabase.get_max_date_input_file: input_data is read from the most recent
+-- file, and each file looks for its alerts on the partition of its file_date.
+-- Safe to run more than once on an existing database.
+-- -------------------------------------------
+
+CREATE INDEX IF NOT EXISTS input_data_last_modified_idx
+    ON public.input_data USING btree
+    (last_modified)
+    TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS deter_rt_tile_id_idx
+    ON public.deter_rt USING btree
+    (tile_id, view_date);
@@ -0,0 +1,75 @@
+"""
+Compare the shapefile readers of the loader on a directory of shapefiles, e.g. a day's worth of tiles.
+
+Each reader parses every file into the arrays written by the loader, the time and
+the peak memory allocated by Python are reported per reader. The parsed geometries
+of both readers are compared, so the readers are known to be equivalent on the data.
+
+Usage:
+    python src/benchmarks/benchmark_reader.py --data-dir /path/to/tiles
+"""
+
+import argparse
+import glob
+import os
+import pathlib
+import sys
+import tracemalloc
+from time import perf_counter
+
+# used to load the location where code of tasks are
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve().absolute()))
+
+import shapely
+from tasks.shapefile_parser import READERS, parse_shapefile
+from utils.logger import TasksLogger
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DETER-RT shapefile readers.")
+    parser.add_argument("--data-dir", required=True, help="directory with the .shp or .zip files")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each reader")
+    args = parser.parse_args()
+
+    logger = TasksLogger("BenchmarkReader")
+    logger.setLoggerLevel("INFO")
+
+    files = sorted(glob.glob(os.path.join(args.data_dir, "*.shp")) + glob.glob(os.path.join(args.data_dir, "*.zip")))
+    size = sum(os.path.getsize(f) for f in files)
+    logger.info(f"{len(files)} files, {size / 1024 / 1024:.1f} MB.")
+
+    results = {}
+    for name in READERS:
+        timings = []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            parsed = [parse_shapefile(filein, reader=name) for filein in files]
+            timings.append(perf_counter() - start)
+
+        tracemalloc.start()
+        for filein in files:
+            parse_shapefile(filein, reader=name)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        rows = sum(p["rows"] for p in parsed)
+        best = min(timings)
+        logger.info(
+            f"{name}: best of {args.repeat} runs {best:.2f} s, "
+            f"{rows / best if best > 0 else 0:.0f} features/s, peak Python memory {peak / 1024 / 1024:.1f} MB"
+        )
+        results[name] = parsed
+
+    # the same geometries and dates from every reader
+    reference_name, reference = next(iter(results.items()))
+    for name, parsed in results.items():
+        for expected, actual in zip(reference, parsed):
+            same = expected["dates"] == actual["dates"] and all(
+                shapely.equals_exact(shapely.from_wkb(expected["wkb"]), shapely.from_wkb(actual["wkb"]), tolerance=0)
+            )
+            if not same:
+                logger.warning(f"{name} differs from {reference_name} on {expected['name']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Check that the built-in memory-mapped reader gives the same data as gpd.read_file.
+
+For every shapefile of the directory, the features read by the memory-mapped reader are
+compared with the ones read by GeoPandas: the count, the EPSG code, each geometry (as
+topologically equal) and each Date_dt value. The files that the reader does not handle
+are listed, they are read by GeoPandas in the loader. The exit code is 1 on any mismatch.
+
+Usage:
+    python src/benchmarks/check_reader_parity.py --data-dir /path/to/tiles
+"""
+
+import argparse
+import glob
+import os
+import pathlib
+import sys
+
+# used to load the location where code of tasks are
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve().absolute()))
+
+import geopandas as gpd
+import shapely
+from tasks.memmap_shapefile_reader import UnsupportedShapefileError, read_shapefile
+from tasks.shapefile_parser import to_text_dates
+from utils.logger import TasksLogger
+
+
+def compare(filein: str) -> list[str]:
+    """Return the differences between the readers on one shapefile."""
+
+    srid, _, wkb, dates = read_shapefile(filein)
+    gdf = gpd.read_file(filein, engine="fiona")
+
+    if len(gdf) != len(wkb):
+        return [f"{len(wkb)} features, expected {len(gdf)}"]
+
+    errors = []
+    if gdf.crs is not None and gdf.crs.to_epsg() != srid:
+        errors.append(f"EPSG {srid}, expected {gdf.crs.to_epsg()}")
+
+    expected_dates = to_text_dates(gdf["Date_dt"]) if "Date_dt" in gdf.columns else [None] * len(gdf)
+    geometries = shapely.from_wkb(wkb)
+    for i, (expected, actual) in enumerate(zip(gdf.geometry.values, geometries)):
+        if (expected is None) != (actual is None) or (expected is not None and not shapely.equals(expected, actual)):
+            errors.append(f"geometry of feature {i} differs")
+        if expected_dates[i] != dates[i]:
+            errors.append(f"Date_dt of feature {i} is {dates[i]}, expected {expected_dates[i]}")
+
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the memory-mapped shapefile reader against GeoPandas.")
+    parser.add_argument("--data-dir", required=True, help="directory with the .shp files")
+    args = parser.parse_args()
+
+    logger = TasksLogger("CheckReaderParity")
+    logger.setLoggerLevel("INFO")
+
+    files = sorted(glob.glob(os.path.join(args.data_dir, "*.shp")))
+    failed = unsupported = 0
+    for filein in files:
+        try:
+            errors = compare(filein)
+        except UnsupportedShapefileError as ex:
+            unsupported += 1
+            logger.info(f"{filein}: not handled by the memory-mapped reader, {ex}")
+            continue
+
+        if errors:
+            failed += 1
+            logger.error(f"{filein}: {len(errors)} differences, first ones: {errors[:5]}")
+
+    logger.info(f"{len(files)} files: {len(files) - failed - unsupported} equal, {failed} different, {unsupported} not handled.")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
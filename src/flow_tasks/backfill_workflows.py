@@ -0,0 +1,62 @@
+""" A manual flow to reload the DETER-RT data of a date range from the archived tiles. """
+
+import pathlib
+import sys
+import pendulum
+from airflow import DAG
+from airflow.models import Variable
+from airflow.models.param import Param
+
+# used to load the location where base dag is
+dag_dir = str(pathlib.Path(__file__).parent.resolve().absolute())
+sys.path.append(dag_dir)
+
+# used to load the location where code of tasks are
+project_dir = str(pathlib.Path(__file__).parent.parent.resolve().absolute())
+sys.path.append(project_dir)
+
+from deter_rt_dag_operators import BaseDagOperators
+
+# define a log level (CRITICAL = 50, FATAL = CRITICAL, ERROR = 40, WARNING = 30, WARN = WARNING, INFO = 20, DEBUG = 10, NOTSET = 0)
+LOG_LEVEL = Variable.get("DETER_RT_LOG_LEVEL")
+
+if not LOG_LEVEL:
+    raise Exception(f"Missing DETER_RT_LOG_LEVEL variable into airflow configuration.")
+
+# Default arguments for all tasks. Precedence is the value at task instantiation.
+task_default_args = {
+    "start_date": pendulum.datetime(year=2025, month=8, day=11, tz="America/Sao_Paulo"),
+    "owner": "airflow",
+    "depends_on_past": False,
+    "email_on_failure": False,
+    "email_on_retry": False,
+    "retries": 0,
+}
+# The path to the virtual environment location for this set of DAGs
+venv_path = f"/opt/airflow/venv/inpe/deter_rt"
+
+DAG_KEY = f"deter_rt_backfill"
+description = f"Reload the DETER-RT tiles of a date range from the GeoParquet cache or the backup store, without touching the hourly flow control rows. Trigger it with start_date and end_date (YYYY-MM-DD); a failed run resumes from where it stopped, a new run_id loads the range again."
+
+with DAG(
+    dag_id=DAG_KEY,
+    description=description,
+    max_active_runs=1,
+    start_date=pendulum.datetime(year=2025, month=8, day=11, tz="America/Sao_Paulo"),
+    schedule_interval=None,
+    catchup=False,
+    default_args=task_default_args,
+    params={
+        "start_date": Param(type="string", format="date"),
+        "end_date": Param(type="string", format="date"),
+        "publish": Param(False, type="boolean"),
+        "run_id": Param("", type="string", maxLength=42),
+    },
+    tags=['DETER-RT', 'RADAR', 'DETER', 'BACKFILL'],
+) as backfill_dag:
+
+    baseDag = BaseDagOperators(
+        venv_path=venv_path, project_dir=project_dir, log_level=LOG_LEVEL
+    )
+
+    backfill = baseDag.backfill_task_operator()
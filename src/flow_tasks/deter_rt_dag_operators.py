@@ -23,6 +23,10 @@ class BaseDagOperators:
             "psycopg2-binary",
             "geopandas==0.13.2",
             "fiona==1.9.6",
+            "pyogrio",
+            "pyarrow",
+            "zstandard",
+            "shapely>=2",
             "geoalchemy2",
             "webdavclient3",
         ]
@@ -129,11 +133,14 @@ class BaseDagOperators:
     def loader_task_operator(self):
 
         def fnc_operator(project_dir: str, log_level: str):
-            sys.path.append(project_dir)
-            from tasks.deter_rt_loader import DeterRTLoader
+            import subprocess
+            import sys
 
-            loader = DeterRTLoader(log_level=log_level)
-            loader.data_loader()
+            # the parser workers are spawned processes that import the main module again,
+            # and this script has no __main__ guard, so the loader runs as its own module
+            subprocess.run(
+                [sys.executable, "-m", "tasks.deter_rt_loader", "--log-level", log_level], cwd=project_dir, check=True
+            )
 
         return PythonVirtualenvOperator(
             task_id="loader_task",
@@ -182,6 +189,39 @@ class BaseDagOperators:
             op_args=[f"{self.project_dir}", f"{self.log_level}"],
         )
 
+    def backfill_task_operator(self):
+        """Reload the DETER RT data of a date range, given by the start_date, end_date, publish and run_id params."""
+
+        def fnc_operator(project_dir: str, log_level: str, start_date: str, end_date: str, publish: str, run_id: str):
+            import subprocess
+            import sys
+
+            # the partitions run on spawned processes that import the main module again,
+            # and this script has no __main__ guard, so the backfill runs as its own module
+            command = [
+                sys.executable, "-m", "tasks.deter_rt_backfill",
+                "--start-date", start_date, "--end-date", end_date, "--run-id", run_id, "--log-level", log_level,
+            ]
+            if str(publish).lower() == "true":
+                command.append("--publish")
+            subprocess.run(command, cwd=project_dir, check=True)
+
+        return PythonVirtualenvOperator(
+            task_id="backfill_task",
+            requirements=self.requirements,
+            venv_cache_path=f"{self.venv_path}",
+            python_callable=fnc_operator,
+            provide_context=True,
+            op_kwargs={
+                "project_dir": f"{self.project_dir}",
+                "log_level": f"{self.log_level}",
+                "start_date": "{{ params.start_date }}",
+                "end_date": "{{ params.end_date }}",
+                "publish": "{{ params.publish }}",
+                "run_id": "{{ params.run_id }}",
+            },
+        )
+
     def log_registry_task_operator(self):
         """Write log into collector_log table"""
 
@@ -0,0 +1,225 @@
+import hashlib
+import lzma
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import closing
+from time import perf_counter, time
+from utils.logger import TasksLogger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class BackupStore:
+    """
+    Backup Store: A content-addressed store of the downloaded files.
+
+    Each distinct content is stored once, compressed, under the SHA-256 of the original
+    bytes, and a SQLite index records which file name was stored with which content and
+    when. A file seen before, with the same name, size and modification time, is not read
+    again. The compression is zstd when the zstandard package is available, otherwise xz.
+
+    The files are stored on a background thread, so the backup runs while the loader
+    writes to the database. The retention removes the index entries older than the
+    retention period and then the contents that no entry refers to.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    INDEX_NAME = "backup_index.sqlite"
+
+    def __init__(self, backup_dir: str, log_level: str, retention_days: int):
+        self.backup_dir = backup_dir
+        self.objects_dir = os.path.join(backup_dir, "objects")
+        self.retention = retention_days * 24 * 3600
+        self.logger = TasksLogger(self.__class__.__name__)
+        self.logger.setLoggerLevel(level=log_level)
+        self.codec = "zst" if zstandard is not None else "xz"
+        self.stored = []
+        self.error = None
+        self.thread = None
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.__create_tables()
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(os.path.join(self.backup_dir, self.INDEX_NAME), timeout=30)
+
+    def __create_tables(self):
+        with closing(self.__connect()) as conn, conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS object (
+                    hash TEXT PRIMARY KEY, codec TEXT NOT NULL, size INTEGER NOT NULL, stored_size INTEGER NOT NULL)"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS entry (
+                    file_name TEXT NOT NULL, file_size INTEGER NOT NULL, file_mtime REAL NOT NULL,
+                    hash TEXT NOT NULL, stored_at REAL NOT NULL,
+                    PRIMARY KEY (file_name, file_size, file_mtime))"""
+            )
+
+    def get_object_path(self, digest: str, codec: str) -> str:
+        """Return the path of a stored content, in a directory named after the first bytes of the hash."""
+
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.{codec}")
+
+    def __hash_file(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def __compress_file(self, path: str, target: str):
+        """Compress the file into the target as a stream, through a temporary file renamed at the end."""
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_target = f"{target}.tmp"
+        with open(path, "rb") as src, open(tmp_target, "wb") as dst:
+            if self.codec == "zst":
+                with zstandard.ZstdCompressor(level=10).stream_writer(dst, closefd=False) as writer:
+                    shutil.copyfileobj(src, writer, self.CHUNK_SIZE)
+            else:
+                with lzma.open(dst, "wb", preset=6) as writer:
+                    shutil.copyfileobj(src, writer, self.CHUNK_SIZE)
+        os.replace(tmp_target, target)
+
+    def store_files(self, files: list[str]) -> list[str]:
+        """
+        Store the files, skipping the ones already in the index and the contents already stored.
+
+        Return: The files that are safely in the store, stored now or before.
+        """
+
+        started_at = perf_counter()
+        stored, new_objects, new_bytes = [], 0, 0
+        with closing(self.__connect()) as conn:
+            for path in files:
+                stat = os.stat(path)
+                file_name = os.path.basename(path)
+                key = (file_name, stat.st_size, stat.st_mtime)
+
+                known = conn.execute(
+                    "SELECT 1 FROM entry WHERE file_name=? AND file_size=? AND file_mtime=?", key
+                ).fetchone()
+                if known is None:
+                    digest = self.__hash_file(path)
+                    row = conn.execute("SELECT codec FROM object WHERE hash=?", (digest,)).fetchone()
+                    if row is None or not os.path.isfile(self.get_object_path(digest, row[0])):
+                        target = self.get_object_path(digest, self.codec)
+                        self.__compress_file(path, target)
+                        conn.execute(
+                            "INSERT OR REPLACE INTO object(hash, codec, size, stored_size) VALUES (?, ?, ?, ?)",
+                            (digest, self.codec, stat.st_size, os.path.getsize(target)),
+                        )
+                        new_objects += 1
+                        new_bytes += os.path.getsize(target)
+
+                    conn.execute(
+                        "INSERT OR REPLACE INTO entry(file_name, file_size, file_mtime, hash, stored_at) VALUES (?, ?, ?, ?, ?)",
+                        key + (digest, time()),
+                    )
+                    conn.commit()
+
+                stored.append(path)
+
+        self.logger.info(
+            f"Backup of {len(stored)} files in {perf_counter() - started_at:.1f} s: "
+            f"{new_objects} new contents, {new_bytes / 1024 / 1024:.1f} MB written."
+        )
+        return stored
+
+    def __run(self, files: list[str]):
+        try:
+            self.stored = self.store_files(files)
+        except Exception as ex:
+            self.error = ex
+
+    def start(self, files: list[str]):
+        """Store the files on a background thread."""
+
+        self.thread = threading.Thread(target=self.__run, args=(files,), name="backup-store")
+        self.thread.start()
+
+    def wait(self) -> list[str]:
+        """
+        Wait for the background backup to finish. A failed backup is logged and keeps every file.
+
+        Return: The files that are safely in the store.
+        """
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.error is not None:
+            self.logger.error(f"Failed to store the backup: {self.error}")
+            return []
+
+        return self.stored
+
+    def restore(self, file_name: str, target_dir: str) -> str:
+        """
+        Restore the last stored content of the file name into the target directory.
+
+        Return: The path of the restored file, or None if the file name is not in the store.
+        """
+
+        with closing(self.__connect()) as conn:
+            row = conn.execute(
+                """SELECT o.hash, o.codec FROM entry e JOIN object o ON o.hash=e.hash
+                WHERE e.file_name=? ORDER BY e.stored_at DESC LIMIT 1""",
+                (file_name,),
+            ).fetchone()
+
+        if row is None:
+            return None  # type: ignore
+
+        target = os.path.join(target_dir, file_name)
+        with open(self.get_object_path(row[0], row[1]), "rb") as src, open(target, "wb") as dst:
+            if row[1] == "zst":
+                with zstandard.ZstdDecompressor().stream_reader(src) as reader:
+                    shutil.copyfileobj(reader, dst, self.CHUNK_SIZE)
+            else:
+                with lzma.open(src, "rb") as reader:
+                    shutil.copyfileobj(reader, dst, self.CHUNK_SIZE)
+
+        return target
+
+    def restore_bundle(self, stem: str, target_dir: str) -> list[str]:
+        """
+        Restore the last stored content of every file of a bundle, the files named stem.<extension>.
+
+        Return: The paths of the restored files.
+        """
+
+        with closing(self.__connect()) as conn:
+            names = conn.execute(
+                "SELECT DISTINCT file_name FROM entry WHERE substr(file_name, 1, ?) = ?",
+                (len(stem) + 1, f"{stem}."),
+            ).fetchall()
+
+        os.makedirs(target_dir, exist_ok=True)
+        return [self.restore(file_name=n[0], target_dir=target_dir) for n in names]
+
+    def apply_retention(self):
+        """Remove the entries older than the retention period, and the contents without entries."""
+
+        with closing(self.__connect()) as conn, conn:
+            if self.retention:
+                conn.execute("DELETE FROM entry WHERE stored_at < ?", (time() - self.retention,))
+            orphans = conn.execute(
+                "SELECT hash, codec FROM object WHERE hash NOT IN (SELECT hash FROM entry)"
+            ).fetchall()
+            for digest, codec in orphans:
+                path = self.get_object_path(digest, codec)
+                if os.path.isfile(path):
+                    os.remove(path)
+            conn.executemany("DELETE FROM object WHERE hash=?", [(o[0],) for o in orphans])
+            total = conn.execute("SELECT count(*), coalesce(sum(stored_size), 0) FROM object").fetchone()
+
+        self.logger.info(
+            f"Backup store: {total[0]} contents, {total[1] / 1024 / 1024:.0f} MB, {len(orphans)} removed by retention."
+        )
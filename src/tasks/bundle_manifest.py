@@ -0,0 +1,78 @@
+import json
+import os
+from datetime import datetime
+from utils.logger import TasksLogger
+
+
+class BundleManifest:
+    """
+    Bundle Manifest: The list of shapefile bundles that are complete in the temporary directory.
+
+    The collector adds a bundle after all of its files were promoted into the temporary
+    directory, and the loader removes it after the import. It is a JSON file, rewritten
+    atomically, with one item per bundle: {"stem", "shapefile", "archive", "files", "etags", "ready_at"}.
+    The archive is the name of a zipped bundle, read in place by the loader. The etags of the
+    files, by file name, key the bundle on the GeoParquet cache.
+    """
+
+    FILE_NAME = "bundles.json"
+
+    def __init__(self, data_dir: str, log_level: str):
+        self.path = os.path.join(data_dir, self.FILE_NAME)
+        self.logger = TasksLogger(self.__class__.__name__)
+        self.logger.setLoggerLevel(level=log_level)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def read(self) -> list[dict]:
+        """Read the ready bundles. An absent manifest has no bundles."""
+
+        if not self.exists():
+            return []
+
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def __write(self, bundles: list[dict]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(bundles, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def add(self, bundles: list[dict]):
+        """
+        Add ready bundles, replacing the previous item of the same stem.
+
+        Parameters
+        ----
+        :param:bundles: A list of dicts with the keys stem, shapefile (the file name to read),
+        archive (the zip file name of a zipped bundle, or None), files and etags.
+        """
+
+        if not bundles:
+            return
+
+        ready_at = datetime.now().isoformat(timespec="seconds")
+        items = {b["stem"]: b for b in self.read()}
+        for bundle in bundles:
+            items[bundle["stem"]] = {
+                "stem": bundle["stem"],
+                "shapefile": bundle["shapefile"],
+                "archive": bundle.get("archive"),
+                "files": bundle["files"],
+                "etags": bundle.get("etags"),
+                "ready_at": ready_at,
+            }
+
+        self.__write(list(items.values()))
+        self.logger.info(f"{len(bundles)} bundles added to the manifest, {len(items)} waiting to be loaded.")
+
+    def remove(self, stems: list[str]):
+        """Remove the bundles of the given stems, after they were loaded."""
+
+        if not stems or not self.exists():
+            return
+
+        stems = set(stems)
+        self.__write([b for b in self.read() if b["stem"] not in stems])
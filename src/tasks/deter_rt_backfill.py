@@ -0,0 +1,227 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from time import perf_counter
+from tasks.backup_store import BackupStore
+from tasks.geoparquet_cache import GeoParquetCache
+from tasks.http_data_source import HTTPDataSource
+from tasks.output_database import OutputDatabase
+from tasks.postgis_copy_writer import PostGISCopyWriter
+from tasks.shapefile_parser import parse_shapefile
+from utils.logger import TasksLogger
+
+
+def load_partition(log_level: str, run_key: str, files: list[tuple], reader: str, data_dirs: dict) -> dict:
+    """
+    Load one partition of the backfill, on its own process and database connection.
+
+    Each tile is read from the GeoParquet cache, or restored from the backup store and parsed,
+    and its rows replace the previous rows of the same file on the backfill table. The rows
+    and the progress record of each tile are committed together, so an interrupted run is
+    resumed from the next tile.
+
+    Parameters
+    ----
+    :param:files: A list of tuple[file_name, file_date, tile_id, etags of the bundle files].
+    :param:data_dirs: A dict with the backup, cache and scratch directories.
+
+    Return: dict with the counters of files, rows, cache and backup reads, and the missing files.
+    """
+
+    logger = TasksLogger("DeterRTBackfill")
+    logger.setLoggerLevel(level=log_level)
+
+    outputdb = OutputDatabase(log_level=log_level)
+    outputdb.prepare_direct_ingest()
+    writer = PostGISCopyWriter(database=outputdb.get_database_facade(), logger=logger)
+    writer.database.commit()
+
+    cache = GeoParquetCache(cache_dir=data_dirs["cache"], log_level=log_level, max_size_mb=0, max_age_days=0)
+    backup_store = BackupStore(backup_dir=data_dirs["backup"], log_level=log_level, retention_days=0)
+
+    stats = {"files": 0, "rows": 0, "cache": 0, "backup": 0, "missing": []}
+    for file_name, file_date, tile_id, etags in files:
+        stem = file_name.split(".")[0]
+        scratch_dir = None
+        key = GeoParquetCache.get_key(etags)
+        try:
+            parsed = cache.read(key) if key else None
+            source = "cache"
+            if parsed is None:
+                scratch_dir = os.path.join(data_dirs["scratch"], stem)
+                backup_store.restore_bundle(stem=stem, target_dir=scratch_dir)
+                path = os.path.join(scratch_dir, file_name)
+                if not os.path.isfile(path):
+                    logger.warning(f"{file_name} is neither in the GeoParquet cache nor in the backup store")
+                    stats["missing"].append(file_name)
+                    continue
+                parsed = parse_shapefile(path, reader)
+                source = "backup"
+
+            writer.write_tagged(
+                table=f"pg_temp.{outputdb.ingest_table}",
+                wkb=parsed["wkb"],
+                dates=parsed["dates"],
+                area_km=parsed["area_km"],
+                lon=parsed["lon"],
+                lat=parsed["lat"],
+                view_date=file_date,
+                tile_id=tile_id,
+            )
+            rows = outputdb.ingest_to_backfill_table(source_file=file_name, run_key=run_key)
+            outputdb.mark_backfill_done(run_key=run_key, file_name=file_name, etag=(etags or {}).get(file_name), source=source, rows=rows)
+            writer.database.commit()
+
+            stats["files"] += 1
+            stats["rows"] += rows
+            stats[source] += 1
+            logger.debug(f"{rows} rows of {file_name} backfilled from the {source}")
+        except Exception as ex:
+            writer.database.rollback()
+            raise ex
+        finally:
+            if scratch_dir is not None:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    writer.database.close()
+    return stats
+
+
+class DeterRTBackfill:
+    """
+    DeterRTBackfill: Reloads the DETER RT data of a date range from the archived tiles.
+
+    The tiles registered in input_data with a file_date in the range are read from the
+    GeoParquet cache, or from the backup store, and loaded into the backfill table by
+    parallel partitions. The hourly flow is not disturbed: input_data is only read, and
+    the progress is kept on its own table, by run, so a run can be resumed.
+
+    A run is keyed by its date range and an optional run id, so the same range is loaded
+    again from scratch by triggering it with a new run id.
+    """
+
+    # the run_key of the progress table is a varchar(64), the date range takes 22 characters of it
+    MAX_RUN_ID_LENGTH: int = 42
+
+    def __init__(self, log_level: str = "DEBUG", project_dir: str = ""):
+        self.log_level = log_level
+        self.logger = TasksLogger(self.__class__.__name__)
+        self.logger.setLoggerLevel(level=log_level)
+        self.data_source = HTTPDataSource(log_level=log_level, project_dir=project_dir)
+
+    def backfill(self, start_date: date, end_date: date, publish: bool = False, run_id: str = "") -> dict:
+        """
+        Load the tiles of the date range into the backfill table.
+
+        Parameters
+        ----
+        :param:start_date, end_date: The range of file dates, both included.
+        :param:publish: If True, the rows loaded by this run are published to the final table to be validated again, see OutputDatabase.publish_backfill.
+        :param:run_id: Resumes the run of the range with the same id, a new id loads all tiles again.
+
+        Return: dict with the counters of the run.
+        """
+
+        started_at = perf_counter()
+        run_key = self.get_run_key(start_date=start_date, end_date=end_date, run_id=run_id)
+
+        outputdb = OutputDatabase(log_level=self.log_level)
+        outputdb.prepare_backfill()
+        files = outputdb.get_backfill_files(start_date=start_date, end_date=end_date)
+        done = outputdb.get_backfill_done(run_key=run_key)
+        pending = [f for f in files if f[0] not in done]
+        self.logger.info(f"Backfill {run_key}: {len(files)} tiles in the range, {len(pending)} to load")
+
+        partitions = self.__make_partitions(files=pending, workers=outputdb.get_backfill_workers())
+        data_dirs = {
+            "backup": self.data_source.get_backup_directory(),
+            "cache": self.data_source.get_cache_directory(),
+            "scratch": os.path.join(self.data_source.get_data_directory(), "backfill"),
+        }
+        reader = outputdb.get_loader_reader()
+
+        totals = {"files": 0, "rows": 0, "cache": 0, "backup": 0, "missing": []}
+        failures = []
+        if partitions:
+            # spawned workers, each one opens its own database connection;
+            # they import the main module again, see main for the guarded entry point
+            with ProcessPoolExecutor(
+                max_workers=len(partitions), mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                futures = [
+                    executor.submit(load_partition, self.log_level, run_key, partition, reader, data_dirs)
+                    for partition in partitions
+                ]
+                for future in as_completed(futures):
+                    try:
+                        stats = future.result()
+                    except Exception as ex:
+                        self.logger.error(f"Backfill partition failed: {ex}")
+                        failures.append(ex)
+                        continue
+
+                    for key in ("files", "rows", "cache", "backup", "missing"):
+                        totals[key] += stats[key]
+
+        self.logger.info(
+            f"Backfill {run_key}: {totals['files']} tiles and {totals['rows']} rows loaded in "
+            f"{perf_counter() - started_at:.1f} s, {totals['cache']} from the GeoParquet cache, "
+            f"{totals['backup']} from the backup store, {len(totals['missing'])} missing"
+        )
+
+        if failures:
+            raise Exception(f"{len(failures)} of {len(partitions)} backfill partitions failed, run it again to resume")
+
+        if publish:
+            moved, inserted = outputdb.publish_backfill(start_date=start_date, end_date=end_date, run_key=run_key)
+            self.logger.info(
+                f"Backfill {run_key}: {moved} alerts of {outputdb.current_table} to validate again, "
+                f"{inserted} missing rows inserted"
+            )
+
+        return totals
+
+    def get_run_key(self, start_date: date, end_date: date, run_id: str = "") -> str:
+        """Return the key of a run on the progress table, from its date range and run id."""
+
+        run_id = str(run_id or "").strip()
+        if len(run_id) > self.MAX_RUN_ID_LENGTH:
+            raise Exception(f"The run_id is longer than {self.MAX_RUN_ID_LENGTH} characters: {run_id}")
+
+        run_key = f"{start_date.isoformat()}_{end_date.isoformat()}"
+        return f"{run_key}_{run_id}" if run_id else run_key
+
+    def __make_partitions(self, files: list[tuple], workers: int) -> list[list[tuple]]:
+        """Split the files into partitions by tile, so each tile is loaded by one partition, in date order."""
+
+        partitions = [[] for _ in range(workers)]
+        tiles = sorted({f[2] for f in files}, key=str)
+        index = {tile_id: i % workers for i, tile_id in enumerate(tiles)}
+        for f in files:
+            partitions[index[f[2]]].append(f)
+
+        return [p for p in partitions if p]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reload the DETER RT data of a date range from the archived tiles.")
+    parser.add_argument("--start-date", required=True, type=date.fromisoformat, help="the first file date, YYYY-MM-DD")
+    parser.add_argument("--end-date", required=True, type=date.fromisoformat, help="the last file date, YYYY-MM-DD")
+    parser.add_argument("--publish", action="store_true", help="publish the backfilled rows to the final table, to validate them again")
+    parser.add_argument("--run-id", default="", help="a new id loads all tiles of the range again")
+    parser.add_argument("--project-dir", default="", help="the directory of the data directory, by default src")
+    parser.add_argument("--log-level", default="INFO", help="the log level of the tasks")
+    args = parser.parse_args()
+
+    DeterRTBackfill(log_level=args.log_level, project_dir=args.project_dir).backfill(
+        start_date=args.start_date, end_date=args.end_date, publish=args.publish, run_id=args.run_id
+    )
+
+
+# the partitions run on spawned processes, which import the main module again, so the
+# backfill runs from this guarded entry point: python -m tasks.deter_rt_backfill
+if __name__ == "__main__":
+    main()
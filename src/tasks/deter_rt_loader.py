@@ -1,12 +1,21 @@
+import argparse
 import glob
+import multiprocessing
 import os
 import pathlib
-import shutil
-import geopandas as gpd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import perf_counter
+from typing import Iterator
+from tasks.backup_store import BackupStore
+from tasks.bundle_manifest import BundleManifest
+from tasks.geoparquet_cache import GeoParquetCache
 from tasks.http_data_source import HTTPDataSource
 from tasks.output_database import OutputDatabase
+from tasks.postgis_copy_writer import PostGISCopyWriter
+from tasks.shapefile_parser import get_peak_rss, parse_shapefile, plan_windows, reset_peak_rss, to_geodataframe
 from utils.logger import TasksLogger
-from datetime import datetime
 
 
 class DeterRTLoader:
@@ -23,13 +32,20 @@ class DeterRTLoader:
 
         try:
             tmp_dir = self.data_source.get_tmp_directory()
+            manifest = BundleManifest(data_dir=tmp_dir, log_level=self.log_level)
 
-            temporary_tables, wrong_files = self.__shapefile_to_postgis(tmp_dir)
+            # the backup runs on a background thread while the files are loaded
+            backup_store = self.__start_backup(tmp_dir=tmp_dir)
+            try:
+                temporary_tables, wrong_files = self.__shapefile_to_postgis(tmp_dir, manifest=manifest)
 
-            self.__set_imported_file_list(files=temporary_tables)
+                self.__set_imported_file_list(files=temporary_tables)
+                manifest.remove(stems=temporary_tables)
+            finally:
+                stored_files = backup_store.wait()
 
-            # store all imported files to bkp directory
-            self.__backup_files(tmp_dir=tmp_dir, wrong_files=wrong_files)
+            self.__remove_files(stored_files=stored_files, wrong_files=wrong_files)
+            backup_store.apply_retention()
 
         except Exception as ex:
             ex_msg = "Failed to load data to output database"
@@ -37,54 +53,160 @@ class DeterRTLoader:
             self.logger.error(f"{ex}")
             raise Exception(ex_msg)
 
-    def __shapefile_to_postgis(self, data_dir: str) -> tuple[list[str],list[str]]:
-        """Import shapefiles to temporary table on Postgres/Postgis database."""
+    def __shapefile_to_postgis(self, data_dir: str, manifest: BundleManifest) -> tuple[list[str],list[str]]:
+        """
+        Import shapefiles to temporary table on Postgres/Postgis database.
+        A zipped bundle is read in place through GDAL's /vsizip/ file system.
+
+        The files are parsed by a pool of loader_workers processes, and the parsed files
+        are written, in order, by this process on one database connection. At most
+        loader_queue_depth files, or row windows, are parsed or waiting to be written at a time.
+        Files larger than the loader_memory_budget_mb setting are read and written in row
+        windows that fit in it, one transaction per file, so the memory does not grow with
+        the file size. The peak resident memory of each file is logged.
+
+        The geometries are normalized while parsed: reprojected to 4674 as MultiPolygons,
+        with their geodesic area and centroid, so the database copies these values.
+
+        Each parsed tile is also written to the GeoParquet cache, keyed by the etags of all
+        files of its bundle, as recorded by the manifest or in input_data, so reprocessing can
+        read it without parsing the shapefile again.
+
+        The loader_reader setting selects the parser, "fiona", "pyogrio" with Arrow output
+        or "memmap", the built-in reader of plain polygon shapefiles.
+
+        The loader_backend setting selects how the data is written: "to_postgis" uses
+        GeoDataFrame.to_postgis and "copy" streams the geometries as EWKB through a
+        binary COPY FROM STDIN into a pre-created table.
+
+        With the "deter_rt_temp" loader_target, the rows are tagged with the view_date and
+        tile_id from input_data and appended straight into the temporary table of the
+        transformer, instead of one table per file.
+
+        The rows are stamped with the open load batch, see OutputDatabase.open_load_batch,
+        which the transformer and the validator then process by its id. With the "tmp_schema"
+        target, the transformer stamps the rows when it unifies the tables.
+        """
 
         tables = []
         wrong_files = []
         ext = "shp"
         try:
 
-            engine = OutputDatabase(log_level=self.log_level).get_sqlalchemy_engine()
-
-            files = self.__get_files(data_dir=data_dir, extension=ext)
+            outputdb = OutputDatabase(log_level=self.log_level)
+            backend = outputdb.get_loader_backend()
+            target = outputdb.get_loader_target()
+            reader = outputdb.get_loader_reader()
+            workers = outputdb.get_loader_workers()
+            depth = outputdb.get_loader_queue_depth(workers=workers)
+            self.logger.info(
+                f"Using the {reader} reader and the {backend} loader backend to {target}, "
+                f"{workers} parser workers and queue depth {depth}"
+            )
+            engine = outputdb.get_sqlalchemy_engine()
+            writer = PostGISCopyWriter(database=outputdb.get_database_facade(), logger=self.logger)
+
+            files = self.__get_files(data_dir=data_dir, extensions=[ext, "zip"], manifest=manifest)
             num_files = len(files)
-            for filein in sorted(files):
-
-                # get name of file without extension
-                filein_tmp = str(str(filein).split(f".{ext}")[0]).split("/")
-                table_name = filein_tmp[len(filein_tmp) - 1]
 
-                # Read shapefile using GeoPandas
-                try:
-                    self.logger.debug(f"Reading shapefile {filein}")
-                    gdf = gpd.read_file(filein, engine="fiona")
-                    if gdf.crs is not None:
-                        self.logger.debug(f"CRS {gdf.crs} to shapefile {filein_tmp}")
-                    else:
-                        self.logger.error(f"Failed to read CRS for shapefile {filein_tmp}")
-                        wrong_files.append(filein_tmp)
-                        continue
+            # the rows of this run, up to the final table, are stamped with the open load batch
+            batch_id = outputdb.open_load_batch() if files else None
+
+            tags = {}
+            if target == "deter_rt_temp":
+                outputdb.prepare_direct_ingest()
+                tags = outputdb.get_input_file_tags(stems=[os.path.basename(f).split(".")[0] for f in files])
+
+            cache = self.__get_cache(outputdb=outputdb)
+            keys = self.__get_cache_keys(outputdb=outputdb, manifest=manifest, files=files) if cache else {}
+
+            budget = outputdb.get_loader_memory_budget_mb() * 1024 * 1024
+            jobs = [
+                (filein, start, stop) for filein in sorted(files) for start, stop in plan_windows(filein, budget)
+            ]
+            if len(jobs) > num_files:
+                self.logger.info(f"{num_files} files split in {len(jobs)} row windows of a {budget // 1024 // 1024} MB budget")
+
+            # the stop of the last window of each file
+            last_stop = {filein: stop for filein, _, stop in jobs}
+            connection = engine.connect()
+            transaction = None
+            parse_seconds = 0.0
+            write_seconds = 0.0
+            for (filein, start, stop), parsed, error in self.__parse_files(
+                jobs=jobs, reader=reader, workers=workers, depth=depth
+            ):
+
+                # the remaining windows of a file that failed
+                if filein in wrong_files:
+                    continue
 
-                except Exception as ex:
-                    self.logger.error(f"Failed to read shapefile {filein_tmp}")
-                    self.logger.error(f"{ex}")
-                    wrong_files.append(filein_tmp)
+                if error is not None:
+                    self.logger.error(f"Failed to read shapefile {filein}")
+                    self.logger.error(f"{error}")
+                    wrong_files.append(filein)
+                    writer.database.rollback()
+                    if transaction is not None:
+                        transaction.rollback()
+                        transaction = None
+                    if cache:
+                        cache.discard(keys.get(os.path.basename(filein).split(".")[0]))
                     continue
 
-                self.logger.debug(f"Importing shapefile {filein_tmp} to table {table_name}")
+                table_name = parsed["name"]
+                if start == 0:
+                    self.logger.debug(f"Importing shapefile {filein}, read with {parsed['reader']}, to table {table_name}")
 
-                # Import shapefile to database
-                gdf.to_postgis(
-                    name=table_name,
-                    con=engine,
-                    if_exists="replace",
-                    index=True,
-                    index_label="id",
-                    schema="tmp",
-                )
+                    if target == "deter_rt_temp" and table_name not in tags:
+                        self.logger.error(f"Missing input_data tags for shapefile {filein}")
+                        wrong_files.append(filein)
+                        continue
 
-                tables.append(table_name)
+                    reset_peak_rss()
+                    file_stats = {"rows": 0, "windows": 0, "parse": 0.0, "write": 0.0, "parse_rss": 0}
+                    use_engine = target != "deter_rt_temp" and backend == "to_postgis"
+                    transaction = connection.begin() if use_engine else None
+
+                last = stop == last_stop[filein]
+                began = perf_counter()
+                self.__write_window(
+                    outputdb=outputdb,
+                    writer=writer,
+                    connection=connection,
+                    transaction=transaction,
+                    parsed=parsed,
+                    tag=tags.get(table_name),
+                    batch_id=batch_id,
+                    last=last,
+                )
+                seconds = perf_counter() - began
+
+                if cache:
+                    cache.append(key=keys.get(table_name), parsed=parsed)
+
+                file_stats["rows"] += parsed["rows"]
+                file_stats["windows"] += 1
+                file_stats["parse"] += parsed["parse_seconds"]
+                file_stats["write"] += seconds
+                file_stats["parse_rss"] = max(file_stats["parse_rss"], parsed["peak_rss"])
+
+                if last:
+                    parse_seconds += file_stats["parse"]
+                    write_seconds += file_stats["write"]
+                    self.logger.info(
+                        f"Loaded {table_name}: {file_stats['rows']} rows in {file_stats['windows']} windows, "
+                        f"parse {file_stats['parse']:.2f} s, write {file_stats['write']:.2f} s, "
+                        f"peak RSS parse {file_stats['parse_rss'] / 1024 / 1024:.0f} MB, "
+                        f"writer {get_peak_rss() / 1024 / 1024:.0f} MB"
+                    )
+                    tables.append(table_name)
+                    transaction = None
+                    if cache:
+                        cache.commit(key=keys.get(table_name))
+
+            connection.close()
+            if cache:
+                cache.apply_retention()
 
             if num_files == 0:
                 self.logger.warning(f"No {ext} files found on {data_dir}")
@@ -97,6 +219,9 @@ class DeterRTLoader:
                     f"Only {len(tables)} of {num_files} {ext} files were imported to database"
                 )
 
+            if tables:
+                self.logger.info(f"Total parse time {parse_seconds:.2f} s, total write time {write_seconds:.2f} s")
+
         except Exception as ex:
             ex_msg = f"Failed to transform {ext} files"
             self.logger.error(ex_msg)
@@ -105,15 +230,174 @@ class DeterRTLoader:
 
         return tables, wrong_files
 
-    def __get_files(self, data_dir: str, extension: str) -> list[str]:
-        """Get all files from a data directory, as per the extension."""
+    def __get_cache(self, outputdb: OutputDatabase) -> GeoParquetCache:
+        """Return the GeoParquet cache of parsed tiles, or None if it is disabled."""
 
-        files = glob.glob(os.path.join(data_dir, f"*.{extension}"))
+        enabled, max_size_mb, max_age_days = outputdb.get_cache_settings()
+        if not enabled:
+            return None  # type: ignore
 
-        self.logger.info(f"Found {len(files)} *.{extension} files on {data_dir}")
+        return GeoParquetCache(
+            cache_dir=self.data_source.get_cache_directory(),
+            log_level=self.log_level,
+            max_size_mb=max_size_mb,
+            max_age_days=max_age_days,
+        )
+
+    def __get_cache_keys(self, outputdb: OutputDatabase, manifest: BundleManifest, files: list[str]) -> dict[str, str]:
+        """
+        Get the GeoParquet cache key of each file, from the etags of all files of its bundle.
+        The etags recorded by the manifest are used, and input_data for the bundles without them.
+
+        Return: dict of stem to cache key
+        """
+
+        stems = [os.path.basename(f).split(".")[0] for f in files]
+        etags = {b["stem"]: b["etags"] for b in manifest.read() if b.get("etags")}
+        missing = [s for s in stems if s not in etags]
+        if missing:
+            etags.update(outputdb.get_input_file_etags(stems=missing))
+
+        return {stem: GeoParquetCache.get_key(etags.get(stem)) for stem in stems}
+
+    def __parse_files(
+        self, jobs: list[tuple[str, int, int]], reader: str, workers: int, depth: int
+    ) -> Iterator[tuple[tuple[str, int, int], dict, Exception]]:
+        """
+        Parse the row windows of the files, serially when there is one worker, or on a pool
+        of worker processes. With the pool, at most depth windows are submitted ahead of the writer.
+
+        Return: yields (job, parsed window, None) or (job, None, the error), in the order of the jobs.
+        """
+
+        if workers <= 1:
+            for job in jobs:
+                self.logger.debug(f"Reading shapefile {job[0]}, rows {job[1]} to {job[2]}")
+                try:
+                    yield job, parse_shapefile(job[0], reader, job[1], job[2]), None
+                except Exception as ex:
+                    yield job, None, ex
+            return
+
+        pending = deque()
+        remaining = iter(jobs)
+        # spawned workers, a fork taken while the backup thread holds a lock could deadlock;
+        # they import the main module again, see main for the guarded entry point
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            for job in islice(remaining, depth):
+                pending.append((job, executor.submit(parse_shapefile, job[0], reader, job[1], job[2])))
+
+            while pending:
+                job, future = pending.popleft()
+                try:
+                    parsed, error = future.result(), None
+                except Exception as ex:
+                    parsed, error = None, ex
+
+                # keep the queue full while the writer works on this window
+                nextjob = next(remaining, None)
+                if nextjob is not None:
+                    pending.append(
+                        (nextjob, executor.submit(parse_shapefile, nextjob[0], reader, nextjob[1], nextjob[2]))
+                    )
+
+                yield job, parsed, error
+
+    def __write_window(
+        self,
+        outputdb: OutputDatabase,
+        writer: PostGISCopyWriter,
+        connection,
+        transaction,
+        parsed: dict,
+        tag: tuple,
+        batch_id: int,
+        last: bool,
+    ):
+        """
+        Write one parsed row window of a shapefile to the database, as per the loader backend
+        and target. The file is committed with its last window, and rolled back on errors.
+
+        Parameters
+        ----
+        :param:connection, transaction: The SQLAlchemy connection and the transaction of the file, used by to_postgis.
+        :param:tag: The (view_date, tile_id) of the file for the "deter_rt_temp" target, otherwise None.
+        :param:batch_id: The load batch stamped on the rows of the "deter_rt_temp" target.
+        :param:last: True for the last window of the file.
+        """
+
+        table_name = parsed["name"]
+        first = parsed["start"] == 0
+        try:
+            if tag is not None:
+                view_date, tile_id = tag
+                writer.write_tagged(
+                    table=f"pg_temp.{outputdb.ingest_table}",
+                    wkb=parsed["wkb"],
+                    dates=parsed["dates"],
+                    area_km=parsed["area_km"],
+                    lon=parsed["lon"],
+                    lat=parsed["lat"],
+                    view_date=view_date,
+                    tile_id=tile_id,
+                )
+                if last:
+                    rows = outputdb.ingest_to_temp_table(batch_id=batch_id)
+                    writer.database.commit()
+                    self.logger.debug(f"{rows} rows of {table_name} appended to {outputdb.temp_table}")
+            elif transaction is None:
+                writer.write_table(
+                    schema="tmp",
+                    table=table_name,
+                    srid=parsed["srid"],
+                    wkb=parsed["wkb"],
+                    dates=parsed["dates"],
+                    area_km=parsed["area_km"],
+                    lon=parsed["lon"],
+                    lat=parsed["lat"],
+                    start=parsed["start"],
+                )
+                if last:
+                    writer.database.commit()
+            else:
+                to_geodataframe(parsed).to_postgis(
+                    name=table_name,
+                    con=connection,
+                    if_exists="replace" if first else "append",
+                    index=True,
+                    index_label="id",
+                    schema="tmp",
+                )
+                if last:
+                    transaction.commit()
+        except Exception as ex:
+            if transaction is not None:
+                transaction.rollback()
+            writer.database.rollback()
+            raise ex
+
+    def __get_files(self, data_dir: str, extensions: list[str], manifest: BundleManifest) -> list[str]:
+        """
+        Get the files of the ready bundles listed in the manifest written by the collector,
+        the shapefile or the archive of each bundle.
+        Without a manifest, get all files from a data directory, as per the extensions.
+        """
+
+        suffixes = tuple(f".{ext}" for ext in extensions)
+        if manifest.exists():
+            names = [b.get('archive') or b['shapefile'] for b in manifest.read()]
+            names = [n for n in names if n and n.lower().endswith(suffixes)]
+            files = [os.path.join(data_dir, n) for n in names]
+            files = [f for f in files if os.path.isfile(f)]
+            self.logger.info(f"Found {len(files)} ready bundles of {len(names)} in the manifest on {data_dir}")
+        else:
+            files = []
+            for ext in extensions:
+                files.extend(glob.glob(os.path.join(data_dir, f"*.{ext}")))
+            self.logger.warning(f"Missing bundle manifest, found {len(files)} files on {data_dir}")
 
         files = OutputDatabase(log_level=self.log_level).get_input_files_to_import(
-            files=files, extension=extension
+            files=files, extensions=extensions
         )
 
         self.logger.info(f"Found {len(files)} files on database not imported yet")
@@ -124,17 +408,16 @@ class DeterRTLoader:
         """Update the input_data table to set the import_date field."""
 
         outdb = OutputDatabase(log_level=self.log_level)
-        for file_name in files:
-            outdb.update_imported_file(file_name=file_name)
+        outdb.update_imported_files(file_names=files)
 
-    def __backup_files(self, tmp_dir: str, wrong_files: list [str], extension_list: list [str] = []):
+    def __start_backup(self, tmp_dir: str, extension_list: list [str] = []) -> BackupStore:
         """
-        Store all files from a temporary directory to backup directory, as per the extension list.
+        Start to store all files from a temporary directory in the backup store, as per the extension list.
+        The files are stored on a background thread, see BackupStore.wait.
 
         Parameters:
         ----
         :param:tmp_dir a location to find files.
-        :param:wrong_files a list of files that were not imported correctly into the database.
         :param:extension_list a list of file extensions like this: ['shz','sbn','sbx','dbf','prj','shx','shp','cpg','xml']
         """
 
@@ -148,24 +431,43 @@ class DeterRTLoader:
             "shp",
             "cpg",
             "xml",
+            "zip",
         ] if not extension_list else extension_list
 
         any_files = []
         for ext in extension_list:
             any_files.extend(glob.glob(f"{tmp_dir}/*.{ext}"))
 
-        backup_directory = self.data_source.get_backup_directory()
-        today = datetime.now().strftime("%Y_%m_%d")
-        archive_name = f"deter_rt_{today}"
-
-        shutil.make_archive(
-            base_name=f"{backup_directory}/{archive_name}",
-            format="zip",
-            root_dir=tmp_dir,
+        backup_store = BackupStore(
+            backup_dir=self.data_source.get_backup_directory(),
+            log_level=self.log_level,
+            retention_days=OutputDatabase(log_level=self.log_level).get_backup_retention_days(),
         )
+        backup_store.start(files=sorted(any_files))
+
+        return backup_store
 
-        # remove files 
-        for f in any_files:
-            # only if was imported properly to database.
-            if f not in wrong_files:
+    def __remove_files(self, stored_files: list[str], wrong_files: list[str]):
+        """
+        Remove the files that are safely in the backup store, except the files of the bundles
+        that were not imported correctly into the database, which are kept for the next run.
+        """
+
+        wrong_stems = {os.path.basename(f).split(".")[0] for f in wrong_files}
+        for f in stored_files:
+            if os.path.basename(f).split(".")[0] not in wrong_stems:
                 pathlib.Path(f).unlink(missing_ok=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the downloaded shapefiles into the output database.")
+    parser.add_argument("--log-level", default="INFO", help="the log level of the tasks")
+    args = parser.parse_args()
+
+    DeterRTLoader(log_level=args.log_level).data_loader()
+
+
+# the parser workers are spawned processes, which import the main module again, so the
+# loader runs from this guarded entry point: python -m tasks.deter_rt_loader
+if __name__ == "__main__":
+    main()
@@ -1,78 +1,85 @@
-from tasks.http_data_source import HTTPDataSource
+from time import perf_counter
+from typing import Callable
 from tasks.output_database import OutputDatabase
 from utils.logger import TasksLogger
 
 
 class DeterRTTransformer():
-    """DeterRTTransformer: The DETER RT data processor."""
+    """
+    DeterRTTransformer: The DETER RT data processor.
+
+    The whole chain of steps runs as one unit of work: one connection and one transaction,
+    committed at the end, with a savepoint per step. A failure on any step rolls back every
+    step, so the temporary tables are kept and the next run processes them again.
+
+    The rows are moved with the open load batch, which is then marked as transformed,
+    so the validator works only on the rows of this batch.
+    """
 
     def __init__(self, log_level: str="DEBUG"):
         self.log_level = log_level
         self.logger = TasksLogger(self.__class__.__name__)
         self.logger.setLoggerLevel(level=log_level)
-        self.data_source = HTTPDataSource(log_level=log_level)
 
-    def process_data(self):
+    def process_data(self) -> dict:
         """
         Used to read temporary tables and write the alerts into the final table.
         Some adjustments on the data will be made here.
         1) Update the view_date and tile_id on temporary table with the file_date and tile_id from input_data.
         2) Read all temporary tables from the tmp schema and insert data into the final table on public schema.
+        3) Remove duplicate geometries and the ones already on the final table.
+           The monthly partitions of the final table are created for the new dates.
         4) Remove temporary tables.
+
+        Return: dict with the (seconds, rows) of each step.
         """
 
+        outdb = OutputDatabase(log_level=self.log_level)
+        database = outdb.get_database_facade()
+        stats = {}
         try:
-            self.__update_tmp_data()
-            self.__unify_data()
-            self.__remove_duplicate_geometries()
-            self.__temp_to_final()
-            self.__truncate_temp_table()
-        except Exception as ex:
-            self.logger.error(f"Error processing data: {ex}")
-            raise ex
-        
-        try:
-            self.__remove_tmp_tables()
+            batch_id = outdb.open_load_batch()
+            tmp_tables = outdb.get_tmp_tables()
+            self.__run_step(outdb, stats, "update_tmp_data", lambda: sum(outdb.update_tmp_table(table=t) for t in tmp_tables))
+            self.__run_step(outdb, stats, "unify_data", lambda: outdb.unify_data(tables=tmp_tables, batch_id=batch_id))
+            self.__run_step(outdb, stats, "remove_duplicate_geometries", outdb.remove_duplicate_geometries)
+            self.__run_step(
+                outdb,
+                stats,
+                "ensure_partitions",
+                lambda: outdb.ensure_monthly_partitions(outdb.current_table, *outdb.get_temp_table_dates()),
+            )
+            self.__run_step(outdb, stats, "temp_to_final", outdb.tmp_to_final)
+            outdb.set_load_batch_status(batch_ids=[batch_id], status="transformed", rows=stats["temp_to_final"][1])
+            self.__run_step(outdb, stats, "truncate_temp_table", outdb.truncate_temp_table)
+            self.__run_step(outdb, stats, "remove_tmp_tables", lambda: outdb.drop_tmp_tables(tables=tmp_tables))
+            database.commit()
         except Exception as ex:
-            self.logger.error(f"Error removing temporary tables: {ex}")
+            database.rollback()
+            self.logger.error(f"Error processing data, nothing was applied: {ex}")
             raise ex
+        finally:
+            database.close()
 
-    def __update_tmp_data(self):
-        """Update the view_date and tile_id on temporary table with the file_date and tile_id from input_data."""
-
-        outdb = OutputDatabase(log_level=self.log_level)
-        tmp_tables = outdb.get_tmp_tables()
-        for table in tmp_tables:
-            outdb.update_tmp_table(table=table)
-            
-    def __unify_data(self,):
-        """Read all temporary tables from the tmp schema and insert data into a single table on public schema."""
-
-        outdb = OutputDatabase(log_level=self.log_level)
-        outdb.unify_data()
-            
-    def __remove_duplicate_geometries(self):
-        """Remove duplicate geometries from the temporary table and
-        remove records that already exist in the final table.
-        """
-
-        outdb = OutputDatabase(log_level=self.log_level)
-        outdb.remove_duplicate_geometries()
-
-    def __temp_to_final(self):
-        """Insert data from all temporary tables on tmp schema into the final table on public schema."""
+        self.logger.info(
+            f"Processed batch {batch_id}, {len(tmp_tables)} temporary tables, in {sum(s for s, _ in stats.values()):.2f} s: "
+            + ", ".join(f"{name} {rows} rows in {seconds:.2f} s" for name, (seconds, rows) in stats.items())
+        )
+        return stats
 
-        outdb = OutputDatabase(log_level=self.log_level)
-        outdb.tmp_to_final()  
-        
-    def __truncate_temp_table(self):
-        """Truncate the temporary table on public schema."""
+    def __run_step(self, outdb: OutputDatabase, stats: dict, name: str, step: Callable[[], int]):
+        """Run one step inside its own savepoint, recording its time and the rows it touched."""
 
-        outdb = OutputDatabase(log_level=self.log_level)
-        outdb.truncate_temp_table()  
-
-    def __remove_tmp_tables(self):
-        """Remove all temporary tables from tmp schema."""
+        database = outdb.get_database_facade()
+        database.execute(sql=f"SAVEPOINT {name};")
+        started_at = perf_counter()
+        try:
+            rows = step()
+        except Exception as ex:
+            database.execute(sql=f"ROLLBACK TO SAVEPOINT {name};")
+            self.logger.error(f"Step {name} failed after {perf_counter() - started_at:.2f} s: {ex}")
+            raise ex
 
-        outdb = OutputDatabase(log_level=self.log_level)
-        outdb.drop_tmp_tables()
+        database.execute(sql=f"RELEASE SAVEPOINT {name};")
+        stats[name] = (perf_counter() - started_at, rows)
+        self.logger.debug(f"Step {name}: {rows} rows in {stats[name][0]:.2f} s")
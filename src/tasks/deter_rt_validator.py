@@ -1,4 +1,3 @@
-from tasks.http_data_source import HTTPDataSource
 from tasks.output_database import OutputDatabase
 from utils.logger import TasksLogger
 
@@ -10,14 +9,15 @@ class DeterRTValidator:
         self.log_level = log_level
         self.logger = TasksLogger(self.__class__.__name__)
         self.logger.setLoggerLevel(level=log_level)
-        self.data_source = HTTPDataSource(log_level=log_level)
 
     def validation(self):
-        """Used to validate the data loaded into output database."""
+        """Used to validate the data of the load batches moved to the final table by the transformer."""
 
         try:
             outputdb = OutputDatabase(log_level=self.log_level)
-            outputdb.validate_data()
+            batch_ids = outputdb.get_load_batches(status="transformed")
+            self.logger.info(f"Validating the load batches {batch_ids}")
+            outputdb.validate_data(batch_ids=batch_ids)
 
         except Exception as ex:
             ex_msg = "Failed to validate data on output database"
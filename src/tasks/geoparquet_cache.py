@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import re
+from time import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import CRS
+from tasks.shapefile_parser import TARGET_SRID, normalize, set_wkb_srid, strip_wkb_srid
+from utils.logger import TasksLogger
+
+
+class GeoParquetCache:
+    """
+    GeoParquet Cache: The parsed tiles kept as GeoParquet files, keyed by a digest of the
+    ETags of all files of the bundle, see get_key, so a change to any of them misses the cache.
+
+    Each file has the "Date_dt" column as text, the geometry column as WKB and the area_km,
+    lon and lat computed at parse time, with the GeoParquet "geo" metadata and the tile name and SRID in the "deter_rt" metadata.
+    A file is written to a temporary name, one row window at a time, and renamed when the
+    tile is complete, so a reader never sees a partial tile. Reading a file renews its age.
+
+    The cache is an optimization: a failure to write it is logged, and the load goes on.
+    """
+
+    SCHEMA = pa.schema(
+        [
+            ("Date_dt", pa.string()),
+            ("geometry", pa.binary()),
+            ("area_km", pa.float64()),
+            ("lon", pa.float64()),
+            ("lat", pa.float64()),
+        ]
+    )
+
+    def __init__(self, cache_dir: str, log_level: str, max_size_mb: int, max_age_days: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        self.max_age = max_age_days * 24 * 3600
+        self.logger = TasksLogger(self.__class__.__name__)
+        self.logger.setLoggerLevel(level=log_level)
+        # the writers of the tiles being written, by key
+        self.writers = {}
+
+    @staticmethod
+    def get_key(etags: dict[str, str]) -> str:
+        """
+        Return the cache key of a bundle, the SHA-256 of the ETags of its files by file name.
+
+        Return: str, or None if no ETag is known
+        """
+
+        if not etags:
+            return None  # type: ignore
+
+        members = "\n".join(f"{name}:{str(etag).strip(chr(34))}" for name, etag in sorted(etags.items()))
+        return hashlib.sha256(members.encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        """Return the path of the cached tile of the key."""
+
+        return os.path.join(self.cache_dir, f"{re.sub(r'[^A-Za-z0-9_-]', '', str(key))}.parquet")
+
+    def __metadata(self, key: str, parsed: dict) -> dict:
+        crs = CRS.from_user_input(parsed["crs"]).to_json_dict() if parsed["crs"] else None
+        geo = {
+            "version": "1.0.0",
+            "primary_column": "geometry",
+            "columns": {"geometry": {"encoding": "WKB", "geometry_types": [], "crs": crs}},
+        }
+        deter_rt = {"name": parsed["name"], "key": key, "srid": parsed["srid"]}
+
+        return {b"geo": json.dumps(geo).encode("utf-8"), b"deter_rt": json.dumps(deter_rt).encode("utf-8")}
+
+    def append(self, key: str, parsed: dict):
+        """Write a parsed row window of a tile, opening the tile on its first window."""
+
+        if key is None:
+            return
+
+        try:
+            if parsed["start"] == 0:
+                self.discard(key)
+                schema = self.SCHEMA.with_metadata(self.__metadata(key, parsed))
+                self.writers[key] = pq.ParquetWriter(f"{self.get_path(key)}.tmp", schema)
+            elif key not in self.writers:
+                return
+
+            table = pa.table(
+                {
+                    "Date_dt": pa.array(parsed["dates"], type=pa.string()),
+                    "geometry": pa.array([strip_wkb_srid(g) for g in parsed["wkb"]], type=pa.binary()),
+                    "area_km": pa.array(parsed["area_km"], type=pa.float64()),
+                    "lon": pa.array(parsed["lon"], type=pa.float64()),
+                    "lat": pa.array(parsed["lat"], type=pa.float64()),
+                },
+                schema=self.writers[key].schema,
+            )
+            self.writers[key].write_table(table)
+        except Exception as ex:
+            self.logger.warning(f"Failed to write {parsed['name']} to the GeoParquet cache: {ex}")
+            self.discard(key)
+
+    def commit(self, key: str):
+        """Close the tile of the key after its last window and make it visible."""
+
+        writer = self.writers.pop(key, None)
+        if writer is None:
+            return
+
+        try:
+            writer.close()
+            os.replace(f"{self.get_path(key)}.tmp", self.get_path(key))
+        except Exception as ex:
+            self.logger.warning(f"Failed to write {key} to the GeoParquet cache: {ex}")
+
+    def discard(self, key: str):
+        """Drop the partial tile of the key, if it is being written."""
+
+        writer = self.writers.pop(key, None)
+        if writer is None:
+            return
+
+        try:
+            writer.close()
+        finally:
+            if os.path.isfile(f"{self.get_path(key)}.tmp"):
+                os.remove(f"{self.get_path(key)}.tmp")
+
+    def read(self, key: str) -> dict:
+        """
+        Read the cached tile of the key, in the layout returned by parse_shapefile,
+        with the geometries as EWKB with the SRID of the tile. The tiles cached before the
+        normalization at parse time are normalized when read.
+
+        Return: dict, or None if the tile is not cached
+        """
+
+        path = self.get_path(key)
+        if not os.path.isfile(path):
+            return None  # type: ignore
+
+        table = pq.read_table(path)
+        deter_rt = json.loads(table.schema.metadata[b"deter_rt"])
+        geo = json.loads(table.schema.metadata[b"geo"])
+        crs = geo["columns"]["geometry"]["crs"]
+        os.utime(path)
+
+        srid = deter_rt["srid"]
+        crs = CRS.from_json_dict(crs).to_wkt() if crs else None
+        wkb = table.column("geometry").to_pylist()
+        if srid is not None:
+            wkb = [None if g is None else set_wkb_srid(g, srid) for g in wkb]
+
+        if "area_km" in table.column_names:
+            area_km, lon, lat = (table.column(c).to_numpy(zero_copy_only=False) for c in ("area_km", "lon", "lat"))
+        else:
+            if crs is None:
+                return None  # type: ignore
+            wkb, area_km, lon, lat = normalize(wkb, crs)
+            srid, crs = TARGET_SRID, CRS.from_epsg(TARGET_SRID).to_wkt()
+
+        return {
+            "name": deter_rt["name"],
+            "srid": srid,
+            "crs": crs,
+            "wkb": wkb,
+            "dates": table.column("Date_dt").to_pylist(),
+            "area_km": area_km,
+            "lon": lon,
+            "lat": lat,
+            "start": 0,
+            "rows": table.num_rows,
+        }
+
+    def apply_retention(self):
+        """Remove the tiles older than the maximum age, then the least recently used ones above the maximum size."""
+
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".parquet") and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        removed = 0
+        now = time()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in sorted(files):
+            if (self.max_age and now - mtime > self.max_age) or (self.max_size and total > self.max_size):
+                os.remove(path)
+                total -= size
+                removed += 1
+
+        self.logger.info(
+            f"GeoParquet cache: {len(files) - removed} tiles, {total / 1024 / 1024:.0f} MB, {removed} removed by retention."
+        )
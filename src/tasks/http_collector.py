@@ -19,20 +19,21 @@ class HTTPCollector(Collector):
         self.outdb: DatabaseFacade
 
         try:
-            self.outdb = OutputDatabase(log_level=self.log_level).get_database_facade(keep_connection=True)
+            # the facade is kept by outputdb, so the control table is written in the same transaction
+            outputdb = OutputDatabase(log_level=self.log_level)
+            self.outdb = outputdb.get_database_facade(keep_connection=True)
         except Exception as exc:
             self.logger.error("Error connecting to output database.")
             raise exc
 
         try:
 
-            outputdb = OutputDatabase(log_level=self.log_level)
             reference_date = outputdb.get_max_date_input_file()
 
-            file_list = self.data_source.make_shapefile_list(reference_date=reference_date, output_db=self.outdb)
+            bundle_list = self.data_source.make_bundle_list(reference_date=reference_date, output_db=outputdb)
 
-            for file in file_list:
-                self.data_source.download_file(output_db=self.outdb, file=file)
+            # a bundle that failed is not registered, so it is resumed on the next run
+            self.data_source.download_bundles(output_db=outputdb, bundle_list=bundle_list)
 
             self.outdb.commit()
         except Exception as exc:
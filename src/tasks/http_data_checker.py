@@ -28,7 +28,7 @@ class HTTPDataChecker:
         If this file exists in the remote shared directory, the execution process should be stopped.
         """
         lock_file="upload.lock"
-        ctrl_files = []
+        has_new_files = False
         try:
             if self.data_source.lock_file_exists(lock_file=lock_file):
                 self.logger.debug(f"Found {lock_file} on remote server. Abort.")
@@ -39,12 +39,12 @@ class HTTPDataChecker:
                 reference_date = outputdb.get_max_date_input_file()
                 self.logger.debug(f"Reference date to check new data: {reference_date}")
 
-                ctrl_files=self.data_source.make_shapefile_list(reference_date=reference_date, output_db=self.database)
-                self.logger.debug(f"Found {len(ctrl_files)} new files on remote server.")
+                has_new_files = self.data_source.has_new_files(reference_date=reference_date, output_db=outputdb)
+                self.logger.debug(f"Found new files on remote server: {has_new_files}")
 
         except Exception as e:
             self.logger.error("Failed to read remote data.")
             self.logger.error(f"{e}")
 
-        return len(ctrl_files) > 0
+        return has_new_files
 
@@ -1,16 +1,28 @@
 import os
 import pathlib
+import shutil
 import requests
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote
+from xml.sax.saxutils import escape
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError, RequestException
 from airflow.models import Connection
 from airflow.hooks.base import BaseHook
 from utils.logger import TasksLogger
+from tasks.bundle_manifest import BundleManifest
+from tasks.http_download_engine import HTTPDownloadEngine
+from tasks.remote_listing_cache import RemoteListingCache
 from webdav3.client import Client
-from webdav3.exceptions import ConnectionException
+from webdav3.exceptions import ConnectionException, NoConnection, ResponseErrorCode
 from datetime import date
-from utils.database_facade import DatabaseFacade
-from datetime import datetime
-from time import sleep
+from tasks.output_database import OutputDatabase
+from utils.retry_policy import RetryPolicy
+from datetime import datetime, timedelta
+
+
+class IncompleteDownloadError(RequestException):
+    """The downloaded data does not match the size listed by the remote server."""
 
 
 class HTTPDataSource:
@@ -18,13 +30,23 @@ class HTTPDataSource:
     # the Airflow connection ids
     WEBDAV_CONNECTION_ID = "DETER_RT_WEBDAV_NEXTCLOUD"
     data_source_config: Connection = None
+    # HTTP status codes of transient failures, worth another attempt
+    RETRYABLE_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+    # the DAV namespace used to read the SEARCH responses
+    DAV_NS = {"d": "DAV:"}
 
     def __init__(self, log_level: str, project_dir: str = ""):
         self.project_dir = project_dir
         self.logger = TasksLogger(self.__class__.__name__)
         self.logger.setLoggerLevel(level=log_level)
+        self.log_level = log_level
         self.__fill_airflow_configuration()
+        self.retry_policy = RetryPolicy.from_settings(self.data_source_config.extra_dejson)
+        self.session = self.__create_session()
         self.client = self.__connect()
+        self.listing_cache: RemoteListingCache = None  # type: ignore
+        # turned off after the first failed SEARCH, to use PROPFIND for the rest of the run
+        self.search_supported = True
 
     def __fill_airflow_configuration(self):
 
@@ -35,6 +57,23 @@ class HTTPDataSource:
                 f"Connection config not found on Airflow connections. Connection id: {self.WEBDAV_CONNECTION_ID}"
             )
 
+    def __create_session(self) -> requests.Session:
+        """
+        Prepare the keep-alive HTTP session shared by all WebDAV requests and return it.
+        The connection pool must hold at least one connection per download worker.
+        """
+
+        session = requests.Session()
+        session.auth = self.get_data_source_credential()
+
+        pool_size = max(self.get_http_pool_size(), self.get_download_workers())
+        # retries are handled by the retry policy
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0, pool_block=True)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
     def __connect(self) -> Client:
         """Prepare a client connection to WebDav and return it."""
 
@@ -46,78 +85,554 @@ class HTTPDataSource:
             "webdav_login": user,
             "webdav_password": password,
             "webdav_root": "/",
-            "webdav_verbose": "on"
+            "webdav_verbose": "on",
+            "webdav_timeout": self.get_http_timeout()[1],
         }
 
         try:
             client = Client(options=options)
+            # share the pooled connections with listing and lock checks
+            client.session = self.session
         except ConnectionException as connexc:
             self.logger.error("WebDav connection failed.")
             raise connexc
 
         return client
 
+    def get_connection_stats(self) -> dict:
+        """
+        Read the connection reuse counters of the shared HTTP session.
+
+        Return: dict with the number of requests, of opened connections and of requests that reused a connection.
+        """
+
+        stats = {"requests": 0, "connections": 0, "reused": 0}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats["requests"] += pool.num_requests
+                stats["connections"] += pool.num_connections
+
+        stats["reused"] = max(stats["requests"] - stats["connections"], 0)
+
+        return stats
+
+    @classmethod
+    def is_retryable(cls, exc: Exception) -> bool:
+        """Whether the exception raised by a WebDAV call is a transient failure."""
+
+        if isinstance(exc, HTTPError):
+            return exc.response is None or exc.response.status_code in cls.RETRYABLE_STATUS_CODES
+        if isinstance(exc, ResponseErrorCode):
+            return int(exc.code) in cls.RETRYABLE_STATUS_CODES
+        return isinstance(exc, (RequestException, ConnectionException, NoConnection))
+
     def lock_file_exists(self, lock_file: str) -> bool:
         remote_path_base = f"{self.get_remote_directory()}"
         self.logger.debug(f"{remote_path_base} path on remote server.")
 
-        return self.client.check(remote_path=f"{remote_path_base}/{lock_file}")
+        return self.retry_policy.call(
+            self.remote_path_exists,
+            remote_path=f"{remote_path_base}/{lock_file}",
+            is_retryable=self.is_retryable,
+            logger=self.logger,
+            description="check the lock file",
+        )
+
+    def remote_path_exists(self, remote_path: str) -> bool:
+        """
+        Check whether a remote file or directory exists with a depth 0 PROPFIND on the shared session.
+        Unlike the WebDAV client check, a failed request raises an HTTPError, so the retry
+        policy can try a transient 5xx again instead of taking it as a missing path.
+        """
+
+        response = self.session.request(
+            "PROPFIND",
+            f"{self.get_data_source_base_url()}/{remote_path}",
+            headers={"Depth": "0"},
+            timeout=self.get_http_timeout(),
+        )
+        if response.status_code == 404:
+            return False
+
+        response.raise_for_status()
+        return True
     
-    def verify_file_exists(self, output_db: DatabaseFacade, file_name: str) -> bool:
+    def get_listing_cache(self) -> RemoteListingCache:
+        """Return the persistent cache of the remote listing, stored in the data directory."""
+
+        if self.listing_cache is None:
+            self.listing_cache = RemoteListingCache(
+                db_path=f"{self.get_data_directory()}/listing_cache.sqlite", log_level=self.log_level
+            )
+        return self.listing_cache
+
+    def __list_remote_directory(self, remote_path_base: str, reference_date: date = None) -> list[dict]:  # type: ignore
+        """
+        Return the entries of the remote directory, or None if it does not exist.
+        A listing younger than listing_cache_ttl seconds is served from the cache.
+
+        With the "search" listing backend, the date and extension filters are sent
+        to the server in a WebDAV SEARCH request, so only new files are returned.
+        If the server does not support it, the full PROPFIND listing is used.
+        """
+
+        cache = self.get_listing_cache()
+
+        if self.get_listing_backend() == "search" and self.search_supported:
+            cache_key = f"search:{remote_path_base}:{reference_date}"
+            remote_folder_info = cache.get_listing(remote_dir=cache_key, max_age=self.get_listing_cache_ttl())
+            if remote_folder_info is not None:
+                return remote_folder_info
+
+            remote_folder_info = self.__search_remote_directory(remote_path_base=remote_path_base, reference_date=reference_date)
+            if remote_folder_info is not None:
+                cache.put_listing(remote_dir=cache_key, entries=remote_folder_info)
+                return remote_folder_info
+
+        remote_folder_info = cache.get_listing(remote_dir=remote_path_base, max_age=self.get_listing_cache_ttl())
+        if remote_folder_info is not None:
+            return remote_folder_info
+
+        remote_path_exists = self.retry_policy.call(
+            self.remote_path_exists,
+            remote_path=remote_path_base,
+            is_retryable=self.is_retryable,
+            logger=self.logger,
+            description="check the remote directory",
+        )
+
+        if not remote_path_exists:
+            return None  # type: ignore
+
+        remote_folder_info = self.retry_policy.call(
+            self.client.list,
+            remote_path_base,
+            get_info=True,
+            is_retryable=self.is_retryable,
+            logger=self.logger,
+            description="list the remote directory",
+        )
+        cache.put_listing(remote_dir=remote_path_base, entries=remote_folder_info)
+
+        return remote_folder_info
+
+    def __get_search_scope(self, remote_path_base: str) -> str:
+        """
+        Return the SEARCH scope of the remote directory, relative to the DAV endpoint,
+        from the search_scope setting or derived from the remote directory. None if unknown.
+        """
+
+        scope = self.data_source_config.extra_dejson.get("search_scope")
+        if scope:
+            return f"/{str(scope).strip('/')}"
+
+        remote_path_base = f"/{remote_path_base.strip('/')}"
+        endpoint = f"/{self.get_search_endpoint()}/"
+        if endpoint in remote_path_base:
+            return f"/{remote_path_base.split(endpoint, 1)[1]}"
+
+        # the legacy WebDAV endpoint maps to the files of the logged user
+        legacy_endpoint = "/remote.php/webdav/"
+        if legacy_endpoint in remote_path_base:
+            user, _ = self.get_data_source_credential()
+            return f"/files/{user}/{remote_path_base.split(legacy_endpoint, 1)[1]}"
+
+        return None  # type: ignore
+
+    def __build_search_request(self, scope: str, reference_date: date) -> str:
+        """Build the RFC 5323 SEARCH body that filters the files by date and by extension."""
+
+        likes = [
+            f"<d:like><d:prop><d:displayname/></d:prop><d:literal>%{escape(ext.strip())}</d:literal></d:like>"
+            for ext in self.get_shapefile_sufixes()
+        ]
+        conditions = [likes[0] if len(likes) == 1 else f"<d:or>{''.join(likes)}</d:or>"]
+
+        if reference_date is not None:
+            # the same as the client filter: files modified after the reference date, in GMT
+            since = (reference_date + timedelta(days=1)).strftime("%Y-%m-%dT00:00:00Z")
+            conditions.append(
+                f"<d:gte><d:prop><d:getlastmodified/></d:prop><d:literal>{since}</d:literal></d:gte>"
+            )
+
+        where = conditions[0] if len(conditions) == 1 else f"<d:and>{''.join(conditions)}</d:and>"
+
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<d:searchrequest xmlns:d="DAV:">
+    <d:basicsearch>
+        <d:select>
+            <d:prop>
+                <d:displayname/>
+                <d:getlastmodified/>
+                <d:getetag/>
+                <d:getcontentlength/>
+                <d:getcontenttype/>
+                <d:resourcetype/>
+            </d:prop>
+        </d:select>
+        <d:from>
+            <d:scope>
+                <d:href>{escape(scope)}</d:href>
+                <d:depth>1</d:depth>
+            </d:scope>
+        </d:from>
+        <d:where>{where}</d:where>
+    </d:basicsearch>
+</d:searchrequest>"""
+
+    def __parse_search_response(self, content: bytes) -> list[dict]:
+        """Read a SEARCH multistatus response into entries with the same keys as the PROPFIND listing."""
+
+        entries = []
+        for response in ET.fromstring(content).findall("d:response", self.DAV_NS):
+            href = unquote(response.findtext("d:href", default="", namespaces=self.DAV_NS))
+            prop = response.find("d:propstat/d:prop", self.DAV_NS)
+            if prop is None:
+                continue
+
+            entries.append({
+                'path': href,
+                'name': prop.findtext("d:displayname", default=os.path.basename(href.rstrip('/')), namespaces=self.DAV_NS),
+                'isdir': prop.find("d:resourcetype/d:collection", self.DAV_NS) is not None,
+                'size': prop.findtext("d:getcontentlength", default=None, namespaces=self.DAV_NS),
+                'modified': prop.findtext("d:getlastmodified", default=None, namespaces=self.DAV_NS),
+                'etag': prop.findtext("d:getetag", default=None, namespaces=self.DAV_NS),
+                'content_type': prop.findtext("d:getcontenttype", default=None, namespaces=self.DAV_NS),
+                'created': None,
+            })
+
+        return entries
+
+    def __search_remote_directory(self, remote_path_base: str, reference_date: date) -> list[dict]:
+        """
+        List only the new files of the remote directory using a WebDAV SEARCH request.
+        Return None if the server does not support it, to fall back to PROPFIND.
+        """
+
+        scope = self.__get_search_scope(remote_path_base=remote_path_base)
+        if scope is None:
+            self.logger.warning("Unable to find the SEARCH scope of the remote directory. Using PROPFIND.")
+            self.search_supported = False
+            return None  # type: ignore
+
+        url = f"{self.get_data_source_base_url()}/{self.get_search_endpoint()}/"
+        body = self.__build_search_request(scope=scope, reference_date=reference_date)
+
+        def search():
+            response = self.session.request(
+                "SEARCH", url, data=body.encode("utf-8"),
+                headers={"Content-Type": "text/xml; charset=UTF-8"},
+                timeout=self.get_http_timeout(),
+            )
+            response.raise_for_status()
+            return response
+
         try:
-            sql = f"""SELECT 1 FROM public.input_data WHERE file_name = '{file_name}' LIMIT 1;"""
-            return bool(output_db.fetchone(sql))
+            response = self.retry_policy.call(
+                search, is_retryable=self.is_retryable, logger=self.logger, description="search the remote directory"
+            )
+            entries = self.__parse_search_response(content=response.content)
         except Exception as exc:
-            self.logger.error("Error while verifying if file already exists in control table.")
-            raise exc
+            self.logger.warning(f"WebDAV SEARCH is not available ({exc}). Using PROPFIND.")
+            self.search_supported = False
+            return None  # type: ignore
 
-    def make_shapefile_list(self, reference_date: date, output_db: DatabaseFacade) -> list[dict]:
+        self.logger.debug(f"{len(entries)} new files found on remote server by SEARCH.")
+        return entries
+
+    def __select_candidates(self, remote_folder_info: list[dict], reference_date: date) -> list[dict]:
+        """
+        Return the shapefile entries newer than the reference date that are not known to be registered.
+        Entries with an unchanged path and ETag reuse the work cached on previous runs.
+        """
+
+        shapefile_extensions = tuple(self.get_shapefile_sufixes())
+        self.logger.debug(f"{','.join(shapefile_extensions)} shapefiles extensions.")
+
+        items = [
+            item for item in remote_folder_info
+            if not item['isdir'] and str(os.path.basename(item['path'])).endswith(shapefile_extensions)
+        ]
+
+        cache = self.get_listing_cache()
+        cached = cache.lookup(entries=items)
+
+        candidates = []
+        new_entries = []
+        for item in items:
+            cached_item = cached.get(item['path'])
+            if cached_item is not None and cached_item['registered']:
+                continue
+
+            if cached_item is not None:
+                file_date = date.fromisoformat(cached_item['modified'])
+            else:
+                file_date = datetime.strptime(item['modified'], '%a, %d %b %Y %H:%M:%S %Z').date()
+                new_entries.append({'path': item['path'], 'etag': item['etag'], 'modified': file_date.isoformat()})
+
+            if reference_date is None or file_date > reference_date:
+                item_tmp = {
+                    'size':item['size'],
+                    'modified':file_date.strftime('%Y-%m-%d'),
+                    'path':item['path'],
+                    'etag':item['etag'],
+                    'file_name':os.path.basename(item['path'])
+                }
+                candidates.append(item_tmp)
+
+        cache.put_entries(entries=new_entries)
+
+        return candidates
+
+    def __filter_unregistered(self, candidates: list[dict], output_db: OutputDatabase) -> list[dict]:
+        """
+        Check the candidates against the control table at once and return those not registered yet.
+        The registered ones are marked in the listing cache, so they are skipped on next runs.
+        """
+
+        unregistered = set(output_db.filter_unregistered_files(file_names=[f['file_name'] for f in candidates]))
+        self.get_listing_cache().mark_registered(
+            paths=[f['path'] for f in candidates if f['file_name'] not in unregistered]
+        )
+
+        return [f for f in candidates if f['file_name'] in unregistered]
+
+    def make_shapefile_list(self, reference_date: date, output_db: OutputDatabase) -> list[dict]:
         shp_files = []
 
         remote_path_base = f"{self.get_remote_directory()}"
-        shapefile_extensions = tuple(self.get_shapefile_sufixes())
         self.logger.debug(f"{remote_path_base} path on remote server.")
-        self.logger.debug(f"{','.join(shapefile_extensions)} shapefiles extensions.")
 
-        if self.client.check(remote_path=remote_path_base):
-            remote_folder_info = self.client.list(remote_path_base, get_info=True)
+        remote_folder_info = self.__list_remote_directory(remote_path_base=remote_path_base, reference_date=reference_date)
+
+        if remote_folder_info is not None:
             self.logger.debug(f"{len(remote_folder_info)} files found on remote server.")
 
-            for item in remote_folder_info:
-                if not item['isdir'] and str(os.path.basename(item['path'])).endswith(shapefile_extensions):
-                    file_exists = self.verify_file_exists(output_db=output_db, file_name=os.path.basename(item['path']))
-                    if file_exists is False:
-                        file_date = datetime.strptime(item['modified'], '%a, %d %b %Y %H:%M:%S %Z').date()
-                        if reference_date is None or file_date > reference_date:
-                            item_tmp = {
-                                'size':item['size'],
-                                'modified':file_date.strftime('%Y-%m-%d'),
-                                'path':item['path'],
-                                'etag':item['etag'],
-                                'file_name':os.path.basename(item['path'])
-                            }
-                            shp_files.append(item_tmp)
+            candidates = self.__select_candidates(remote_folder_info=remote_folder_info, reference_date=reference_date)
+            shp_files = self.__filter_unregistered(candidates=candidates, output_db=output_db)
 
+        self.get_listing_cache().log_stats()
         self.logger.info(f"{len(shp_files)} files found on remote server.")
 
         return shp_files
 
-    def download_file(self, output_db: DatabaseFacade, file: dict):
+    def has_new_files(self, reference_date: date, output_db: OutputDatabase) -> bool:
         """
-        To download a file from http source.
-        
-        Parameters
-        ----
-        :param:output_db: The facade to read end write data on output database.
-        :param:file_name: The expected file name without location path.
-        :param:file_date: The expected date of the file.
-        :param:tile_id: The tile identifier extracted from original file name.
+        Probe mode of make_shapefile_list: tell whether there is at least one file
+        newer than the reference date and not registered in the control table.
+
+        Candidates are checked against the control table in batches of probe_batch_size,
+        newest first, and the probe stops at the first batch with an unseen file.
+        Files already known to be registered are skipped by the listing cache,
+        so the common "nothing new" case needs no query at all.
+        """
+
+        remote_path_base = f"{self.get_remote_directory()}"
+        remote_folder_info = self.__list_remote_directory(remote_path_base=remote_path_base, reference_date=reference_date)
+
+        if remote_folder_info is None:
+            return False
+
+        candidates = self.__select_candidates(remote_folder_info=remote_folder_info, reference_date=reference_date)
+        bundles, _ = self.group_bundles(files=candidates)
+        bundles.sort(key=lambda b: b['modified'], reverse=True)
+
+        # only a complete bundle is new data, so a batch holds whole bundles
+        batch_size = self.get_probe_batch_size()
+        batch = []
+        checked = 0
+        for i, bundle in enumerate(bundles):
+            batch.append(bundle)
+            if sum(len(b['files']) for b in batch) < batch_size and i < len(bundles) - 1:
+                continue
+
+            files = [f for b in batch for f in b['files']]
+            unregistered = {f['file_name'] for f in self.__filter_unregistered(candidates=files, output_db=output_db)}
+            checked += len(files)
+            if any(all(f['file_name'] in unregistered for f in b['files']) for b in batch):
+                self.logger.debug(f"Found an unseen bundle after checking {checked} candidates.")
+                return True
+            batch = []
+
+        self.logger.debug(f"No unseen bundle among {len(candidates)} candidates.")
+        return False
+
+    def group_bundles(self, files: list[dict]) -> tuple[list[dict], list[dict]]:
+        """
+        Group files by stem (the file name without extension) into shapefile bundles.
+        A bundle is complete when it has one file of each extension in bundle_extensions.
+        A zipped bundle (.zip) is complete by itself.
+
+        Return: tuple[complete, incomplete], each a list of dicts with the keys stem, shapefile, archive, files and modified.
+        """
+
+        required = {ext.strip().lower() for ext in self.get_bundle_extensions()}
+        groups: dict[str, list[dict]] = {}
+        complete, incomplete = [], []
+        for file in files:
+            if file['file_name'].lower().endswith(".zip"):
+                complete.append({
+                    'stem': file['file_name'].split(".")[0],
+                    'shapefile': None,
+                    'archive': file['file_name'],
+                    'files': [file],
+                    'modified': file['modified'],
+                })
+            else:
+                groups.setdefault(file['file_name'].split(".")[0], []).append(file)
+
+        for stem, members in groups.items():
+            extensions = {os.path.splitext(f['file_name'])[1].lower() for f in members}
+            shapefile = next((f['file_name'] for f in members if f['file_name'].lower().endswith(".shp")), None)
+            bundle = {
+                'stem': stem,
+                'shapefile': shapefile,
+                'archive': None,
+                'files': members,
+                'modified': max(f['modified'] for f in members),
+            }
+            (complete if required.issubset(extensions) else incomplete).append(bundle)
+
+        return complete, incomplete
+
+    def make_bundle_list(self, reference_date: date, output_db: OutputDatabase) -> list[dict]:
+        """
+        Make the list of new shapefile bundles that are complete on the remote server.
+        A bundle still missing some of its files is left for a later run.
+        """
+
+        file_list = self.make_shapefile_list(reference_date=reference_date, output_db=output_db)
+        complete, incomplete = self.group_bundles(files=file_list)
+
+        for bundle in incomplete:
+            names = ",".join(sorted(f['file_name'] for f in bundle['files']))
+            self.logger.info(f"Bundle {bundle['stem']} is not complete on remote server yet ({names}).")
+
+        self.logger.info(f"{len(complete)} complete bundles found on remote server.")
+
+        return complete
+
+    def download_bundles(self, output_db: OutputDatabase, bundle_list: list[dict]) -> dict:
+        """
+        To download shapefile bundles from http source using concurrent transfers.
+
+        The files are downloaded into a staging directory per bundle. Once all files
+        of a bundle are there, they are moved into the temporary directory (the .shp last),
+        written into the control table and added to the bundle manifest read by the loader.
+        A bundle with failed transfers is left in staging, to be resumed on the next run.
+
+        Return: dict with the aggregate statistics of the transfers and the list of failed bundles.
+        """
+
+        tmp_dir = self.get_tmp_directory()
+        file_list = []
+        for bundle in bundle_list:
+            staging_dir = os.path.join(self.get_staging_directory(), bundle['stem'])
+            os.makedirs(staging_dir, exist_ok=True)
+            for file in bundle['files']:
+                file_list.append(dict(file, local_path=os.path.join(staging_dir, file['file_name'])))
+
+        downloaded, stats = self.__run_downloads(file_list=file_list)
+        downloaded_names = {f['file_name'] for f in downloaded}
+
+        ready, failed = [], []
+        for bundle in bundle_list:
+            if all(f['file_name'] in downloaded_names for f in bundle['files']):
+                ready.append(bundle)
+            else:
+                failed.append(bundle['stem'])
+
+        for bundle in ready:
+            staging_dir = os.path.join(self.get_staging_directory(), bundle['stem'])
+            # the loader looks for the .shp, so it is the last one to arrive
+            members = sorted(bundle['files'], key=lambda f: f['file_name'] in (bundle['shapefile'], bundle['archive']))
+            for file in members:
+                os.replace(os.path.join(staging_dir, file['file_name']), os.path.join(tmp_dir, file['file_name']))
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        try:
+            self.__registry_on_control_table(output_db=output_db, files=[f for b in ready for f in b['files']])
+        except Exception as exc:
+            self.logger.error("Failed to register remote file metadata in control table.")
+            raise exc
+
+        BundleManifest(data_dir=tmp_dir, log_level=self.log_level).add(bundles=[
+            {
+                'stem': b['stem'],
+                'shapefile': b['shapefile'],
+                'archive': b['archive'],
+                'files': [f['file_name'] for f in b['files']],
+                'etags': {f['file_name']: str(f['etag']).replace('"', '') for f in b['files']},
+            }
+            for b in ready
+        ])
+
+        if failed:
+            self.logger.error(f"{len(failed)} bundles were not downloaded and will be resumed later: {','.join(failed)}")
+
+        stats['bundles'] = len(ready)
+        stats['failed_bundles'] = failed
+
+        return stats
+
+    def __run_downloads(self, file_list: list[dict]) -> tuple[list[dict], dict]:
+        """
+        Run the transfers of the files in the download engine.
+
+        Return: tuple[the files downloaded successfully, the aggregate statistics]
+        """
+
+        url = self.get_data_source_base_url()
+        jobs = [
+            {'url': f"{url}/{self.get_remote_directory()}/{file['file_name']}", 'file': file}
+            for file in file_list
+        ]
+
+        downloaded = []
+
+        engine = HTTPDownloadEngine(
+            log_level=self.log_level,
+            max_workers=self.get_download_workers(),
+            max_per_host=self.get_download_workers_per_host(),
+            retry_policy=self.retry_policy,
+            is_retryable=self.is_retryable,
+        )
+        stats = engine.run(
+            jobs=jobs,
+            transfer=lambda job: self.__fetch_file(file=job['file']),
+            on_success=lambda job: downloaded.append(job['file']),
+        )
+
+        stats['connections'] = self.get_connection_stats()
+        self.logger.info(
+            f"HTTP connections: {stats['connections']['connections']} opened, "
+            f"{stats['connections']['reused']} of {stats['connections']['requests']} requests reused a connection."
+        )
+
+        return downloaded, stats
+
+    def __fetch_file(self, file: dict) -> int:
+        """
+        Download one file into the temporary directory, or into the local_path of the file if given,
+        if it is not there yet.
+
+        Return: The number of bytes written.
         """
         file_name = file['file_name']
         remote_path_base = f"{self.get_remote_directory()}/{file_name}"
-        local_path_base = f"{self.get_tmp_directory()}/{file_name}"
+        local_path_base = file.get('local_path', f"{self.get_tmp_directory()}/{file_name}")
         url = self.get_data_source_base_url()
         username, password = self.get_data_source_credential()
+        num_bytes = 0
+
+        expected_size = int(file['size']) if file.get('size') is not None else None
+
+        if os.path.isfile(path=local_path_base) and expected_size is not None \
+                and os.path.getsize(local_path_base) != expected_size:
+            self.logger.warning(f"Local file {file_name} does not match the listed size. Downloading again.")
+            pathlib.Path(local_path_base).unlink(missing_ok=True)
 
         # if file already exists, avoid download again
         if os.path.isfile(path=local_path_base):
@@ -126,10 +641,12 @@ class HTTPDataSource:
             self.logger.debug(f"The local file needs to be updated.")
 
             try:
-                self.download_from_webdav(url=f"{url}/{remote_path_base}",
-                                          local_filename=local_path_base,
-                                          username=username,
-                                          password=password)
+                num_bytes = self.download_from_webdav(url=f"{url}/{remote_path_base}",
+                                                      local_filename=local_path_base,
+                                                      username=username,
+                                                      password=password,
+                                                      etag=file.get('etag'),
+                                                      expected_size=expected_size)
             except HTTPError as http_err:
                 # Catches 4xx or 5xx errors
                 self.logger.error("Failure while trying to download file from data source.")
@@ -138,49 +655,38 @@ class HTTPDataSource:
                 if http_err.response.status_code == 404:
                     # do not try again if the file was not found
                     self.logger.error(f"File not found: {remote_path_base}")
-                    raise FileNotFoundError
+                    raise FileNotFoundError(remote_path_base)
+                raise http_err
             except RequestException as err:
                 # Catches broader issues like ConnectionError, Timeout, etc.
                 self.logger.error(f"Other error occurred: {err}")
+                raise err
             except Exception as exc:
                 self.logger.error("Failure while trying to download file from data source.")
                 raise exc
 
-            if not os.path.isfile(path=local_path_base):
-                self.logger.info("Retrying the download after 5 seconds...")
-                sleep(5)
-                self.download_file(output_db=output_db, file=file)
-            else:
-                self.logger.info(f"file_name={file_name}")
+            self.logger.info(f"file_name={file_name}")
 
-        try:
-            self.__registry_on_control_table(output_db=output_db, file=file)
-        except Exception as exc:
-            self.logger.error("Failed to register remote file metadata in control table.")
-            raise exc
+        return num_bytes
 
-    def __registry_on_control_table(self, output_db: DatabaseFacade, file:dict):
-        """Write the metadata file into control table"""
+    def __registry_on_control_table(self, output_db: OutputDatabase, files: list[dict]):
+        """Write the metadata of the files into control table"""
 
-        content_length = int(file['size'])
-        etag = str(file['etag']).replace('"', '')
-        last_modified = file['modified']
-        file_name = file['file_name']
-        file_date = (file_name.split("."))[0].split("_")[3]
-        tile_id = (file_name.split("."))[0].split("_")[4]
-
-        self.logger.debug(f"file_name={file_name}")
-        self.logger.debug(f"file_date={file_date}")
-        self.logger.debug(f"tile_id={tile_id}")
-        self.logger.debug(f"content_length={content_length}")
-        self.logger.debug(f"etag={etag}")
-        self.logger.debug(f"last_modified={last_modified}")
+        rows = []
+        for file in files:
+            file_name = file['file_name']
+            row = {
+                'file_name': file_name,
+                'file_date': (file_name.split("."))[0].split("_")[3],
+                'tile_id': (file_name.split("."))[0].split("_")[4],
+                'etag': str(file['etag']).replace('"', ''),
+                'file_size': int(file['size']),
+                'last_modified': file['modified'],
+            }
+            self.logger.debug(f"{row}")
+            rows.append(row)
 
-        sql = f"""INSERT INTO public.input_data(file_name, file_date, tile_id, etag, file_size, last_modified)
-        VALUES ('{file_name}', '{file_date}'::date, '{tile_id}', '{etag}', {content_length}, '{last_modified}'::date)
-        ON CONFLICT DO NOTHING;"""
-
-        output_db.execute(sql=sql, logger=self.logger)
+        output_db.register_input_files(files=rows)
 
     def get_data_source_base_url(self) -> str:
         """Create a base URL using AirFlow connection settings."""
@@ -254,6 +760,34 @@ class HTTPDataSource:
 
         return base_dir
 
+    def get_cache_directory(self) -> str:
+        """
+        Returns the directory of the GeoParquet cache of parsed tiles.
+        If the directory does not exist, it will be created.
+        """
+
+        base_dir = f"{self.get_data_directory()}/cache"
+
+        if not os.path.isdir(base_dir):
+            self.logger.info(f"Creating a cache directory in {base_dir}")
+            os.makedirs(base_dir)
+
+        return base_dir
+
+    def get_staging_directory(self) -> str:
+        """
+        Returns the directory where the bundles are downloaded before they are complete.
+        If the directory does not exist, it will be created.
+        """
+
+        base_dir = f"{self.get_tmp_directory()}/.staging"
+
+        if not os.path.isdir(base_dir):
+            self.logger.info(f"Creating a staging directory in {base_dir}")
+            os.makedirs(base_dir)
+
+        return base_dir
+
     def get_remote_directory(self) -> str:
         """
         Read remote directory from AirFlow connection settings.
@@ -273,24 +807,167 @@ class HTTPDataSource:
 
         return extension_list
 
-    def download_from_webdav(self, url, local_filename, username, password):
+    def get_download_workers(self) -> int:
+        """
+        Read the maximum number of concurrent downloads from AirFlow connection settings.
+
+        Return: int, default is 4
         """
-        Downloads a file from a WebDAV URL using the requests library.
+
+        return int(self.data_source_config.extra_dejson.get("download_workers", 4))
+
+    def get_download_workers_per_host(self) -> int:
+        """
+        Read the maximum number of concurrent downloads to the same host from AirFlow connection settings.
+
+        Return: int, default is 4
+        """
+
+        return int(self.data_source_config.extra_dejson.get("download_workers_per_host", 4))
+
+    def get_listing_cache_ttl(self) -> float:
+        """
+        Read the maximum age, in seconds, of a cached remote listing from AirFlow connection settings.
+        Use zero to list the remote directory on every call.
+
+        Return: float, default is 600
+        """
+
+        return float(self.data_source_config.extra_dejson.get("listing_cache_ttl", 600))
+
+    def get_bundle_extensions(self) -> list[str]:
+        """
+        Read the list of extensions that make a complete shapefile bundle from AirFlow connection settings.
+
+        Return: list[str], default is [".shp", ".shx", ".dbf", ".prj"]
+        """
+        extension_list = str(self.data_source_config.extra_dejson.get("bundle_extensions", ".shp,.shx,.dbf,.prj")).split(",")
+
+        return extension_list
+
+    def get_listing_backend(self) -> str:
+        """
+        Read the listing backend from AirFlow connection settings: "propfind" lists the whole
+        remote directory and "search" asks the server only for the new files.
+
+        Return: str, default is "propfind"
+        """
+
+        return str(self.data_source_config.extra_dejson.get("listing_backend", "propfind")).lower()
+
+    def get_search_endpoint(self) -> str:
+        """
+        Read the path of the WebDAV SEARCH endpoint from AirFlow connection settings.
+
+        Return: str, default is "remote.php/dav"
+        """
+
+        return str(self.data_source_config.extra_dejson.get("search_endpoint", "remote.php/dav")).strip("/")
+
+    def get_probe_batch_size(self) -> int:
+        """
+        Read the number of candidate files checked per query by the probe, from AirFlow connection settings.
+
+        Return: int, default is 50
+        """
+
+        return max(int(self.data_source_config.extra_dejson.get("probe_batch_size", 50)), 1)
+
+    def get_http_pool_size(self) -> int:
+        """
+        Read the size of the HTTP connection pool from AirFlow connection settings.
+
+        Return: int, default is 4
+        """
+
+        return int(self.data_source_config.extra_dejson.get("http_pool_size", 4))
+
+    def get_http_timeout(self) -> tuple[float, float]:
+        """
+        Read the HTTP connect and read timeouts, in seconds, from AirFlow connection settings.
+
+        Return: tuple[connect_timeout, read_timeout], default is (10, 60)
+        """
+
+        extra = self.data_source_config.extra_dejson
+
+        return float(extra.get("http_connect_timeout", 10)), float(extra.get("http_read_timeout", 60))
+
+    def download_from_webdav(self, url, local_filename, username, password, etag=None, expected_size=None) -> int:
+        """
+        Downloads a file from a WebDAV URL using the shared HTTP session.
         Raise request exceptions.
+        Return the number of bytes written.
+
+        The data is written to a "<local_filename>.part" file, renamed to local_filename once
+        its size matches the expected size. If a previous attempt left a .part file, the
+        download is resumed with an HTTP Range request, validated by If-Range against the ETag.
+        When the server answers with the full content (the ETag changed), it starts from zero.
 
         Args:
             url (str): The full URL to the file on the WebDAV server.
             local_filename (str): The path to save the file locally.
             username (str): The WebDAV username.
             password (str): The WebDAV password.
+            etag (str): The ETag listed by the remote server, used to validate a resumed download.
+            expected_size (int): The size listed by the remote server.
         """
-        # Use requests.get with stream=True for efficient handling of large files
-        response = requests.get(url, auth=(username, password), stream=True)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+        part_filename = f"{local_filename}.part"
+        offset = os.path.getsize(part_filename) if os.path.isfile(part_filename) else 0
+
+        # only a strong ETag can validate a partial content
+        strong_etag = None
+        if etag and not str(etag).startswith("W/"):
+            strong_etag = f'"{str(etag).strip(chr(34))}"'
+
+        if offset > 0 and (strong_etag is None or (expected_size is not None and offset > expected_size)):
+            self.logger.debug(f"Discarding the partial file {part_filename}, it can not be resumed.")
+            pathlib.Path(part_filename).unlink(missing_ok=True)
+            offset = 0
+
+        num_bytes = 0
+        if expected_size is None or offset < expected_size:
+            headers = {}
+            if offset > 0:
+                headers = {"Range": f"bytes={offset}-", "If-Range": strong_etag}
+                self.logger.debug(f"Resuming the download of {local_filename} from byte {offset}.")
+
+            # Use the shared session with stream=True for efficient handling of large files
+            response = self.session.get(
+                url, auth=(username, password), headers=headers, stream=True, timeout=self.get_http_timeout()
+            )
+
+            if response.status_code == 416:
+                # the range is not satisfiable, so the partial file is useless
+                response.close()
+                pathlib.Path(part_filename).unlink(missing_ok=True)
+                raise IncompleteDownloadError(f"Range not satisfiable for {url}, the download will restart.")
+
+            response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+
+            # 206 means the server accepted the range, otherwise it is sending the whole file
+            mode = 'ab' if offset > 0 and response.status_code == 206 else 'wb'
+
+            # Write the file content in chunks. On failure, the .part file is kept to resume later
+            with open(part_filename, mode) as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    if chunk: # filter out keep-alive new chunks
+                        f.write(chunk)
+                        num_bytes += len(chunk)
+
+        if not os.path.isfile(part_filename):
+            # an empty remote file needs no request
+            open(part_filename, 'wb').close()
+
+        size = os.path.getsize(part_filename)
+        if expected_size is not None and size != expected_size:
+            if size > expected_size:
+                pathlib.Path(part_filename).unlink(missing_ok=True)
+            raise IncompleteDownloadError(
+                f"Downloaded {size} of {expected_size} bytes of {url}."
+            )
+
+        os.replace(part_filename, local_filename)
+        self.logger.debug(f"Successfully downloaded {local_filename}")
 
-        # Write the file content in chunks
-        with open(local_filename, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk: # filter out keep-alive new chunks
-                    f.write(chunk)
-        print(f"Successfully downloaded {local_filename}")
+        return num_bytes
@@ -0,0 +1,128 @@
+import heapq
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import count
+from time import monotonic, perf_counter, sleep
+from typing import Callable
+from urllib.parse import urlparse
+from utils.logger import TasksLogger
+from utils.retry_policy import RetryPolicy
+
+
+class HTTPDownloadEngine:
+    """HTTP Download Engine: Runs file transfers in a thread pool with a global and a per-host limit."""
+
+    def __init__(
+        self,
+        log_level: str,
+        max_workers: int = 4,
+        max_per_host: int = 4,
+        retry_policy: RetryPolicy = None,  # type: ignore
+        is_retryable: Callable[[Exception], bool] = lambda exc: True,
+    ):
+        self.logger = TasksLogger(self.__class__.__name__)
+        self.logger.setLoggerLevel(level=log_level)
+        self.max_workers = max(int(max_workers), 1)
+        self.max_per_host = max(int(max_per_host), 1)
+        # without a policy, each transfer is tried only once
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy(max_attempts=1)
+        self.is_retryable = is_retryable
+        self.__host_slots: dict[str, threading.BoundedSemaphore] = {}
+        self.__host_slots_lock = threading.Lock()
+
+    def __get_host_slot(self, url: str) -> threading.BoundedSemaphore:
+        """Return the semaphore that limits the number of concurrent transfers to the host of the URL."""
+
+        host = urlparse(url).netloc
+        with self.__host_slots_lock:
+            if host not in self.__host_slots:
+                self.__host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.__host_slots[host]
+
+    def __run_job(self, job: dict, transfer: Callable[[dict], int]) -> int:
+        """Run one transfer while holding a slot of its host."""
+
+        with self.__get_host_slot(job['url']):
+            return transfer(job)
+
+    def run(self, jobs: list[dict], transfer: Callable[[dict], int], on_success: Callable[[dict], None]) -> dict:
+        """
+        Run all transfers and return the aggregate statistics.
+
+        A failed transfer is scheduled again according to the retry policy,
+        while the other transfers keep running.
+
+        Parameters
+        ----
+        :param:jobs: The list of jobs. Each job is a dict with at least the 'url' key.
+        :param:transfer: The function that transfers one job and returns the number of bytes written.
+        :param:on_success: Called in the caller thread, once for each job, after its transfer succeeds.
+
+        Return: dict with the keys files, failed, retries, bytes, seconds and throughput (bytes per second).
+        """
+
+        stats = {"files": 0, "failed": [], "retries": 0, "bytes": 0, "seconds": 0.0, "throughput": 0.0}
+        if not jobs:
+            return stats
+
+        self.logger.info(
+            f"Downloading {len(jobs)} files using {self.max_workers} workers ({self.max_per_host} per host)."
+        )
+
+        start = perf_counter()
+        sequence = count()
+        # the heap of scheduled attempts: (ready_at, sequence, job, attempt, started_at)
+        scheduled = [(monotonic(), next(sequence), job, 1, None) for job in jobs]
+        heapq.heapify(scheduled)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="download") as executor:
+            while scheduled or running:
+
+                now = monotonic()
+                while scheduled and scheduled[0][0] <= now:
+                    _, _, job, attempt, started_at = heapq.heappop(scheduled)
+                    future = executor.submit(self.__run_job, job, transfer)
+                    running[future] = (job, attempt, started_at if started_at else now)
+
+                timeout = max(scheduled[0][0] - monotonic(), 0) if scheduled else None
+                if not running:
+                    sleep(timeout)
+                    continue
+
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    job, attempt, started_at = running.pop(future)
+                    try:
+                        stats["bytes"] += future.result()
+                    except Exception as exc:
+                        delay = self.retry_policy.delay(attempt)
+                        if self.is_retryable(exc) and self.retry_policy.can_retry(
+                            attempt=attempt, started_at=started_at, delay=delay
+                        ):
+                            self.logger.warning(
+                                f"Attempt {attempt} to download {job['url']} failed: {exc}. "
+                                f"Retrying in {delay:.1f} seconds..."
+                            )
+                            heapq.heappush(scheduled, (monotonic() + delay, next(sequence), job, attempt + 1, started_at))
+                            stats["retries"] += 1
+                        else:
+                            self.logger.error(f"Failed to download {job['url']} after {attempt} attempts: {exc}")
+                            stats["failed"].append({"job": job, "error": exc})
+                        continue
+
+                    on_success(job)
+                    stats["files"] += 1
+
+        stats["seconds"] = perf_counter() - start
+        if stats["seconds"] > 0:
+            stats["throughput"] = stats["bytes"] / stats["seconds"]
+
+        self.logger.info(
+            f"Downloaded {stats['files']} of {len(jobs)} files, "
+            f"{stats['bytes'] / 1048576:.2f} MB in {stats['seconds']:.2f} s "
+            f"({stats['throughput'] / 1048576:.2f} MB/s, {stats['retries']} retries)."
+        )
+
+        return stats
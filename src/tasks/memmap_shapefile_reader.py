@@ -0,0 +1,220 @@
+"""
+Memory-mapped reader of simple polygon shapefiles.
+
+The .shp, .shx and .dbf files are mapped with numpy.memmap and the polygons are written
+as WKB straight from the mapped coordinates, which the shapefile already stores as
+little-endian doubles. It only handles plain Polygon shapefiles whose multi-part records
+are either one outer ring with holes or a set of outer rings, and a Date_dt column of
+type date or text. Anything else raises UnsupportedShapefileError, to be read by GeoPandas.
+"""
+
+import os
+import struct
+import numpy as np
+from pyproj import CRS
+
+# shape types of the shapefile specification
+NULL_SHAPE = 0
+POLYGON = 5
+# geometry types of WKB and the flag that marks an SRID after the type
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+EWKB_SRID_FLAG = 0x20000000
+# the size of the header of .shp and .shx files, and of each record header of .shp
+FILE_HEADER_SIZE = 100
+RECORD_HEADER_SIZE = 8
+DBF_FIELD_TERMINATOR = 0x0D
+
+
+class UnsupportedShapefileError(ValueError):
+    """The shapefile uses a feature that the memory-mapped reader does not handle."""
+
+
+def find_sibling(filein: str, ext: str) -> str:
+    """Return the path of the file of the same bundle with the extension, in lower or upper case, or None."""
+
+    base = os.path.splitext(filein)[0]
+    for candidate in (f"{base}.{ext.lower()}", f"{base}.{ext.upper()}"):
+        if os.path.isfile(candidate):
+            return candidate
+    return None  # type: ignore
+
+
+def wkb_header(geometry_type: int, srid: int) -> bytes:
+    """Return the little-endian (E)WKB header of a geometry type, with the SRID if it is known."""
+
+    if srid is None:
+        return struct.pack("<BI", 1, geometry_type)
+    return struct.pack("<BII", 1, geometry_type | EWKB_SRID_FLAG, srid)
+
+
+def group_rings(xy: np.ndarray, bounds: np.ndarray) -> list[list[int]]:
+    """
+    Group the rings of a multi-part record into polygons, by the orientation of the rings:
+    outer rings are clockwise and holes are counterclockwise.
+
+    Return: a list of polygons, each one a list of ring indexes, the outer ring first.
+    """
+
+    # twice the signed area of each ring, zeroing the segments that join two rings
+    cross = xy[:-1, 0] * xy[1:, 1] - xy[1:, 0] * xy[:-1, 1]
+    cross[bounds[1:-1] - 1] = 0
+    outer = np.add.reduceat(cross, bounds[:-1]) < 0
+
+    if outer.all():
+        return [[i] for i in range(len(outer))]
+    if outer[0] and outer.sum() == 1:
+        return [list(range(len(outer)))]
+
+    raise UnsupportedShapefileError("Multi-part record with several outer rings and holes")
+
+
+def read_polygons(shp_path: str, shx_path: str, srid: int, start: int = 0, stop: int = None) -> tuple[int, list[bytes]]:
+    """
+    Read the polygons from start to stop of a shapefile as (E)WKB, using the record offsets
+    of the .shx file. A record with more than one outer ring is a MultiPolygon, a null record is None.
+
+    Return: (the number of records of the file, the polygons)
+    """
+
+    if os.path.getsize(shx_path) <= FILE_HEADER_SIZE:
+        return 0, []
+
+    shx = np.memmap(shx_path, dtype=">i4", mode="r", offset=FILE_HEADER_SIZE).reshape(-1, 2)
+    offsets = shx[start:stop, 0].astype(np.int64) * 2
+    buffer = memoryview(np.memmap(shp_path, dtype=np.uint8, mode="r"))
+
+    (file_type,) = struct.unpack_from("<i", buffer, 32)
+    if file_type not in (NULL_SHAPE, POLYGON):
+        raise UnsupportedShapefileError(f"Shape type {file_type}")
+
+    polygon_header = wkb_header(WKB_POLYGON, srid)
+    multi_header = wkb_header(WKB_MULTIPOLYGON, srid)
+    part_header = wkb_header(WKB_POLYGON, None)  # type: ignore
+
+    def ring(points_at: int, start: int, end: int) -> list:
+        return [struct.pack("<I", end - start), buffer[points_at + 16 * start:points_at + 16 * end]]
+
+    wkb = []
+    for offset in offsets:
+        content = int(offset) + RECORD_HEADER_SIZE
+        (shape_type,) = struct.unpack_from("<i", buffer, content)
+        if shape_type == NULL_SHAPE:
+            wkb.append(None)
+            continue
+        if shape_type != POLYGON:
+            raise UnsupportedShapefileError(f"Shape type {shape_type} on a record")
+
+        # the record: shape type, bounding box, number of parts and points, parts, points
+        num_parts, num_points = struct.unpack_from("<2i", buffer, content + 36)
+        parts_at = content + 44
+        points_at = parts_at + 4 * num_parts
+        parts = np.append(np.frombuffer(buffer, dtype="<i4", count=num_parts, offset=parts_at), num_points)
+        bounds = parts.tolist()
+
+        if num_parts == 1:
+            polygons = [[0]]
+        else:
+            xy = np.frombuffer(buffer, dtype="<f8", count=2 * num_points, offset=points_at).reshape(-1, 2)
+            polygons = group_rings(xy, parts)
+
+        chunks = []
+        if len(polygons) == 1:
+            chunks += [polygon_header, struct.pack("<I", len(polygons[0]))]
+            for i in polygons[0]:
+                chunks += ring(points_at, bounds[i], bounds[i + 1])
+        else:
+            chunks += [multi_header, struct.pack("<I", len(polygons))]
+            for polygon in polygons:
+                chunks += [part_header, struct.pack("<I", len(polygon))]
+                for i in polygon:
+                    chunks += ring(points_at, bounds[i], bounds[i + 1])
+        wkb.append(b"".join(chunks))
+
+    return len(shx), wkb
+
+
+def read_dbf_dates(dbf_path: str, column: str, start: int = 0, stop: int = None) -> tuple[int, list[str]]:
+    """
+    Read a date column of the records from start to stop of a .dbf file as 'YYYY-MM-DD' text,
+    keeping the blanks as None. The column is read as a strided view over the mapped records.
+
+    Return: (the number of records of the file, the dates), the dates are None if there is no such column.
+    """
+
+    raw = np.memmap(dbf_path, dtype=np.uint8, mode="r")
+    num_records, header_length, record_length = struct.unpack_from("<IHH", raw, 4)
+
+    field = None
+    position, field_offset = 32, 1
+    while raw[position] != DBF_FIELD_TERMINATOR:
+        name = raw[position:position + 11].tobytes().split(b"\x00")[0].decode("ascii")
+        field_type, length = chr(raw[position + 11]), int(raw[position + 16])
+        if name == column:
+            field = (field_type, field_offset, length)
+        field_offset += length
+        position += 32
+
+    if num_records == 0:
+        return 0, [] if field is not None else None  # type: ignore
+
+    records = np.memmap(
+        dbf_path,
+        dtype=np.dtype({
+            "names": ["deleted", "value"],
+            "formats": ["S1", f"S{field[2] if field else 1}"],
+            "offsets": [0, field[1] if field else 0],
+            "itemsize": record_length,
+        }),
+        mode="r",
+        offset=header_length,
+        shape=(num_records,),
+    )[start:stop]
+
+    if (records["deleted"] == b"*").any():
+        raise UnsupportedShapefileError("Deleted records on the dbf")
+    if field is None:
+        return num_records, None  # type: ignore
+
+    field_type = field[0]
+    values = np.char.strip(np.char.decode(records["value"], "ascii"))
+    if field_type == "D":
+        return num_records, [f"{v[:4]}-{v[4:6]}-{v[6:8]}" if v else None for v in values]
+    if field_type == "C":
+        return num_records, [v[:10] if v else None for v in values]
+
+    raise UnsupportedShapefileError(f"Field type {field_type} of {column}")
+
+
+def read_shapefile(
+    filein: str, start: int = 0, stop: int = None, column: str = "Date_dt"
+) -> tuple[int, str, list[bytes], list[str]]:
+    """
+    Read the records from start to stop of a plain polygon shapefile, and their date column,
+    from the files of its bundle.
+
+    Return: (srid, crs as WKT, EWKB geometries, dates)
+    """
+
+    if not filein.lower().endswith(".shp"):
+        raise UnsupportedShapefileError("Only plain .shp files are mapped")
+
+    shx_path, dbf_path, prj_path = (find_sibling(filein, ext) for ext in ("shx", "dbf", "prj"))
+    if shx_path is None or dbf_path is None:
+        raise UnsupportedShapefileError("Missing .shx or .dbf file")
+    if prj_path is None:
+        raise ValueError(f"Failed to read CRS for shapefile {filein}")
+
+    with open(prj_path, "r") as f:
+        crs = CRS.from_user_input(f.read())
+    srid = crs.to_epsg()
+
+    num_shapes, wkb = read_polygons(filein, shx_path, srid=srid, start=start, stop=stop)
+    num_records, dates = read_dbf_dates(dbf_path, column=column, start=start, stop=stop)
+    if num_records != num_shapes:
+        raise UnsupportedShapefileError(f"{num_shapes} shapes and {num_records} dbf records")
+
+    # the WKT of an ESRI .prj does not round-trip to its EPSG code, so the one of the code is returned
+    wkt = CRS.from_epsg(srid).to_wkt() if srid is not None else crs.to_wkt()
+
+    return srid, wkt, wkb, dates if dates is not None else [None] * len(wkb)
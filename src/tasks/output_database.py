@@ -1,4 +1,4 @@
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from airflow.models import Connection
 from airflow.hooks.base import BaseHook
 from utils.database_facade import DatabaseFacade
@@ -12,6 +12,8 @@ class OutputDatabase:
     # the Airflow connection ids
     # used to access the output database
     DETER_RT_CONNECTION_ID: str = "DETER_RT_DB_URL"
+    # the fingerprint of a geometry used to find duplicates, as on docs/create_database.sql
+    GEOM_HASH: str = "md5(ST_AsBinary(ST_Normalize(ST_SnapToGrid(geom, 0.000001))))::uuid"
     database: DatabaseFacade = None  # type: ignore
     logger: TasksLogger = None  # type: ignore
 
@@ -26,7 +28,18 @@ class OutputDatabase:
         # validation parameters
         self.current_table = "deter_rt"
         self.temp_table = "deter_rt_temp"
+        # session table used by the loader to write straight into the temp_table
+        self.ingest_table = "deter_rt_ingest"
+        # the batches of rows loaded by the hourly flow, from the loader to the validator
+        self.load_batch_table = "load_batch"
+        # the staging table and the progress table of the backfill, apart from the hourly flow
+        self.backfill_table = "deter_rt_backfill"
+        self.backfill_progress_table = "backfill_progress"
         self.deter_optical_table = "deter_otico"
+        # the optical DETER dissolved by class and subdivided in small pieces, used by the validation
+        self.optical_coverage_table = "deter_otico_coverage"
+        # the maximum number of vertices of each piece of the optical coverage
+        self.coverage_max_vertices = 256
         self.audited_table = "deter_rt_validados"
         self.intermediary_table = "by_percentage_of_coverage"
         self.threshold = "0.5"  # 50%
@@ -35,6 +48,88 @@ class OutputDatabase:
         # the number of randomly selected candidates
         self.limit_random = "50"
 
+    def get_setting(self, name: str, default=None):
+        """Read a setting from the "Extra" field of the output database connection."""
+
+        return self.deter_rt_db_url.extra_dejson.get(name, default)
+
+    def get_loader_backend(self) -> str:
+        """
+        Read how the loader writes shapefiles to the database: "to_postgis" or "copy".
+
+        Return: str, default is "to_postgis"
+        """
+
+        backend = str(self.get_setting("loader_backend", "to_postgis")).lower()
+        if backend not in ("to_postgis", "copy"):
+            raise Exception(f"Unknown loader_backend: {backend}")
+
+        return backend
+
+    def get_loader_target(self) -> str:
+        """
+        Read where the loader writes shapefiles: "tmp_schema", one table per file on the tmp
+        schema, or "deter_rt_temp", straight into the temporary table of the transformer.
+
+        Return: str, default is "tmp_schema"
+        """
+
+        target = str(self.get_setting("loader_target", "tmp_schema")).lower()
+        if target not in ("tmp_schema", "deter_rt_temp"):
+            raise Exception(f"Unknown loader_target: {target}")
+
+        return target
+
+    def get_loader_reader(self) -> str:
+        """
+        Read how the loader parses shapefiles: "fiona" through GeoPandas, "pyogrio"
+        as Arrow tables with only the columns used downstream and WKB geometries, or
+        "memmap" with the built-in memory-mapped reader of plain polygon shapefiles.
+
+        Return: str, default is "fiona"
+        """
+
+        reader = str(self.get_setting("loader_reader", "fiona")).lower()
+        if reader not in ("fiona", "pyogrio", "memmap"):
+            raise Exception(f"Unknown loader_reader: {reader}")
+
+        return reader
+
+    def get_loader_memory_budget_mb(self) -> int:
+        """
+        Read the memory budget of each row window read by the loader, in MB. Larger
+        shapefiles are read and written in windows that fit in it, 0 disables the windows.
+
+        Return: int, default is 512
+        """
+
+        return max(0, int(self.get_setting("loader_memory_budget_mb", 512)))
+
+    def get_loader_workers(self) -> int:
+        """
+        Read the number of worker processes used by the loader to parse shapefiles.
+        With 1, the files are parsed serially in the loader process.
+
+        The workers are spawned, and each one imports the main module of the loader process
+        again, so with more than 1 the loader must run from a main module with a __main__
+        guard, as python -m tasks.deter_rt_loader. The Airflow task runs it this way, the
+        script of a PythonVirtualenvOperator has no such guard.
+
+        Return: int, default is 1
+        """
+
+        return max(1, int(self.get_setting("loader_workers", 1)))
+
+    def get_loader_queue_depth(self, workers: int) -> int:
+        """
+        Read the maximum number of parsed, or in-progress, shapefiles waiting for the database writer.
+        It bounds the memory used by the loader when parsing is faster than writing.
+
+        Return: int, default is twice the number of workers
+        """
+
+        return max(1, int(self.get_setting("loader_queue_depth", 2 * workers)))
+
     def get_sqlalchemy_engine(self):
         """Gets the connection engine base on SqlAlchemy to use in GeoPandas"""
 
@@ -110,10 +205,20 @@ class OutputDatabase:
         return max_date  # type: ignore
 
     def get_max_date_input_file(self) -> date:
-        """Gets the max date of last downloaded shapefile."""
+        """
+        Gets the max date of last downloaded shapefile with alerts on the final table.
+        The files are read from the most recent, and each one looks for its alerts with
+        view_date equal to its file_date, so only the partition of that month is read.
+        """
 
         outdb = self.get_database_facade()
-        sql = f"SELECT MAX(last_modified)::date FROM public.input_data ip, public.{self.current_table} rt WHERE ip.file_date=rt.view_date AND ip.tile_id=rt.tile_id;"
+        sql = f"""SELECT ip.last_modified::date FROM public.input_data ip
+        WHERE ip.last_modified IS NOT NULL
+        AND EXISTS (
+            SELECT 1 FROM public.{self.current_table} rt WHERE rt.view_date = ip.file_date AND rt.tile_id = ip.tile_id
+        )
+        ORDER BY ip.last_modified DESC
+        LIMIT 1;"""
         data = outdb.fetchone(query=sql, logger=self.logger)
         max_date = None
         outdb.close()
@@ -122,15 +227,15 @@ class OutputDatabase:
 
         return max_date  # type: ignore
 
-    def get_input_files_to_import(self, files: list[str], extension: str) -> list[str]:
+    def get_input_files_to_import(self, files: list[str], extensions: list[str]) -> list[str]:
         """
-        Gets the list of downloaded shapefiles that were not imported into the database.
+        Gets the list of downloaded shapefiles, or zipped bundles, that were not imported into the database.
         Using the input list of files on disc to filter the list of files not imported.
         """
 
         outdb = self.get_database_facade()
-        sql = f"SELECT file_name FROM public.input_data ip WHERE ip.import_date IS NULL AND file_name ilike '%.{extension}';"
-        data = outdb.fetchall(query=sql, logger=self.logger)
+        sql = f"SELECT file_name FROM public.input_data ip WHERE ip.import_date IS NULL AND file_name ilike ANY(%s);"
+        data = outdb.fetchall(query=sql, logger=self.logger, params=([f"%.{ext}" for ext in extensions],))
         out_files = []
         if data is not None and len(data) > 0 and files is not None and len(files) > 0:
             files_on_db = [r[0] for r in data]
@@ -145,14 +250,459 @@ class OutputDatabase:
         outdb.close()
         return out_files
 
-    def update_imported_file(self, file_name: str):
-        """Update the input_data table to set the import_date field."""
+    def filter_unregistered_files(self, file_names: list[str]) -> list[str]:
+        """
+        Gets the file names that are not registered in the input_data table yet.
+        All names are checked by one set-based query.
+        """
+
+        if not file_names:
+            return []
 
         outdb = self.get_database_facade()
-        sql = f"""UPDATE public.input_data SET import_date=NOW()::date WHERE file_name ilike '{file_name}%';"""
+        sql = f"""SELECT f.file_name FROM unnest(%s::text[]) AS f(file_name)
+        WHERE NOT EXISTS (SELECT 1 FROM public.input_data ip WHERE ip.file_name=f.file_name);"""
+        data = outdb.fetchall(query=sql, logger=self.logger, params=(list(file_names),))
+
+        return [r[0] for r in data] if data else []
+
+    def register_input_files(self, files: list[dict]) -> int:
+        """
+        Write the metadata of downloaded files into the input_data table using one statement.
+        The transaction is not committed here.
+
+        Parameters
+        ----
+        :param:files: A list of dicts with the keys file_name, file_date, tile_id, etag, file_size and last_modified.
+
+        Return: The number of registered files.
+        """
+
+        if not files:
+            return 0
+
+        columns = ["file_name", "file_date", "tile_id", "etag", "file_size", "last_modified"]
+        params = tuple([f[column] for f in files] for column in columns)
+
+        outdb = self.get_database_facade()
+        sql = f"""INSERT INTO public.input_data(file_name, file_date, tile_id, etag, file_size, last_modified)
+        SELECT * FROM unnest(%s::character varying[], %s::date[], %s::character varying[], %s::character varying[], %s::integer[], %s::date[])
+        ON CONFLICT DO NOTHING;"""
+
+        return outdb.execute(sql=sql, logger=self.logger, params=params)
+
+    def update_imported_files(self, file_names: list[str]) -> int:
+        """
+        Update the input_data table to set the import_date field of all files of the given names,
+        where a name is the file name without extension, using one statement.
+        """
+
+        if not file_names:
+            return 0
+
+        outdb = self.get_database_facade()
+        sql = f"""UPDATE public.input_data SET import_date=NOW()::date WHERE split_part(file_name, '.', 1) = ANY(%s::text[]);"""
+        rowcount = outdb.execute(sql=sql, logger=self.logger, params=(list(file_names),))
+        outdb.commit()
+
+        return rowcount
+
+    def get_input_file_tags(self, stems: list[str]) -> dict[str, tuple[date, str]]:
+        """
+        Gets the file_date and tile_id of the shapefiles, or zipped bundles, of the given stems
+        (file names without extension) from input_data, using one query.
+
+        Return: dict of stem to tuple[file_date, tile_id]
+        """
+
+        if not stems:
+            return {}
+
+        outdb = self.get_database_facade()
+        sql = f"""SELECT split_part(file_name, '.', 1), file_date, tile_id FROM public.input_data
+        WHERE split_part(file_name, '.', 1) = ANY(%s::text[]) AND file_name ilike ANY(ARRAY['%%.shp', '%%.zip']);"""
+        data = outdb.fetchall(query=sql, logger=self.logger, params=(list(stems),))
+
+        return {r[0]: (r[1], r[2]) for r in data} if data else {}
+
+    def get_input_file_etags(self, stems: list[str]) -> dict[str, dict[str, str]]:
+        """
+        Gets the etags of all files of the bundles of the given stems from input_data, using one query.
+        A file registered more than once has the etag of its last record.
+
+        Return: dict of stem to a dict of file name to etag
+        """
+
+        if not stems:
+            return {}
+
+        outdb = self.get_database_facade()
+        sql = f"""SELECT DISTINCT ON (file_name) split_part(file_name, '.', 1), file_name, etag FROM public.input_data
+        WHERE split_part(file_name, '.', 1) = ANY(%s::text[]) AND etag IS NOT NULL
+        ORDER BY file_name, id DESC;"""
+        data = outdb.fetchall(query=sql, logger=self.logger, params=(list(stems),))
+
+        etags = {}
+        for stem, file_name, etag in data or []:
+            etags.setdefault(stem, {})[file_name] = etag
+
+        return etags
+
+    def get_backup_retention_days(self) -> int:
+        """
+        Read how many days the downloaded files are kept in the backup store, 0 keeps them forever.
+
+        Return: int, default is 365
+        """
+
+        return max(0, int(self.get_setting("backup_retention_days", 365)))
+
+    def get_cache_settings(self) -> tuple[bool, int, int]:
+        """
+        Read the settings of the GeoParquet cache of parsed tiles.
+
+        Return: tuple[enabled, max size in MB, max age in days], default is (True, 2048, 30)
+        """
+
+        enabled = str(self.get_setting("geoparquet_cache", "true")).lower() in ("true", "1", "yes")
+        max_size_mb = int(self.get_setting("geoparquet_cache_max_size_mb", 2048))
+        max_age_days = int(self.get_setting("geoparquet_cache_max_age_days", 30))
+
+        return enabled, max_size_mb, max_age_days
+
+    def prepare_direct_ingest(self):
+        """
+        Create the session table that receives the rows of one shapefile before they are
+        appended to the temporary table. Its rows are deleted on each commit.
+        The transaction is committed here, so rolling back a failed file keeps the table.
+        """
+
+        outdb = self.get_database_facade()
+        sql = f"""CREATE TEMP TABLE IF NOT EXISTS {self.ingest_table}
+        (geometry geometry, "Date_dt" text, area_km double precision, lon double precision, lat double precision,
+        view_date date, tile_id character varying)
+        ON COMMIT DELETE ROWS;"""
+        outdb.execute(sql=sql, logger=self.logger)
+        outdb.commit()
+
+    def ingest_to_temp_table(self, batch_id: int) -> int:
+        """
+        Append the rows of the session table to the temporary table on public schema, with the
+        geometry, area and centroid normalized by the loader, stamped with the load batch.
+        The transaction is not committed here.
+        """
+
+        outdb = self.get_database_facade()
+        sql = f"""INSERT INTO public.{self.temp_table} (geom, class_name, view_date, detection_date, area_km, lon, lat, tile_id, batch_id)
+        SELECT geometry, 'alerta', view_date, "Date_dt"::date, area_km, lon, lat, tile_id, %s
+        FROM pg_temp.{self.ingest_table};"""
+
+        return outdb.execute(sql=sql, logger=self.logger, params=(batch_id,))
+
+    def open_load_batch(self) -> int:
+        """
+        Get the open load batch, creating it if there is none. A batch stays open until the
+        transformer moves its rows to the final table, so the rows left by a failed run are
+        processed with the next one. The transaction is committed here.
+
+        Return: The id of the open batch.
+        """
+
+        outdb = self.get_database_facade()
+        sql = f"""INSERT INTO public.{self.load_batch_table} (status) VALUES ('open')
+        ON CONFLICT (status) WHERE status = 'open' DO NOTHING;"""
+        outdb.execute(sql=sql, logger=self.logger)
+        data = outdb.fetchone(
+            query=f"""SELECT id FROM public.{self.load_batch_table} WHERE status = 'open';""", logger=self.logger
+        )
+        outdb.commit()
+
+        return data[0]
+
+    def get_load_batches(self, status: str) -> list[int]:
+        """Gets the ids of the load batches in the status: "open", "transformed" or "validated"."""
+
+        outdb = self.get_database_facade()
+        sql = f"""SELECT id FROM public.{self.load_batch_table} WHERE status = %s ORDER BY id;"""
+        data = outdb.fetchall(query=sql, logger=self.logger, params=(status,))
+
+        return [r[0] for r in data] if data else []
+
+    def set_load_batch_status(self, batch_ids: list[int], status: str, rows: int = None) -> int:  # type: ignore
+        """
+        Move the load batches to the status, recording when, and the number of rows if given.
+        The transaction is not committed here.
+        """
+
+        if status not in ("transformed", "validated"):
+            raise Exception(f"Unknown load batch status: {status}")
+
+        outdb = self.get_database_facade()
+        sql = f"""UPDATE public.{self.load_batch_table}
+        SET status = %s, rows = COALESCE(%s, rows), {status}_at = now()
+        WHERE id = ANY(%s);"""
+
+        return outdb.execute(sql=sql, logger=self.logger, params=(status, rows, list(batch_ids)))
+
+    def get_backfill_workers(self) -> int:
+        """
+        Read the number of parallel partitions, each one a process with its own connection, used by the backfill.
+        The processes are spawned, so the backfill must run from a main module with a __main__
+        guard, as python -m tasks.deter_rt_backfill, see get_loader_workers.
+
+        Return: int, default is 4
+        """
+
+        return max(1, int(self.get_setting("backfill_workers", 4)))
+
+    def prepare_backfill(self):
+        """Create the staging table and the progress table of the backfill, if they do not exist."""
+
+        outdb = self.get_database_facade()
+        sql = f"""CREATE TABLE IF NOT EXISTS public.{self.backfill_table}
+        (
+            id serial,
+            geom geometry(MultiPolygon,4674) NOT NULL,
+            class_name character varying(256) NOT NULL,
+            view_date date NOT NULL,
+            area_km double precision NOT NULL,
+            lon double precision,
+            lat double precision,
+            tile_id character varying(256) NOT NULL,
+            detection_date date,
+            source_file character varying(256) NOT NULL,
+            run_key character varying(64),
+            geom_hash uuid GENERATED ALWAYS AS ({self.GEOM_HASH}) STORED,
+            CONSTRAINT {self.backfill_table}_pkey PRIMARY KEY (id)
+        );
+        CREATE INDEX IF NOT EXISTS {self.backfill_table}_view_date_idx ON public.{self.backfill_table} (view_date);
+        CREATE INDEX IF NOT EXISTS {self.backfill_table}_run_key_idx ON public.{self.backfill_table} (run_key, view_date);
+        CREATE INDEX IF NOT EXISTS {self.backfill_table}_source_file_idx ON public.{self.backfill_table} (source_file);
+        CREATE INDEX IF NOT EXISTS {self.backfill_table}_geom_hash_idx ON public.{self.backfill_table} (geom_hash, view_date);
+        CREATE TABLE IF NOT EXISTS public.{self.backfill_progress_table}
+        (
+            run_key character varying(64) NOT NULL,
+            file_name character varying(256) NOT NULL,
+            etag character varying,
+            source character varying(16) NOT NULL,
+            rows integer NOT NULL,
+            loaded_at timestamp without time zone NOT NULL DEFAULT now(),
+            CONSTRAINT {self.backfill_progress_table}_pkey PRIMARY KEY (run_key, file_name)
+        );"""
         outdb.execute(sql=sql, logger=self.logger)
         outdb.commit()
 
+    def get_backfill_files(self, start_date: date, end_date: date) -> list[tuple[str, date, str, dict]]:
+        """
+        Gets the shapefiles, or zipped bundles, registered in input_data with a file_date in the range,
+        with the etags of all files of their bundles, as in get_input_file_etags. The input_data table is only read.
+
+        Return: list of tuple[file_name, file_date, tile_id, dict of file name to etag]
+        """
+
+        outdb = self.get_database_facade()
+        sql = f"""SELECT i.file_name, i.file_date, i.tile_id, m.etags FROM public.input_data i
+        LEFT JOIN LATERAL (
+            SELECT json_object_agg(b.file_name, b.etag) etags FROM (
+                SELECT DISTINCT ON (file_name) file_name, etag FROM public.input_data
+                WHERE split_part(file_name, '.', 1) = split_part(i.file_name, '.', 1) AND etag IS NOT NULL
+                ORDER BY file_name, id DESC
+            ) b
+        ) m ON true
+        WHERE i.file_date BETWEEN %s AND %s AND i.file_name ilike ANY(ARRAY['%%.shp', '%%.zip'])
+        ORDER BY i.file_date, i.file_name;"""
+        data = outdb.fetchall(query=sql, logger=self.logger, params=(start_date, end_date))
+
+        return [tuple(r) for r in data] if data else []  # type: ignore
+
+    def get_backfill_done(self, run_key: str) -> set[str]:
+        """Gets the file names already loaded by the backfill run."""
+
+        outdb = self.get_database_facade()
+        sql = f"""SELECT file_name FROM public.{self.backfill_progress_table} WHERE run_key = %s;"""
+        data = outdb.fetchall(query=sql, logger=self.logger, params=(run_key,))
+
+        return {r[0] for r in data} if data else set()
+
+    def ingest_to_backfill_table(self, source_file: str, run_key: str) -> int:
+        """
+        Replace the rows of the file on the backfill table, of any run, with the rows of the
+        session table, as normalized by the loader, recording the run that loaded them.
+        The transaction is not committed here.
+        """
+
+        outdb = self.get_database_facade()
+        outdb.execute(
+            sql=f"""DELETE FROM public.{self.backfill_table} WHERE source_file = %s;""",
+            logger=self.logger,
+            params=(source_file,),
+        )
+        sql = f"""INSERT INTO public.{self.backfill_table} (geom, class_name, view_date, detection_date, area_km, lon, lat, tile_id, source_file, run_key)
+        SELECT geometry, 'alerta', view_date, "Date_dt"::date, area_km, lon, lat, tile_id, %s, %s
+        FROM pg_temp.{self.ingest_table};"""
+
+        return outdb.execute(sql=sql, logger=self.logger, params=(source_file, run_key))
+
+    def mark_backfill_done(self, run_key: str, file_name: str, etag: str, source: str, rows: int):
+        """Record a file as loaded by the backfill run. The transaction is not committed here."""
+
+        outdb = self.get_database_facade()
+        sql = f"""INSERT INTO public.{self.backfill_progress_table} (run_key, file_name, etag, source, rows)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (run_key, file_name) DO UPDATE SET etag=EXCLUDED.etag, source=EXCLUDED.source, rows=EXCLUDED.rows, loaded_at=now();"""
+        outdb.execute(sql=sql, logger=self.logger, params=(run_key, file_name, etag, source, rows))
+
+    def publish_backfill(self, start_date: date, end_date: date, run_key: str) -> tuple[int, int]:
+        """
+        Publish the rows loaded by the backfill run for the date range into the final table, so
+        they are validated again: the alerts that already exist there, with the same rule as
+        remove_duplicate_geometries, are moved to a new load batch, and the missing ones are
+        inserted with it. The rows left on the backfill table by other runs are not published.
+
+        The load batch is apart from the open batch of the hourly flow, committed as transformed
+        with the rows, so the validator processes them next.
+
+        Return: tuple[the number of existing alerts moved to the batch, the number of rows inserted]
+        """
+
+        outdb = self.get_database_facade()
+        self.ensure_monthly_partitions(table=self.current_table, start_date=start_date, end_date=end_date)
+        sql = f"""INSERT INTO public.{self.load_batch_table} (status, transformed_at) VALUES ('transformed', now()) RETURNING id;"""
+        batch_id = outdb.fetchone(query=sql, logger=self.logger)[0]
+
+        sql = f"""UPDATE public.{self.current_table} f SET batch_id = %s
+        WHERE f.view_date BETWEEN %s AND %s
+        AND EXISTS (
+            SELECT 1 FROM public.{self.backfill_table} b
+            WHERE b.run_key = %s AND b.geom_hash = f.geom_hash AND b.view_date = f.view_date
+            AND b.view_date BETWEEN %s AND %s
+        );"""
+        moved = outdb.execute(
+            sql=sql, logger=self.logger, params=(batch_id, start_date, end_date, run_key, start_date, end_date)
+        )
+
+        sql = f"""INSERT INTO public.{self.current_table} (geom, class_name, view_date, detection_date, area_km, lon, lat, tile_id, batch_id)
+        SELECT DISTINCT ON (b.geom_hash, b.view_date)
+            b.geom, b.class_name, b.view_date, b.detection_date, b.area_km, b.lon, b.lat, b.tile_id, %s
+        FROM public.{self.backfill_table} b
+        WHERE b.run_key = %s AND b.view_date BETWEEN %s AND %s
+        AND NOT EXISTS (
+            SELECT 1 FROM public.{self.current_table} f
+            WHERE f.geom_hash = b.geom_hash AND f.view_date = b.view_date
+            AND f.view_date BETWEEN %s AND %s
+        )
+        ORDER BY b.geom_hash, b.view_date, b.id;"""
+        inserted = outdb.execute(
+            sql=sql, logger=self.logger, params=(batch_id, run_key, start_date, end_date, start_date, end_date)
+        )
+        if moved + inserted == 0:
+            # no batch without rows for the validator
+            outdb.rollback()
+            return 0, 0
+
+        self.set_load_batch_status(batch_ids=[batch_id], status="transformed", rows=moved + inserted)
+        outdb.commit()
+
+        return moved, inserted
+
+    def ensure_monthly_partitions(self, table: str, start_date: date, end_date: date) -> int:
+        """
+        Create the missing partitions, one per month of view_date, of a table partitioned by
+        view_date for the months from start_date to end_date, so no row lands in the default
+        partition. A table that is not partitioned yet is left as is. The transaction is not committed here.
+
+        A partition can not be created while the default partition holds rows of its month,
+        e.g. alerts with a wrong Date_dt, so these rows are moved into the new partition.
+
+        Return: The number of partitions created.
+        """
+
+        if start_date is None or end_date is None:
+            return 0
+
+        outdb = self.get_database_facade()
+        sql = """SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s);"""
+        if not outdb.fetchone(query=sql, logger=self.logger, params=(f"public.{table}",)):
+            return 0
+
+        sql = """SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s);"""
+        data = outdb.fetchall(query=sql, logger=self.logger, params=(f"public.{table}",))
+        partitions = {r[0] for r in data} if data else set()
+        default = next((r[0] for r in data or [] if r[1]), None)
+
+        created = 0
+        month = start_date.replace(day=1)
+        while month <= end_date:
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            partition = f"{table}_{month.strftime('%Y%m')}"
+            if partition not in partitions:
+                moved = self.__take_default_rows(default=default, start_date=month, end_date=next_month)
+                sql = f"""CREATE TABLE IF NOT EXISTS public.{partition} PARTITION OF public.{table} FOR VALUES FROM (%s) TO (%s);"""
+                outdb.execute(sql=sql, logger=self.logger, params=(month, next_month))
+                if moved:
+                    self.__restore_default_rows(table=table, default=default)
+                    self.logger.warning(f"{moved} rows of {partition} moved out of the default partition {default}")
+                created += 1
+            month = next_month
+
+        if created:
+            self.logger.info(f"{created} monthly partitions of {table} created, from {start_date} to {end_date}")
+        return created
+
+    def __take_default_rows(self, default: str, start_date: date, end_date: date) -> int:
+        """
+        Move the rows of the default partition with a view_date from start_date, included, to
+        end_date, excluded, into the session table pg_temp.<default>_moved, so the partition of
+        these dates can be created. The transaction is not committed here.
+
+        Return: The number of rows moved.
+        """
+
+        if default is None:
+            return 0
+
+        outdb = self.get_database_facade()
+        sql = f"""CREATE TEMP TABLE IF NOT EXISTS {default}_moved (LIKE public.{default}) ON COMMIT DROP;
+        WITH taken AS (
+            DELETE FROM public.{default} WHERE view_date >= %s AND view_date < %s RETURNING *
+        )
+        INSERT INTO pg_temp.{default}_moved SELECT * FROM taken;"""
+
+        return outdb.execute(sql=sql, logger=self.logger, params=(start_date, end_date))
+
+    def __restore_default_rows(self, table: str, default: str):
+        """
+        Insert the rows taken from the default partition back into the partitioned table, where
+        they land in the new partition, without the generated columns. The transaction is not committed here.
+        """
+
+        outdb = self.get_database_facade()
+        sql = """SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position)
+        FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s AND is_generated = 'NEVER';"""
+        columns = outdb.fetchone(query=sql, logger=self.logger, params=(table,))[0]
+        sql = f"""INSERT INTO public.{table} ({columns}) SELECT {columns} FROM pg_temp.{default}_moved;
+        TRUNCATE pg_temp.{default}_moved;"""
+        outdb.execute(sql=sql, logger=self.logger)
+
+    def get_temp_table_dates(self) -> tuple[date, date]:
+        """Gets the first and the last view_date on the temporary table, or (None, None) if it is empty."""
+
+        outdb = self.get_database_facade()
+        sql = f"""SELECT min(view_date), max(view_date) FROM public.{self.temp_table};"""
+        data = outdb.fetchone(query=sql, logger=self.logger)
+
+        return (data[0], data[1]) if data else (None, None)  # type: ignore
+
+    def get_batch_dates(self, batch_ids: list[int]) -> tuple[date, date]:
+        """Gets the first and the last view_date of the rows of the load batches on the final table."""
+
+        outdb = self.get_database_facade()
+        sql = f"""SELECT min(view_date), max(view_date) FROM public.{self.current_table} WHERE batch_id = ANY(%s);"""
+        data = outdb.fetchone(query=sql, logger=self.logger, params=(list(batch_ids),))
+
+        return (data[0], data[1]) if data else (None, None)  # type: ignore
+
     def get_tmp_tables(self) -> list[str]:
         """Get the list of temporary tables on tmp schema."""
 
@@ -163,121 +713,135 @@ class OutputDatabase:
         if data is not None and len(data) > 0:
             tables = [r[0] for r in data]
 
-        outdb.close()
         return tables
 
-    def update_tmp_table(self, table: str):
-        """Update the view_date and tile_id on temporary table with the file_date and tile_id from input_data."""
+    def update_tmp_table(self, table: str) -> int:
+        """
+        Update the view_date and tile_id on temporary table with the file_date and tile_id from input_data.
+        The transaction is not committed here.
+
+        Return: The number of rows updated.
+        """
 
         outdb = self.get_database_facade()
-        alter_sql = f"""ALTER TABLE IF EXISTS tmp."{table}" ADD COLUMN IF NOT EXISTS view_date date;"""
+        alter_sql = f"""ALTER TABLE IF EXISTS tmp."{table}" ADD COLUMN IF NOT EXISTS view_date date, ADD COLUMN IF NOT EXISTS tile_id character varying;"""
         outdb.execute(sql=alter_sql, logger=self.logger)
-        outdb.commit()
-        alter_sql = f"""ALTER TABLE IF EXISTS tmp."{table}" ADD COLUMN IF NOT EXISTS tile_id character varying;"""
-        outdb.execute(sql=alter_sql, logger=self.logger)
-        outdb.commit()
 
-        sql = f"""UPDATE tmp."{table}" AS tmp SET view_date=ip.file_date, tile_id=ip.tile_id FROM public.input_data AS ip WHERE ip.file_name='{table}.shp';"""
-        outdb.execute(sql=sql, logger=self.logger)
-        outdb.commit()
-    
-    def unify_data(self):
-        """Insert data from all temporary tables on tmp schema into a single table on public schema."""
+        sql = f"""UPDATE tmp."{table}" AS tmp SET view_date=ip.file_date, tile_id=ip.tile_id FROM public.input_data AS ip WHERE ip.file_name IN (%s, %s);"""
+        return outdb.execute(sql=sql, logger=self.logger, params=(f"{table}.shp", f"{table}.zip"))
+
+    def unify_data(self, tables: list[str], batch_id: int) -> int:
+        """
+        Insert data from the temporary tables on tmp schema into a single table on public schema,
+        stamped with the load batch. The transaction is not committed here.
+
+        Return: The number of rows inserted.
+        """
 
         outdb = self.get_database_facade()
-        sql = f"""DO $$ DECLARE r RECORD;
-                  BEGIN
-                      FOR r IN (SELECT table_name FROM information_schema.tables WHERE table_schema='tmp' AND table_type='BASE TABLE') LOOP
-                          EXECUTE 'INSERT INTO public.{self.temp_table} (geom, class_name, view_date, detection_date, area_km, tile_id) SELECT ST_Multi(ST_Transform(geometry,4674)), ''alerta'', view_date, "Date_dt"::date, (ST_Area((ST_Transform(geometry,4674))::geography))/1000000, tile_id FROM tmp.' || quote_ident(r.table_name);
-                      END LOOP;
-                  END $$;"""
-        outdb.execute(sql=sql, logger=self.logger)
-        outdb.commit()
-           
-    def remove_duplicate_geometries(self):
+        rows = 0
+        for table in tables:
+            sql = f"""INSERT INTO public.{self.temp_table} (geom, class_name, view_date, detection_date, area_km, lon, lat, tile_id, batch_id)
+            SELECT geometry, 'alerta', view_date, "Date_dt"::date, area_km, lon, lat, tile_id, %s FROM tmp."{table}";"""
+            rows += outdb.execute(sql=sql, logger=self.logger, params=(batch_id,))
+
+        return rows
+
+    def remove_duplicate_geometries(self) -> int:
         """
         Remove duplicate geometries from the temporary table and
         remove records that already exist in the final table.
+        The transaction is not committed here.
+
+        Two geometries are the same when their geom_hash are equal, the MD5 of the
+        geometry snapped to a 0.000001 degree grid and normalized, a stored column
+        indexed with view_date on both tables, so both deletes are joins on the index.
+        The final table is bounded by the dates of the temporary table, so only the
+        partitions of these months are read.
+
+        Return: The number of rows removed.
         """
 
         outdb = self.get_database_facade()
+        start_date, end_date = self.get_temp_table_dates()
 
+        # Remove duplicados dentro da temp table (geom_hash + view_date), mantendo o menor id
         sql = f"""
-                -- Remove duplicados dentro da temp table (geom + view_date)
                 DELETE FROM public.{self.temp_table} t
-                WHERE t.id NOT IN (
-                    SELECT MIN(id)
-                    FROM (
-                        SELECT
-                            id,
-                            ST_SnapToGrid(geom, 0.000001) AS geom_norm,
-                            view_date
-                        FROM public.{self.temp_table}
-                    ) sub
-                    GROUP BY geom_norm, view_date
-                );
-
-
-                -- Remove o que já existe no final (geom + view_date, IGNORANDO tile_id)
+                USING public.{self.temp_table} d
+                WHERE d.geom_hash = t.geom_hash
+                AND d.view_date = t.view_date
+                AND d.id < t.id;
+        """
+        rows = outdb.execute(sql=sql, logger=self.logger)
+
+        # Remove o que já existe no final (geom_hash + view_date, IGNORANDO tile_id)
+        sql = f"""
                 DELETE FROM public.{self.temp_table} t
                 USING public.{self.current_table} f
-                WHERE ST_Equals(
-                        ST_SnapToGrid(t.geom, 0.000001),
-                        ST_SnapToGrid(f.geom, 0.000001)
-                    )
-                AND t.view_date = f.view_date;
+                WHERE f.geom_hash = t.geom_hash
+                AND f.view_date = t.view_date
+                AND f.view_date BETWEEN %s AND %s;
         """
+        rows += outdb.execute(sql=sql, logger=self.logger, params=(start_date, end_date))
 
-        outdb.execute(sql=sql, logger=self.logger)
-        outdb.commit()
+        return rows
+
+    def tmp_to_final(self) -> int:
+        """
+        Insert data from the temporary table on public schema into the final table on public schema.
+        The transaction is not committed here.
 
-    def tmp_to_final(self):
-        """Insert data from the temporary table on public schema into the final table on public schema."""
+        Return: The number of rows inserted.
+        """
 
         outdb = self.get_database_facade()
-        sql = f"""INSERT INTO public.{self.current_table} (geom, class_name, view_date, detection_date, area_km, tile_id)
-                  SELECT geom, class_name, view_date, detection_date, area_km, tile_id FROM public.{self.temp_table};"""
-        outdb.execute(sql=sql, logger=self.logger)
-        outdb.commit()
-        
-    def truncate_temp_table(self):
-        """Truncate the temporary table on public schema."""
+        sql = f"""INSERT INTO public.{self.current_table} (geom, class_name, view_date, detection_date, area_km, lon, lat, tile_id, batch_id)
+                  SELECT geom, class_name, view_date, detection_date, area_km, lon, lat, tile_id, batch_id FROM public.{self.temp_table};"""
+        return outdb.execute(sql=sql, logger=self.logger)
+
+    def truncate_temp_table(self) -> int:
+        """
+        Truncate the temporary table on public schema. The transaction is not committed here.
+
+        Return: The number of rows removed.
+        """
 
         outdb = self.get_database_facade()
+        data = outdb.fetchone(query=f"""SELECT count(*) FROM public.{self.temp_table};""", logger=self.logger)
         sql = f"""TRUNCATE TABLE public.{self.temp_table};"""
         outdb.execute(sql=sql, logger=self.logger)
-        outdb.commit()
-    
-    def drop_tmp_tables(self):
-        """Drop all temporary tables on tmp schema."""
 
-        outdb = self.get_database_facade()
+        return data[0] if data else 0
 
-        get_tables_sql = """
-            SELECT table_name
-            FROM information_schema.tables
-            WHERE table_schema = 'tmp'
-            AND table_type = 'BASE TABLE';
+    def drop_tmp_tables(self, tables: list[str]) -> int:
         """
+        Drop the temporary tables on tmp schema. The transaction is not committed here.
+        A table that fails to drop is logged and kept, each drop runs in its own savepoint.
 
-        tables = outdb.fetchall(get_tables_sql)
+        Return: The number of tables dropped.
+        """
 
-        for table in tables:
-            table_name = table[0]
+        outdb = self.get_database_facade()
 
+        dropped = 0
+        for table_name in tables:
+            outdb.execute(sql="SAVEPOINT drop_tmp_table;")
             try:
                 drop_sql = f'DROP TABLE IF EXISTS tmp."{table_name}"'
 
                 self.logger.info(f"Dropping table tmp.{table_name}")
 
                 outdb.execute(sql=drop_sql, logger=self.logger)
-
-                outdb.commit()
+                outdb.execute(sql="RELEASE SAVEPOINT drop_tmp_table;")
+                dropped += 1
 
             except Exception as e:
-                outdb.rollback()
+                outdb.execute(sql="ROLLBACK TO SAVEPOINT drop_tmp_table;")
                 self.logger.error(f"Error dropping tmp.{table_name}: {e}")
 
+        return dropped
+
     def get_last_deter_date(self) -> date:
         """To get the latest date of DETER data loaded from the data source."""
 
@@ -295,13 +859,71 @@ class OutputDatabase:
         return deter_date
 
 
-    def validate_data(self):
-        """Validate the deter rt data with intersection over otical deter."""
+    def get_optical_last_id(self) -> int:
+        """Gets the id of the last row of the optical DETER table, or 0 if it is empty."""
 
         outdb = self.get_database_facade()
+        sql = f"""SELECT COALESCE(MAX(id), 0) FROM public.{self.deter_optical_table};"""
+        data = outdb.fetchone(query=sql, logger=self.logger)
+
+        return data[0] if data else 0
+
+    def update_optical_coverage(self, after_id: int) -> int:
+        """
+        Merge the optical DETER rows after the id into the coverage table, by class: the new
+        polygons, buffered as the validation did, are dissolved with the coverage pieces that
+        intersect one of them, which are replaced by the subdivided result. Each piece is tested
+        against each new polygon, not against their union, so the pieces that only fall within the
+        extent of the new polygons are kept. An empty coverage is built from all the optical rows. The transaction is not committed here.
+
+        Return: The number of coverage pieces written.
+        """
+
+        outdb = self.get_database_facade()
+        data = outdb.fetchone(query=f"""SELECT 1 FROM public.{self.optical_coverage_table} LIMIT 1;""", logger=self.logger)
+        if not data:
+            after_id = 0
+
+        sql = f"""
+        WITH new_rows AS (
+            SELECT class_name, ST_Buffer(geom, 0.000000001) AS geom
+            FROM public.{self.deter_optical_table}
+            WHERE id > %s
+        ),
+        touched AS (
+            DELETE FROM public.{self.optical_coverage_table} c
+            WHERE EXISTS (
+                SELECT 1 FROM public.{self.deter_optical_table} o
+                WHERE o.id > %s AND o.class_name = c.class_name AND ST_Intersects(o.geom, c.geom)
+            )
+            RETURNING c.class_name, c.geom
+        )
+        INSERT INTO public.{self.optical_coverage_table} (class_name, geom)
+        SELECT class_name, ST_Multi(ST_Subdivide(ST_CollectionExtract(ST_Union(geom), 3), {int(self.coverage_max_vertices)}))
+        FROM (
+            SELECT class_name, geom FROM new_rows
+            UNION ALL
+            SELECT class_name, geom FROM touched
+        ) merged
+        GROUP BY class_name;
+        """
+
+        return outdb.execute(sql=sql, logger=self.logger, params=(after_id, after_id))
+
+    def validate_data(self, batch_ids: list[int]):
+        """
+        Validate the deter rt data of the load batches with intersection over otical deter.
+        The rows are found by the batch_id index, within the view_date range of the batches,
+        so only the partitions of these months are read, and the batches are marked as validated.
+        The optical DETER is read from the coverage table, so each alert only unions the few
+        small pieces of each class that it overlaps.
+        """
+
+        outdb = self.get_database_facade()
+        start_date, end_date = self.get_batch_dates(batch_ids=batch_ids)
+        params = {"batch_ids": list(batch_ids), "start_date": start_date, "end_date": end_date}
 
         CREATE_TABLE = []
-        UPDATE_AREA = []
         WITHOUT_AUDIT = []
         COPY_ADITED = []
         class_group = ["DESMATAMENTO_CR","DESMATAMENTO_VEG","MINERACAO"]
@@ -313,12 +935,12 @@ class OutputDatabase:
             CREATE TABLE public.{self.intermediary_table}_{class_name.lower()} AS
             SELECT null::character varying as nome_avaliador1, null::integer as auditar, null::timestamp without time zone as datafim_avaliador1, 
                 now()::date as created_at, null::character varying as classe_avaliador1,
-                a.area_km, a.view_date, a.detection_date, a.tile_id, a.uuid, '{class_name}' as optical_class_name,
+                a.area_km, a.lon, a.lat, a.view_date, a.detection_date, a.tile_id, a.uuid, '{class_name}' as optical_class_name,
                 (ST_Multi(ST_CollectionExtract(
                     COALESCE(
                     safe_diff(a.geom,
-                        ( SELECT st_union(st_buffer(b.geom,0.000000001))
-                        FROM public.{self.deter_optical_table} b
+                        ( SELECT st_union(b.geom)
+                        FROM public.{self.optical_coverage_table} b
                         WHERE
                             b.class_name = '{class_name}'
                             AND created_at<=now()::date
@@ -331,20 +953,14 @@ class OutputDatabase:
                 ) AS geom_diff,
                 ST_Multi(a.geom) as geom_original
             FROM public.{self.current_table} a
-            WHERE a.view_date IN(
-                SELECT file_date FROM public.input_data WHERE import_date=now()::date GROUP BY 1
-            );
-            """)
-
-            # update area_km on intermediary table
-            UPDATE_AREA.append(f"""
-            UPDATE public.{self.intermediary_table}_{class_name.lower()} SET area_km=ST_Area(geom_original::geography)/1000000;
+            WHERE a.batch_id = ANY(%(batch_ids)s)
+            AND a.view_date BETWEEN %(start_date)s AND %(end_date)s;
             """)
 
             # DETER_RT alerts are marked as audited by default when DETER_B coverage is greater than or equal to one threshold (50%)
             WITHOUT_AUDIT.append(f"""
             WITH calculate_area AS (
-                SELECT optical_class_name, ST_Area(geom_diff::geography)/1000000 as area_diff,ST_Area(geom_original::geography)/1000000 as area_original, uuid
+                SELECT optical_class_name, ST_Area(geom_diff::geography)/1000000 as area_diff, area_km as area_original, uuid
                 FROM public.{self.intermediary_table}_{class_name.lower()}
             )
             UPDATE public.{self.intermediary_table}_{class_name.lower()}
@@ -362,7 +978,7 @@ class OutputDatabase:
             nome_avaliador2, classe_avaliador2, datafim_avaliador2, deltat_avaliador2,
             geom, created_at, tile_id, auditar)
             
-            SELECT uuid, ST_X(ST_Centroid(geom_original)) as lon, ST_Y(ST_Centroid(geom_original)) as lat,
+            SELECT uuid, COALESCE(lon, ST_X(ST_Centroid(geom_original))) as lon, COALESCE(lat, ST_Y(ST_Centroid(geom_original))) as lat,
             area_km, view_date, detection_date, 'alerta'::character varying(256) as class_name,
             nome_avaliador1, classe_avaliador1, datafim_avaliador1, 0 as deltat_avaliador1,
             nome_avaliador1 as nome_avaliador2, classe_avaliador1 as classe_avaliador2, datafim_avaliador1 as datafim_avaliador2, 0 as deltat_avaliador2,
@@ -374,11 +990,7 @@ class OutputDatabase:
 
         for sql in CREATE_TABLE:
             # create the intermeriary table without overlap
-            outdb.execute(sql=sql, logger=self.logger)
-
-        for sql in UPDATE_AREA:
-            # update area
-            outdb.execute(sql=sql, logger=self.logger)
+            outdb.execute(sql=sql, logger=self.logger, params=params)
 
         self.logger.debug(
             "Marked as audited by default when coverage is greater than or equal to 50%"
@@ -403,26 +1015,25 @@ class OutputDatabase:
         nome_avaliador2, classe_avaliador2, datafim_avaliador2, deltat_avaliador2,
         geom, created_at, tile_id, auditar)
 
-        SELECT uuid, ST_X(ST_Centroid(geom)) as lon, ST_Y(ST_Centroid(geom)) as lat,
+        SELECT uuid, COALESCE(lon, ST_X(ST_Centroid(geom))) as lon, COALESCE(lat, ST_Y(ST_Centroid(geom))) as lat,
         area_km, view_date, detection_date, 'alerta'::character varying(256) as class_name,
         null::character varying, null::character varying, null::timestamp without time zone, 0 as deltat_avaliador1,
         null::character varying, null::character varying, null::timestamp without time zone, 0 as deltat_avaliador2,
         geom, created_at, tile_id, null::integer as auditar
         FROM public.{self.current_table} 
         WHERE uuid NOT IN (SELECT uuid::uuid FROM public.{self.audited_table})
-        AND view_date IN(
-            SELECT file_date FROM public.input_data WHERE import_date=now()::date GROUP BY 1
-        )
-        AND created_at = now()::date;
+        AND batch_id = ANY(%(batch_ids)s)
+        AND view_date BETWEEN %(start_date)s AND %(end_date)s;
         """
-        outdb.execute(sql=COPY_NON_AUDITED, logger=self.logger)
+        outdb.execute(sql=COPY_NON_AUDITED, logger=self.logger, params=params)
 
         # Mark all records as validated ("is_done=1") in the main table to prevent them from being reused in the validation draw process.
         UPDATE_IS_DONE = f"""
-        UPDATE public.{self.current_table} SET is_done=1 WHERE is_done=0;
+        UPDATE public.{self.current_table} SET is_done=1
+        WHERE batch_id = ANY(%(batch_ids)s) AND view_date BETWEEN %(start_date)s AND %(end_date)s AND is_done=0;
         """
         # Update is_done to 1
-        outdb.execute(sql=UPDATE_IS_DONE, logger=self.logger)
+        outdb.execute(sql=UPDATE_IS_DONE, logger=self.logger, params=params)
         self.logger.info(f"Mark all records as validated in the main table.")
 
         # the candidates by bigger areas
@@ -492,6 +1103,7 @@ class OutputDatabase:
             outdb.execute(sql=DROP_TMP_TABLE, logger=self.logger)
             self.logger.info(f"Drop the temporary table ({self.intermediary_table}_{class_name.lower()})")
 
+        self.set_load_batch_status(batch_ids=batch_ids, status="validated")
         outdb.commit()
 
     def get_info_to_report(self):
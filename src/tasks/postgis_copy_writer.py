@@ -0,0 +1,188 @@
+import struct
+from datetime import date
+from typing import Any, Iterable, Iterator
+from utils.database_facade import DatabaseFacade
+from utils.logger import TasksLogger
+
+
+class CopyStream:
+    """A read-only file-like object over an iterator of bytes, as expected by copy_expert."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self.buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        return self.read(size)
+
+
+class PostGISCopyWriter:
+    """
+    PostGIS Copy Writer: Streams rows into a PostGIS table with the PostgreSQL binary COPY FROM STDIN.
+
+    The supported column types are int8, float8, text, date and geometry, where a
+    geometry value is EWKB bytes. A None value is written as NULL.
+    """
+
+    HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+    TRAILER = struct.pack("!h", -1)
+    NULL = struct.pack("!i", -1)
+    # PostgreSQL stores dates as days since 2000-01-01
+    PG_EPOCH = date(2000, 1, 1).toordinal()
+    # the number of encoded rows sent in each chunk of the stream
+    ROWS_PER_CHUNK = 1000
+
+    def __init__(self, database: DatabaseFacade, logger: TasksLogger):
+        self.database = database
+        self.logger = logger
+
+    @classmethod
+    def __encode_value(cls, value: Any, pg_type: str) -> bytes:
+        if value is None:
+            return cls.NULL
+
+        if pg_type == "int8":
+            data = struct.pack("!q", int(value))
+        elif pg_type == "float8":
+            data = struct.pack("!d", float(value))
+        elif pg_type == "date":
+            data = struct.pack("!i", value.toordinal() - cls.PG_EPOCH)
+        elif pg_type == "text":
+            data = str(value).encode("utf-8")
+        elif pg_type == "geometry":
+            data = bytes(value)
+        else:
+            raise ValueError(f"Unsupported type for binary COPY: {pg_type}")
+
+        return struct.pack("!i", len(data)) + data
+
+    def __encode_rows(self, rows: Iterable[tuple], types: list[str], counter: list[int]) -> Iterator[bytes]:
+        yield self.HEADER
+
+        field_count = struct.pack("!h", len(types))
+        chunk = []
+        for row in rows:
+            chunk.append(field_count + b"".join(self.__encode_value(v, t) for v, t in zip(row, types)))
+            counter[0] += 1
+            if len(chunk) >= self.ROWS_PER_CHUNK:
+                yield b"".join(chunk)
+                chunk = []
+
+        if chunk:
+            yield b"".join(chunk)
+        yield self.TRAILER
+
+    def copy_rows(self, table: str, columns: list[tuple[str, str]], rows: Iterable[tuple]) -> int:
+        """
+        Stream the rows into the table. The transaction is not committed here.
+
+        Parameters
+        ----
+        :param:table: The qualified and quoted table name, e.g. tmp."file_name".
+        :param:columns: A list of (column name, type) in the order of the row values.
+        :param:rows: An iterable of tuples with one value per column.
+
+        Return: The number of rows written.
+        """
+
+        names = ", ".join(f'"{name}"' for name, _ in columns)
+        sql = f"COPY {table} ({names}) FROM STDIN WITH (FORMAT binary)"
+        self.logger.debug(sql)
+
+        counter = [0]
+        stream = CopyStream(self.__encode_rows(rows=rows, types=[t for _, t in columns], counter=counter))
+        cursor = self.database.conn.cursor()
+        cursor.copy_expert(sql, stream)
+        cursor.close()
+
+        return counter[0]
+
+    def write_tagged(
+        self,
+        table: str,
+        wkb: Iterable[bytes],
+        dates: Iterable[str],
+        area_km: Iterable[float],
+        lon: Iterable[float],
+        lat: Iterable[float],
+        view_date: date,
+        tile_id: str,
+    ) -> int:
+        """
+        Stream the rows into an existing table with the geometry, "Date_dt", area_km, lon, lat,
+        view_date and tile_id columns, every row tagged with the view_date and tile_id of its file.
+        The transaction is not committed here.
+
+        Return: The number of rows written.
+        """
+
+        return self.copy_rows(
+            table=table,
+            columns=[
+                ("geometry", "geometry"),
+                ("Date_dt", "text"),
+                ("area_km", "float8"),
+                ("lon", "float8"),
+                ("lat", "float8"),
+                ("view_date", "date"),
+                ("tile_id", "text"),
+            ],
+            rows=((*row, view_date, tile_id) for row in zip(wkb, dates, area_km, lon, lat)),
+        )
+
+    def write_table(
+        self,
+        schema: str,
+        table: str,
+        srid: int,
+        wkb: Iterable[bytes],
+        dates: Iterable[str],
+        area_km: Iterable[float],
+        lon: Iterable[float],
+        lat: Iterable[float],
+        start: int = 0,
+    ) -> int:
+        """
+        Create the table in the same layout written by GeoDataFrame.to_postgis for the
+        columns used downstream (id, "Date_dt", area_km, lon, lat and geometry), and stream the rows into it.
+        With a start other than 0, the rows are appended to the table, numbered from start,
+        as the next window of the same file. The geometries are EWKB with the srid.
+        The transaction is not committed here.
+
+        Return: The number of rows written.
+        """
+
+        target = f'{schema}."{table}"'
+        if start == 0:
+            self.database.execute(sql=f"DROP TABLE IF EXISTS {target};", logger=self.logger)
+            self.database.execute(
+                sql=f"""CREATE TABLE {target} (id bigint, "Date_dt" text, area_km double precision,
+                lon double precision, lat double precision, geometry geometry(Geometry, {int(srid)}));""",
+                logger=self.logger,
+            )
+
+        return self.copy_rows(
+            table=target,
+            columns=[
+                ("id", "int8"),
+                ("Date_dt", "text"),
+                ("area_km", "float8"),
+                ("lon", "float8"),
+                ("lat", "float8"),
+                ("geometry", "geometry"),
+            ],
+            rows=((i, *row) for i, row in enumerate(zip(dates, area_km, lon, lat, wkb), start=start)),
+        )
@@ -0,0 +1,108 @@
+import json
+import sqlite3
+from contextlib import closing
+from time import time
+from utils.logger import TasksLogger
+
+
+class RemoteListingCache:
+    """
+    Remote Listing Cache: A local SQLite store of the remote directory listing.
+
+    It keeps a snapshot of the last listing of each remote directory, and the per-entry
+    work (the parsed modification date and whether the file is known to be registered
+    in the control table), keyed by path and ETag. An entry whose ETag changed is a miss.
+    """
+
+    def __init__(self, db_path: str, log_level: str):
+        self.db_path = db_path
+        self.logger = TasksLogger(self.__class__.__name__)
+        self.logger.setLoggerLevel(level=log_level)
+        self.stats = {"listing_hits": 0, "listing_misses": 0, "entry_hits": 0, "entry_misses": 0}
+        self.__create_tables()
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def __create_tables(self):
+        with closing(self.__connect()) as conn, conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS listing (
+                    remote_dir TEXT PRIMARY KEY, listed_at REAL NOT NULL, entries TEXT NOT NULL)"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS entry (
+                    path TEXT PRIMARY KEY, etag TEXT NOT NULL, modified TEXT NOT NULL,
+                    registered INTEGER NOT NULL DEFAULT 0)"""
+            )
+
+    def get_listing(self, remote_dir: str, max_age: float) -> list[dict]:
+        """Return the last listing of the remote directory if it is younger than max_age seconds, otherwise None."""
+
+        with closing(self.__connect()) as conn:
+            row = conn.execute(
+                "SELECT listed_at, entries FROM listing WHERE remote_dir=?", (remote_dir,)
+            ).fetchone()
+
+        if row is None or (time() - row[0]) > max_age:
+            self.stats["listing_misses"] += 1
+            return None  # type: ignore
+
+        self.stats["listing_hits"] += 1
+        self.logger.debug(f"Listing of {remote_dir} served from cache ({time() - row[0]:.0f} s old).")
+        return json.loads(row[1])
+
+    def put_listing(self, remote_dir: str, entries: list[dict]):
+        """Store the listing of the remote directory."""
+
+        with closing(self.__connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO listing(remote_dir, listed_at, entries) VALUES (?, ?, ?)",
+                (remote_dir, time(), json.dumps(entries, default=str)),
+            )
+
+    def lookup(self, entries: list[dict]) -> dict[str, dict]:
+        """
+        Return the cached work of the entries whose path and ETag did not change,
+        as a dict of path to {'modified', 'registered'}.
+        """
+
+        found = {}
+        with closing(self.__connect()) as conn:
+            for entry in entries:
+                row = conn.execute(
+                    "SELECT modified, registered FROM entry WHERE path=? AND etag=?",
+                    (entry['path'], str(entry['etag'])),
+                ).fetchone()
+                if row is not None:
+                    found[entry['path']] = {'modified': row[0], 'registered': bool(row[1])}
+
+        self.stats["entry_hits"] += len(found)
+        self.stats["entry_misses"] += len(entries) - len(found)
+
+        return found
+
+    def put_entries(self, entries: list[dict]):
+        """Store the parsed modification date of the entries, as a dict with path, etag and modified keys."""
+
+        with closing(self.__connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO entry(path, etag, modified, registered) VALUES (?, ?, ?, 0)",
+                [(e['path'], str(e['etag']), e['modified']) for e in entries],
+            )
+
+    def mark_registered(self, paths: list[str]):
+        """Mark the entries as registered in the control table, so they need no further checks."""
+
+        with closing(self.__connect()) as conn, conn:
+            conn.executemany("UPDATE entry SET registered=1 WHERE path=?", [(p,) for p in paths])
+
+    def log_stats(self):
+        """Write the cache counters to the log."""
+
+        total = self.stats["entry_hits"] + self.stats["entry_misses"]
+        self.logger.info(
+            f"Listing cache: {self.stats['entry_hits']} of {total} entries served from cache, "
+            f"{self.stats['entry_misses']} new or changed; "
+            f"{self.stats['listing_hits']} listings served from cache."
+        )
@@ -0,0 +1,365 @@
+"""
+Shapefile parser used by the loader.
+
+The functions of this module run in the worker processes of the loader, so they only
+take and return plain picklable values, and they do not touch the database.
+"""
+
+import os
+import resource
+import struct
+import zipfile
+from datetime import date, datetime
+from time import perf_counter
+from typing import Any, Iterable
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyogrio import read_info
+from pyogrio.raw import read_arrow
+from pyproj import CRS, Transformer
+from tasks.memmap_shapefile_reader import UnsupportedShapefileError, read_shapefile
+
+# the attribute columns used downstream, the geometry is always read
+COLUMNS = ["Date_dt"]
+# the CRS of the alerts on the database, SIRGAS 2000
+TARGET_SRID = 4674
+# the flag of the geometry type of EWKB that marks an SRID after the type
+EWKB_SRID_FLAG = 0x20000000
+# the .shx file has a 100 bytes header and one 8 bytes record per feature
+SHX_HEADER_SIZE = 100
+SHX_RECORD_SIZE = 8
+# the memory used by a parsed feature per byte of .shp, with the GeoDataFrame and the encoded rows
+MEMORY_PER_SHP_BYTE = 6
+# the smallest window, so a tiny budget does not turn into one query per feature
+MIN_WINDOW_ROWS = 1000
+
+
+def get_read_path(filein: str) -> str:
+    """Return the path to read a shapefile, or the /vsizip/ path of the shapefile inside a zipped bundle."""
+
+    if not filein.lower().endswith(".zip"):
+        return filein
+
+    with zipfile.ZipFile(filein) as archive:
+        members = [n for n in archive.namelist() if n.lower().endswith(".shp")]
+
+    if len(members) != 1:
+        raise ValueError(f"Expected one shapefile in {filein}, found {len(members)}")
+
+    return f"/vsizip/{filein}/{members[0]}"
+
+
+def to_ewkb(geometries: Any, srid: int) -> np.ndarray:
+    """Encode an array of shapely geometries as EWKB with the SRID, or as WKB if the SRID is unknown."""
+
+    geometries = np.asarray(geometries)
+    if srid is None:
+        return shapely.to_wkb(geometries)
+
+    return shapely.to_wkb(shapely.set_srid(geometries, srid), include_srid=True)
+
+
+def to_text_dates(values: Iterable[Any]) -> list[str]:
+    """Encode the values of a date column as 'YYYY-MM-DD' text, keeping the nulls."""
+
+    out = []
+    for value in values:
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            out.append(None)
+        elif isinstance(value, (date, datetime)):
+            out.append(value.strftime("%Y-%m-%d"))
+        else:
+            out.append(str(value)[:10])
+    return out
+
+
+def set_wkb_srid(wkb: bytes, srid: int) -> bytes:
+    """
+    Turn a WKB geometry into EWKB with the SRID, by setting the SRID flag of the geometry
+    type and inserting the SRID after it. Only the outer geometry carries the SRID.
+    """
+
+    byteorder = "<" if wkb[0] == 1 else ">"
+    (geometry_type,) = struct.unpack(f"{byteorder}I", wkb[1:5])
+    return (
+        wkb[:1]
+        + struct.pack(f"{byteorder}I", geometry_type | EWKB_SRID_FLAG)
+        + struct.pack(f"{byteorder}I", srid)
+        + wkb[5:]
+    )
+
+
+def strip_wkb_srid(wkb: bytes) -> bytes:
+    """Turn an EWKB geometry with an SRID back into WKB. Other geometries are returned as they are."""
+
+    if wkb is None:
+        return None  # type: ignore
+
+    byteorder = "<" if wkb[0] == 1 else ">"
+    (geometry_type,) = struct.unpack(f"{byteorder}I", wkb[1:5])
+    if not geometry_type & EWKB_SRID_FLAG:
+        return bytes(wkb)
+
+    return wkb[:1] + struct.pack(f"{byteorder}I", geometry_type & ~EWKB_SRID_FLAG) + wkb[9:]
+
+
+def read_fiona(filein: str, start: int = 0, stop: int = None) -> tuple[int, str, Any, list[str]]:
+    """
+    Read the features from start to stop of a shapefile with GeoPandas and fiona, building the shapely geometries.
+
+    Return: (srid, crs as WKT, EWKB geometries, dates)
+    """
+
+    gdf = gpd.read_file(get_read_path(filein), engine="fiona", rows=slice(start, stop))
+
+    if gdf.crs is None:
+        raise ValueError(f"Failed to read CRS for shapefile {filein}")
+
+    srid = gdf.crs.to_epsg()
+    dates = to_text_dates(gdf["Date_dt"]) if "Date_dt" in gdf.columns else [None] * len(gdf)
+
+    return srid, gdf.crs.to_wkt(), to_ewkb(gdf.geometry.values, srid=srid), dates
+
+
+def read_pyogrio(filein: str, start: int = 0, stop: int = None) -> tuple[int, str, Any, list[str]]:
+    """
+    Read the features from start to stop of a shapefile with pyogrio as an Arrow table, only with the columns used downstream.
+    The geometries stay as the WKB written by GDAL, no shapely objects are built.
+
+    Return: (srid, crs as WKT, EWKB geometries, dates)
+    """
+
+    path = get_read_path(filein)
+    fields = read_info(path)["fields"]
+    meta, table = read_arrow(
+        path,
+        columns=[c for c in COLUMNS if c in fields],
+        skip_features=start,
+        max_features=None if stop is None else stop - start,
+    )
+
+    if not meta["crs"]:
+        raise ValueError(f"Failed to read CRS for shapefile {filein}")
+
+    crs = CRS.from_user_input(meta["crs"])
+    srid = crs.to_epsg()
+    wkb = table.column(meta["geometry_name"] or "wkb_geometry").to_pylist()
+    if srid is not None:
+        wkb = [None if g is None else set_wkb_srid(g, srid) for g in wkb]
+    dates = to_text_dates(table.column("Date_dt").to_pylist()) if "Date_dt" in table.column_names else [None] * len(wkb)
+
+    return srid, crs.to_wkt(), wkb, dates
+
+
+def normalize(wkb: Any, crs: str) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Normalize the geometries as they are stored on the database, for whole arrays at once:
+    reprojected to 4674 and as MultiPolygons, with the geodesic area in km² on the
+    ellipsoid of 4674, as ST_Area(geography), and the lon/lat of the planar centroid in 4674.
+
+    Return: (EWKB geometries in 4674, area_km, lon, lat)
+    """
+
+    geometries = shapely.from_wkb(np.asarray(wkb, dtype=object))
+    source = CRS.from_user_input(crs)
+    if source.to_epsg() != TARGET_SRID:
+        transformer = Transformer.from_crs(source, TARGET_SRID, always_xy=True)
+        geometries = shapely.transform(
+            geometries, lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1]))
+        )
+
+    polygons = shapely.get_type_id(geometries) == shapely.GeometryType.POLYGON
+    if polygons.any():
+        geometries[polygons] = shapely.multipolygons(geometries[polygons], indices=np.arange(polygons.sum()))
+
+    centroids = shapely.centroid(geometries)
+
+    return (
+        to_ewkb(geometries, srid=TARGET_SRID),
+        geodesic_area_km(geometries),
+        shapely.get_x(centroids),
+        shapely.get_y(centroids),
+    )
+
+
+def authalic_latitude(lat: np.ndarray, e: float) -> np.ndarray:
+    """Map geodetic latitudes, in radians, to the authalic sphere of an ellipsoid of eccentricity e."""
+
+    def q(sin_lat):
+        return (1 - e * e) * (
+            sin_lat / (1 - (e * sin_lat) ** 2) - np.log((1 - e * sin_lat) / (1 + e * sin_lat)) / (2 * e)
+        )
+
+    return np.arcsin(np.clip(q(np.sin(lat)) / q(1.0), -1.0, 1.0))
+
+
+def geodesic_area_km(geometries: np.ndarray) -> np.ndarray:
+    """
+    Compute the geodesic area in km² of (Multi)Polygons in 4674, for whole arrays at once.
+    The coordinates of all rings are flattened into one array and mapped to the authalic
+    sphere of the ellipsoid, which keeps the areas. The spherical excess of every edge is
+    computed in one pass, summed per ring, and the outer rings are added and the holes
+    subtracted, whatever their orientation. The edges are great circles on that sphere,
+    which for alerts, with edges of metres, differs from the geodesic area of ST_Area(geography)
+    by far less than its rounding.
+    """
+
+    parts, part_index = shapely.get_parts(geometries, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+
+    # the first ring of each polygon is its exterior
+    exterior = np.ones(len(rings), dtype=bool)
+    exterior[1:] = ring_part[1:] != ring_part[:-1]
+
+    ellipsoid = CRS.from_epsg(TARGET_SRID).ellipsoid
+    a, f = ellipsoid.semi_major_metre, 1 / ellipsoid.inverse_flattening
+    e = np.sqrt(f * (2 - f))
+    authalic_radius_2 = a * a / 2 * (1 + (1 - e * e) / (2 * e) * np.log((1 + e) / (1 - e)))
+
+    lon = np.radians(coords[:, 0])
+    tan_lat = np.tan(authalic_latitude(np.radians(coords[:, 1]), e) / 2)
+
+    # the edges join consecutive coordinates of the same ring, the rings are closed
+    edge = coord_ring[1:] == coord_ring[:-1]
+    dlon = lon[1:] - lon[:-1]
+    # wrapped only across the antimeridian, adding pi to every difference would round it
+    dlon = np.where(dlon > np.pi, dlon - 2 * np.pi, np.where(dlon < -np.pi, dlon + 2 * np.pi, dlon))
+    excess = 2 * np.arctan2(np.tan(dlon / 2) * (tan_lat[:-1] + tan_lat[1:]), 1 + tan_lat[:-1] * tan_lat[1:])
+
+    ring_area = np.abs(np.bincount(coord_ring[:-1][edge], weights=excess[edge], minlength=len(rings))) * authalic_radius_2
+    ring_area = np.where(exterior, ring_area, -ring_area)
+
+    return np.bincount(part_index[ring_part], weights=ring_area, minlength=len(geometries)) / 1_000_000
+
+
+READERS = {"fiona": read_fiona, "pyogrio": read_pyogrio, "memmap": read_shapefile}
+
+
+def get_peak_rss() -> int:
+    """Return the peak resident memory of this process in bytes, since it started or since the last reset_peak_rss."""
+
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # not resettable, but available on any unix
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of this process to the current one, where Linux allows it."""
+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def plan_windows(filein: str, memory_budget: int) -> list[tuple[int, int]]:
+    """
+    Split the features of a shapefile, or zipped bundle, into row windows that are expected
+    to fit in the memory budget once parsed. The number of features and their average size
+    come from the sizes of the .shx and .shp files, so nothing is read.
+
+    Parameters
+    ----
+    :param:filein: The path of the shapefile, or of the zipped bundle.
+    :param:memory_budget: The memory budget of a window in bytes, 0 reads the whole file at once.
+
+    Return: a list of (start, stop), stop is None for the last window of an unknown number of features.
+    """
+
+    try:
+        if filein.lower().endswith(".zip"):
+            with zipfile.ZipFile(filein) as archive:
+                sizes = {os.path.splitext(i.filename)[1].lower(): i.file_size for i in archive.infolist()}
+        else:
+            base = os.path.splitext(filein)[0]
+            sizes = {ext: os.path.getsize(f"{base}{ext}") for ext in (".shp", ".shx") if os.path.isfile(f"{base}{ext}")}
+    except (OSError, zipfile.BadZipFile):
+        sizes = {}
+
+    if not memory_budget or ".shp" not in sizes or ".shx" not in sizes:
+        return [(0, None)]  # type: ignore
+
+    count = (sizes[".shx"] - SHX_HEADER_SIZE) // SHX_RECORD_SIZE
+    if count <= 0:
+        return [(0, None)]  # type: ignore
+
+    row_bytes = max(1, sizes[".shp"] // count) * MEMORY_PER_SHP_BYTE
+    rows = max(MIN_WINDOW_ROWS, memory_budget // row_bytes)
+
+    return [(start, min(start + rows, count)) for start in range(0, count, rows)]
+
+
+def parse_shapefile(filein: str, reader: str = "fiona", start: int = 0, stop: int = None) -> dict:
+    """
+    Read one shapefile, or zipped bundle, or a window of its features, and normalize the columns used downstream.
+    The geometries are normalized as stored on the database, see normalize.
+
+    Parameters
+    ----
+    :param:filein: The path of the shapefile, or of the zipped bundle.
+    :param:reader: "fiona" reads through GeoPandas, "pyogrio" reads an Arrow table with column projection,
+    "memmap" maps plain polygon shapefiles and falls back to "fiona" for anything else.
+    :param:start, stop: The window of features to read, by default all of them.
+
+    Return: dict with the keys
+        name: the file name without extension,
+        srid: 4674, the EPSG code of the normalized geometries,
+        crs: the CRS as WKT,
+        wkb: the MultiPolygons in 4674 as EWKB,
+        dates: the "Date_dt" column as 'YYYY-MM-DD' text,
+        area_km: the geodesic area in km²,
+        lon, lat: the centroid,
+        start: the index of the first feature read,
+        rows: the number of features,
+        reader: the reader used, which differs from the requested one after a fallback,
+        parse_seconds: the time spent reading and normalizing,
+        peak_rss: the peak resident memory of the parsing process while reading, in bytes.
+    """
+
+    reset_peak_rss()
+    started_at = perf_counter()
+    try:
+        _, crs, wkb, dates = READERS[reader](filein, start, stop)
+    except UnsupportedShapefileError as ex:
+        _, crs, wkb, dates = read_fiona(filein, start, stop)
+        reader = f"fiona, {ex}"
+
+    wkb, area_km, lon, lat = normalize(wkb, crs)
+
+    return {
+        "name": os.path.basename(filein).split(".")[0],
+        "srid": TARGET_SRID,
+        "crs": CRS.from_epsg(TARGET_SRID).to_wkt(),
+        "wkb": wkb,
+        "dates": dates,
+        "area_km": area_km,
+        "lon": lon,
+        "lat": lat,
+        "start": start,
+        "rows": len(wkb),
+        "reader": reader,
+        "parse_seconds": perf_counter() - started_at,
+        "peak_rss": get_peak_rss(),
+    }
+
+
+def to_geodataframe(parsed: dict) -> gpd.GeoDataFrame:
+    """Rebuild a GeoDataFrame from a parsed shapefile."""
+
+    index = pd.RangeIndex(parsed["start"], parsed["start"] + parsed["rows"])
+    return gpd.GeoDataFrame(
+        {"Date_dt": parsed["dates"], "area_km": parsed["area_km"], "lon": parsed["lon"], "lat": parsed["lat"]},
+        geometry=gpd.GeoSeries.from_wkb(parsed["wkb"], crs=parsed["crs"], index=index),
+        index=index,
+    )
@@ -38,8 +38,18 @@ class SQLViewCollector(Collector):
             # create a SQLView in the output database from the source database
             db.create_data_source_sql_view(sql=self.data_source.sql_view_to_create())
 
+            # the monthly partitions of the new data, up to today
+            db.ensure_monthly_partitions(
+                table=db.deter_optical_table, start_date=last_deter_date, end_date=date.today()
+            )
+
+            last_id = db.get_optical_last_id()
             sql = self.data_source.sql_copy_from_data_source(reference_date=last_deter_date)
             num_rows = outdb.execute(sql=sql, logger=self.logger)
+
+            # merge the new rows into the optical coverage used by the validation
+            pieces = db.update_optical_coverage(after_id=last_id)
+            self.logger.info(f"{num_rows} optical rows copied, {pieces} coverage pieces written")
             
             # Remove SQLView from the output database
             db.drop_data_source_sql_view(sql=self.data_source.sql_view_to_drop())
@@ -94,14 +94,14 @@ class DatabaseFacade(BaseModel):
 
         self.conn.rollback()
 
-    def execute(self, sql: str, logger: TasksLogger = None): # type: ignore
-        """Execute a sql string."""
+    def execute(self, sql: str, logger: TasksLogger = None, params: Any = None): # type: ignore
+        """Execute a sql string. The optional params are bound to the %s placeholders."""
         if logger:
             logger.debug(" ".join(sql.split()))
 
         cursor = self.conn.cursor()
 
-        cursor.execute(sql)
+        cursor.execute(sql, params)
 
         rowcount = cursor.rowcount
 
@@ -183,22 +183,22 @@ class DatabaseFacade(BaseModel):
                 force_recreate=force_recreate,
             )
 
-    def fetchall(self, query, logger: TasksLogger = None): # type: ignore
+    def fetchall(self, query, logger: TasksLogger = None, params: Any = None): # type: ignore
         if logger:
             logger.debug(query.strip())
 
         cursor = self.conn.cursor()
-        cursor.execute(query)
+        cursor.execute(query, params)
         data = cursor.fetchall()
         cursor.close()
         return data
 
-    def fetchone(self, query, logger: TasksLogger = None): # type: ignore
+    def fetchone(self, query, logger: TasksLogger = None, params: Any = None): # type: ignore
         if logger:
             logger.debug(query.strip())
 
         cursor = self.conn.cursor()
-        cursor.execute(query)
+        cursor.execute(query, params)
         data = cursor.fetchone()
         cursor.close()
         return data
@@ -0,0 +1,102 @@
+import random
+from time import monotonic, sleep
+from typing import Any, Callable
+from utils.logger import TasksLogger
+
+
+class RetryPolicy:
+    """
+    Retry policy with exponential backoff, jitter, a maximum number of attempts
+    and a total time budget counted from the first attempt.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 2.0,
+        max_delay: float = 60.0,
+        time_budget: float = 600.0,
+        jitter: float = 0.5,
+    ):
+        self.max_attempts = max(int(max_attempts), 1)
+        self.base_delay = max(float(base_delay), 0.0)
+        self.max_delay = max(float(max_delay), self.base_delay)
+        self.time_budget = max(float(time_budget), 0.0)
+        self.jitter = min(max(float(jitter), 0.0), 1.0)
+
+    @classmethod
+    def from_settings(cls, settings: dict, prefix: str = "retry_") -> "RetryPolicy":
+        """
+        Build a policy from a dict of settings, such as the extras of an Airflow connection.
+        Missing keys keep the default values.
+
+        Keys: retry_max_attempts, retry_base_delay, retry_max_delay, retry_time_budget, retry_jitter
+        """
+        names = ["max_attempts", "base_delay", "max_delay", "time_budget", "jitter"]
+        kwargs = {
+            name: settings[f"{prefix}{name}"]
+            for name in names
+            if settings.get(f"{prefix}{name}") is not None
+        }
+        return cls(**kwargs)
+
+    def delay(self, attempt: int) -> float:
+        """The time to wait, in seconds, after the given failed attempt (starting at 1)."""
+
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (max(attempt, 1) - 1)))
+        return ceiling * (1.0 - self.jitter * random.random())
+
+    def can_retry(self, attempt: int, started_at: float, delay: float) -> bool:
+        """
+        Whether a new attempt is allowed after the given failed attempt.
+
+        Parameters
+        ----
+        :param:attempt: The number of attempts already made.
+        :param:started_at: The monotonic time of the first attempt.
+        :param:delay: The time to wait before the next attempt.
+        """
+
+        if attempt >= self.max_attempts:
+            return False
+
+        return (monotonic() + delay - started_at) <= self.time_budget
+
+    def call(
+        self,
+        fnc: Callable[..., Any],
+        *args,
+        is_retryable: Callable[[Exception], bool] = lambda exc: True,
+        logger: TasksLogger = None,  # type: ignore
+        description: str = "",
+        **kwargs,
+    ) -> Any:
+        """
+        Call the function until it succeeds or the policy gives up.
+        The last exception is raised when the policy gives up.
+        """
+
+        description = description if description else getattr(fnc, "__name__", "call")
+        started_at = monotonic()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            try:
+                return fnc(*args, **kwargs)
+            except Exception as exc:
+                if not is_retryable(exc):
+                    raise exc
+
+                delay = self.delay(attempt)
+                if not self.can_retry(attempt=attempt, started_at=started_at, delay=delay):
+                    if logger:
+                        logger.error(f"Giving up {description} after {attempt} attempts: {exc}")
+                    raise exc
+
+                if logger:
+                    logger.warning(
+                        f"Attempt {attempt} of {self.max_attempts} to {description} failed: {exc}. "
+                        f"Retrying in {delay:.1f} seconds..."
+                    )
+                sleep(delay)
@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# used to load the location where code of tasks are
+sys.path.append(str(pathlib.Path(__file__).parent.parent.joinpath("src").resolve().absolute()))
@@ -0,0 +1,89 @@
+"""
+Write small polygon shapefiles byte by byte for the tests, so the cases that GDAL would
+not write on its own, as deleted DBF records, are covered too.
+"""
+
+import struct
+
+from pyproj import CRS
+
+SHP_NULL = 0
+SHP_POLYGON = 5
+
+# shapefile rings: the outer ones are clockwise, the holes counterclockwise
+SQUARE = [(-50.0, -10.0), (-50.0, -9.0), (-49.0, -9.0), (-49.0, -10.0), (-50.0, -10.0)]
+HOLE = [(-49.8, -9.8), (-49.6, -9.8), (-49.6, -9.6), (-49.8, -9.6), (-49.8, -9.8)]
+SECOND_SQUARE = [(-48.0, -10.0), (-48.0, -9.5), (-47.5, -9.5), (-47.5, -10.0), (-48.0, -10.0)]
+
+
+def polygon_content(rings: list) -> bytes:
+    """Encode the content of a polygon record, or of a null shape."""
+
+    if rings is None:
+        return struct.pack("<i", SHP_NULL)
+
+    points = [p for ring in rings for p in ring]
+    xs, ys = [x for x, _ in points], [y for _, y in points]
+    parts, offset = [], 0
+    for ring in rings:
+        parts.append(offset)
+        offset += len(ring)
+
+    return (
+        struct.pack("<i4d2i", SHP_POLYGON, min(xs), min(ys), max(xs), max(ys), len(rings), len(points))
+        + struct.pack(f"<{len(parts)}i", *parts)
+        + b"".join(struct.pack("<2d", x, y) for x, y in points)
+    )
+
+
+def shp_header(file_length: int, bbox: tuple) -> bytes:
+    """Encode the header shared by the .shp and .shx files, with the length in bytes."""
+
+    return struct.pack(">7i", 9994, 0, 0, 0, 0, 0, file_length // 2) + struct.pack("<2i8d", 1000, SHP_POLYGON, *bbox, 0, 0, 0, 0)
+
+
+def dbf_value(value: str, field_type: str) -> bytes:
+    """Encode a date as the text of a D (YYYYMMDD) or C (YYYY-MM-DD) field."""
+
+    if field_type == "D":
+        return (value or "").replace("-", "").ljust(8).encode("ascii")
+    return (value or "").ljust(10).encode("ascii")
+
+
+def write_shapefile(path, features: list, field_type: str = "D", deleted: tuple = ()) -> str:
+    """
+    Write a polygon shapefile in EPSG:4674 with a "name" and a "Date_dt" field.
+    The records at the positions of deleted are flagged as deleted in the .dbf.
+    """
+
+    contents = [polygon_content(rings) for rings, _ in features]
+    points = [p for rings, _ in features if rings for ring in rings for p in ring]
+    bbox = (min(x for x, _ in points), min(y for _, y in points), max(x for x, _ in points), max(y for _, y in points))
+
+    records, index, offset = [], [], 100
+    for number, content in enumerate(contents, start=1):
+        records.append(struct.pack(">2i", number, len(content) // 2) + content)
+        index.append(struct.pack(">2i", offset // 2, len(content) // 2))
+        offset += 8 + len(content)
+
+    stem = str(path)
+    with open(f"{stem}.shp", "wb") as f:
+        f.write(shp_header(offset, bbox) + b"".join(records))
+    with open(f"{stem}.shx", "wb") as f:
+        f.write(shp_header(100 + 8 * len(index), bbox) + b"".join(index))
+    with open(f"{stem}.prj", "w") as f:
+        f.write(CRS.from_epsg(4674).to_wkt("WKT1_ESRI"))
+
+    fields = [("name", "C", 12), ("Date_dt", field_type, 8 if field_type == "D" else 10)]
+    record_length = 1 + sum(length for _, _, length in fields)
+    header_length = 32 + 32 * len(fields) + 1
+    dbf = struct.pack("<B3BIHH20x", 3, 125, 8, 11, len(features), header_length, record_length)
+    for name, kind, length in fields:
+        dbf += struct.pack("<11sc4xBB14x", name.encode("ascii"), kind.encode("ascii"), length, 0)
+    dbf += b"\r"
+    for i, (_, date) in enumerate(features):
+        dbf += (b"*" if i in deleted else b" ") + f"feature {i}".ljust(12).encode("ascii") + dbf_value(date, field_type)
+    with open(f"{stem}.dbf", "wb") as f:
+        f.write(dbf + b"\x1a")
+
+    return f"{stem}.shp"
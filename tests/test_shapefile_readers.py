@@ -0,0 +1,134 @@
+"""
+Check each shapefile reader against gpd.read_file on small synthetic shapefiles, see shapefiles.py.
+"""
+
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+shapely = pytest.importorskip("shapely")
+pyproj = pytest.importorskip("pyproj")
+pytest.importorskip("fiona")
+pytest.importorskip("pyogrio")
+
+from tasks.memmap_shapefile_reader import UnsupportedShapefileError  # noqa: E402
+from tasks.shapefile_parser import READERS, parse_shapefile, to_text_dates  # noqa: E402
+from shapefiles import HOLE, SECOND_SQUARE, SQUARE, write_shapefile  # noqa: E402
+
+FEATURES = [
+    ([SQUARE], "2025-08-11"),
+    ([SQUARE, HOLE], "2025-08-12"),
+    ([SQUARE, SECOND_SQUARE], "2025-08-13"),
+    (None, "2025-08-14"),
+    ([SECOND_SQUARE], None),
+]
+
+
+def assert_same_as_geopandas(filein: str, srid: int, wkb: list, dates: list):
+    """Compare the output of a reader with the features read by gpd.read_file."""
+
+    gdf = gpd.read_file(filein)
+
+    assert len(wkb) == len(gdf)
+    assert srid == gdf.crs.to_epsg()
+    assert dates == to_text_dates(gdf["Date_dt"])
+    for expected, actual in zip(gdf.geometry.values, shapely.from_wkb(wkb)):
+        if expected is None:
+            assert actual is None
+        else:
+            assert shapely.equals(expected, actual)
+            assert shapely.get_num_interior_rings(shapely.get_geometry(expected, 0)) == shapely.get_num_interior_rings(
+                shapely.get_geometry(actual, 0)
+            )
+
+
+@pytest.mark.parametrize("reader", sorted(READERS))
+@pytest.mark.parametrize("field_type", ["D", "C"])
+def test_reader_matches_geopandas(tmp_path, reader, field_type):
+    filein = write_shapefile(tmp_path / "tile", FEATURES, field_type=field_type)
+
+    srid, crs, wkb, dates = READERS[reader](filein)
+
+    assert_same_as_geopandas(filein, srid, wkb, dates)
+    assert pyproj.CRS.from_user_input(crs).equals(pyproj.CRS.from_epsg(4674))
+    # normalize skips the reprojection only when the returned CRS maps back to the SRID
+    assert pyproj.CRS.from_user_input(crs).to_epsg() == srid
+
+
+@pytest.mark.parametrize("reader", sorted(READERS))
+def test_reader_window_matches_geopandas(tmp_path, reader):
+    filein = write_shapefile(tmp_path / "tile", FEATURES)
+
+    srid, _, wkb, dates = READERS[reader](filein, 1, 4)
+    gdf = gpd.read_file(filein, rows=slice(1, 4))
+
+    assert srid == 4674
+    assert dates == to_text_dates(gdf["Date_dt"])
+    assert [g is None for g in gdf.geometry.values] == [g is None for g in wkb]
+
+
+@pytest.mark.parametrize("reader", ["fiona", "pyogrio"])
+def test_reader_skips_deleted_records(tmp_path, reader):
+    filein = write_shapefile(tmp_path / "tile", FEATURES, deleted=(1,))
+
+    srid, _, wkb, dates = READERS[reader](filein)
+
+    assert len(wkb) == len(FEATURES) - 1
+    assert_same_as_geopandas(filein, srid, wkb, dates)
+
+
+def test_memmap_falls_back_on_deleted_records(tmp_path):
+    filein = write_shapefile(tmp_path / "tile", FEATURES, deleted=(1,))
+
+    with pytest.raises(UnsupportedShapefileError):
+        READERS["memmap"](filein)
+
+    parsed = parse_shapefile(filein, reader="memmap")
+    gdf = gpd.read_file(filein)
+
+    assert parsed["reader"].startswith("fiona")
+    assert parsed["rows"] == len(gdf)
+    assert parsed["dates"] == to_text_dates(gdf["Date_dt"])
+
+
+@pytest.mark.parametrize("reader", sorted(READERS))
+def test_parsed_shapefile_matches_geopandas(tmp_path, reader):
+    filein = write_shapefile(tmp_path / "tile", FEATURES)
+
+    parsed = parse_shapefile(filein, reader=reader)
+    gdf = gpd.read_file(filein)
+
+    assert parsed["srid"] == gdf.crs.to_epsg()
+    assert parsed["dates"] == to_text_dates(gdf["Date_dt"])
+    for expected, actual in zip(gdf.geometry.values, shapely.from_wkb(parsed["wkb"])):
+        if expected is None:
+            assert actual is None
+        else:
+            assert shapely.get_type_id(actual) == shapely.GeometryType.MULTIPOLYGON
+            assert shapely.equals(expected, actual)
+
+
+def test_geodesic_area_km_matches_the_ellipsoid():
+    """The area computed over whole arrays agrees with the geodesic area of pyproj, per geometry."""
+
+    import numpy as np
+
+    from tasks.shapefile_parser import TARGET_SRID, geodesic_area_km
+
+    square = shapely.Polygon([(-60.0, -10.0), (-59.9, -10.0), (-59.9, -9.9), (-60.0, -9.9)])
+    holed = shapely.Polygon(square.exterior, [[(-59.98, -9.98), (-59.95, -9.98), (-59.95, -9.95)]])
+    multi = shapely.MultiPolygon([square, shapely.affinity.translate(holed, 0.5, -20.0)])
+    geometries = np.array([square, holed, multi, shapely.Polygon()], dtype=object)
+
+    geod = pyproj.CRS.from_epsg(TARGET_SRID).get_geod()
+
+    def ring_area(ring):
+        return abs(geod.geometry_area_perimeter(shapely.Polygon(ring))[0])
+
+    # pyproj adds the holes unless they wind opposite to their exterior, so each ring is measured apart
+    expected = [
+        sum(ring_area(p.exterior) - sum(ring_area(r) for r in p.interiors) for p in shapely.get_parts(g) if not p.is_empty)
+        / 1_000_000
+        for g in geometries
+    ]
+
+    assert geodesic_area_km(geometries) == pytest.approx(expected, rel=1e-6)